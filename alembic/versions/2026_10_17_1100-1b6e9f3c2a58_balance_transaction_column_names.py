@@ -0,0 +1,52 @@
+"""balance and transaction column names
+
+Revision ID: 1b6e9f3c2a58
+Revises:
+Create Date: 2026-10-17 11:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = '1b6e9f3c2a58'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Таблицы, созданные по старым моделям, называли столбцы иначе, чем CRUD и схемы API:
+# (таблица, старое имя, новое имя)
+RENAMES = [
+    ('balance', 'user', 'user_id'),
+    ('balance', 'total_amount', 'amount'),
+    ('balance', 'locked_amount', 'blocked_amount'),
+    ('transaction', 'user', 'user_id'),
+    ('transaction', 'created_at', 'timestamp'),
+]
+
+
+def _rename(table: str, old: str, new: str) -> None:
+    """Переименование столбца, если он ещё называется по-старому"""
+    op.execute(f"""
+        DO $$
+        BEGIN
+            IF EXISTS (
+                SELECT 1 FROM information_schema.columns
+                WHERE table_schema = current_schema() AND table_name = '{table}' AND column_name = '{old}'
+            ) THEN
+                ALTER TABLE "{table}" RENAME COLUMN "{old}" TO "{new}";
+            END IF;
+        END $$
+    """)
+
+
+def upgrade() -> None:
+    for table, old, new in RENAMES:
+        _rename(table, old, new)
+
+
+def downgrade() -> None:
+    for table, old, new in reversed(RENAMES):
+        _rename(table, new, old)
@@ -0,0 +1,55 @@
+"""order indexes
+
+Revision ID: 3f9c1a2b7d41
+Revises: 1b6e9f3c2a58
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = '3f9c1a2b7d41'
+down_revision: Union[str, None] = '1b6e9f3c2a58'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # CONCURRENTLY нельзя выполнять внутри транзакции, зато таблица заявок
+    # не блокируется на запись на время построения индексов
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_order_active_book',
+            'order',
+            ['ticker', 'direction', 'price', 'created_at'],
+            postgresql_where="status IN ('NEW', 'PARTIALLY_EXECUTED')",
+            postgresql_include=['id', 'user_id', 'qty', 'filled'],
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+        op.create_index(
+            'ix_order_user_id',
+            'order',
+            ['user_id'],
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_order_user_id',
+            table_name='order',
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
+        op.drop_index(
+            'ix_order_active_book',
+            table_name='order',
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
@@ -0,0 +1,65 @@
+"""order keyset indexes
+
+Revision ID: 8b2e4d6f1a90
+Revises: 3f9c1a2b7d41
+Create Date: 2026-10-17 13:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = '8b2e4d6f1a90'
+down_revision: Union[str, None] = '3f9c1a2b7d41'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_order_created_at_id',
+            'order',
+            ['created_at', 'id'],
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+        # Покрывает и поиск заявок пользователя, поэтому индекс по одному user_id больше не нужен
+        op.create_index(
+            'ix_order_user_id_created_at',
+            'order',
+            ['user_id', 'created_at', 'id'],
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+        op.drop_index(
+            'ix_order_user_id',
+            table_name='order',
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_order_user_id',
+            'order',
+            ['user_id'],
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+        op.drop_index(
+            'ix_order_user_id_created_at',
+            table_name='order',
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
+        op.drop_index(
+            'ix_order_created_at_id',
+            table_name='order',
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
@@ -0,0 +1,40 @@
+"""transaction ticker time index
+
+Revision ID: c4d7a9e2b315
+Revises: 8b2e4d6f1a90
+Create Date: 2026-10-17 14:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4d7a9e2b315'
+down_revision: Union[str, None] = '8b2e4d6f1a90'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Лента сделок по тикеру и выгрузка за период читают индекс по порядку,
+    # без сортировки всей таблицы
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_transaction_ticker_timestamp',
+            'transaction',
+            ['ticker', 'timestamp', 'id'],
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_transaction_ticker_timestamp',
+            table_name='transaction',
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
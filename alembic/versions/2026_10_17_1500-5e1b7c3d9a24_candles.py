@@ -0,0 +1,44 @@
+"""candles
+
+Revision ID: 5e1b7c3d9a24
+Revises: c4d7a9e2b315
+Create Date: 2026-10-17 15:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = '5e1b7c3d9a24'
+down_revision: Union[str, None] = 'c4d7a9e2b315'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Таблица пустая: свечи по накопленной истории строит `python -m app.jobs.candles`
+    op.create_table(
+        'candle',
+        sa.Column('ticker', sa.String(), nullable=False),
+        sa.Column('interval', sa.String(), nullable=False),
+        sa.Column('start', postgresql.TIMESTAMP(timezone=True), nullable=False),
+        sa.Column('open', sa.Integer(), nullable=False),
+        sa.Column('high', sa.Integer(), nullable=False),
+        sa.Column('low', sa.Integer(), nullable=False),
+        sa.Column('close', sa.Integer(), nullable=False),
+        sa.Column('volume', sa.BigInteger(), nullable=False),
+        sa.Column('trades', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ['ticker'], ['instrument.ticker'],
+            name=op.f('fk_candle_ticker_instrument'), ondelete='CASCADE',
+        ),
+        sa.PrimaryKeyConstraint('ticker', 'interval', 'start', name=op.f('pk_candle')),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('candle')
@@ -0,0 +1,97 @@
+"""partition transaction by month
+
+Revision ID: a7c2e5f80b16
+Revises: 5e1b7c3d9a24
+Create Date: 2026-10-17 16:00:00.000000
+
+"""
+
+from datetime import datetime, timezone
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7c2e5f80b16'
+down_revision: Union[str, None] = '5e1b7c3d9a24'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Секции создаются на столько месяцев вперёд, дальше их создаёт app/jobs/partitions.py
+MONTHS_AHEAD = 2
+
+
+def _month(timestamp: datetime, months: int = 0) -> datetime:
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc)
+    index = timestamp.year * 12 + timestamp.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def _copy_table(target: str, partition_by: str = '') -> None:
+    """
+    Новая таблица со столбцами и внешними ключами таблицы сделок
+
+    Столбцы берутся из существующей таблицы, а не перечисляются здесь,
+    поэтому миграция не зависит от того, как они названы в модели.
+    """
+    op.execute(
+        f'CREATE TABLE {target} (LIKE "transaction" INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'
+        f'{partition_by}'
+    )
+    op.execute(f"""
+        DO $$
+        DECLARE fk record;
+        BEGIN
+            FOR fk IN
+                SELECT conname, pg_get_constraintdef(oid) AS definition FROM pg_constraint
+                WHERE conrelid = '"transaction"'::regclass AND contype = 'f'
+            LOOP
+                EXECUTE format('ALTER TABLE {target} ADD CONSTRAINT %I %s', fk.conname, fk.definition);
+            END LOOP;
+        END $$
+    """)
+
+
+def _replace_table(source: str) -> None:
+    """Переносит сделки в новую таблицу и ставит её на место старой"""
+    op.execute(f'INSERT INTO {source} SELECT * FROM "transaction"')
+    op.execute('DROP TABLE "transaction"')
+    op.execute(f'ALTER TABLE {source} RENAME TO "transaction"')
+    op.execute(f'ALTER TABLE "transaction" RENAME CONSTRAINT pk_{source} TO pk_transaction')
+    op.create_index('ix_transaction_ticker_timestamp', 'transaction', ['ticker', 'timestamp', 'id'])
+
+
+def upgrade() -> None:
+    # Таблица переписывается целиком: на время миграции запись сделок заблокирована,
+    # чтение остаётся доступным
+    op.execute('LOCK TABLE "transaction" IN EXCLUSIVE MODE')
+    oldest = op.get_bind().execute(sa.text('SELECT min("timestamp") FROM "transaction"')).scalar()
+    now = datetime.now(timezone.utc)
+
+    # Ключ секционирования обязан входить в первичный ключ
+    _copy_table('transaction_partitioned', ' PARTITION BY RANGE ("timestamp")')
+    op.execute(
+        'ALTER TABLE transaction_partitioned '
+        'ADD CONSTRAINT pk_transaction_partitioned PRIMARY KEY (id, "timestamp")'
+    )
+    month = _month(oldest or now)
+    while month <= _month(now, MONTHS_AHEAD):
+        following = _month(month, 1)
+        op.execute(
+            f'CREATE TABLE transaction_{month.year:04d}_{month.month:02d} '
+            f'PARTITION OF transaction_partitioned '
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{following.isoformat()}')"
+        )
+        month = following
+    _replace_table('transaction_partitioned')
+
+
+def downgrade() -> None:
+    # Выгруженные в архив секции не возвращаются
+    op.execute('LOCK TABLE "transaction" IN EXCLUSIVE MODE')
+    _copy_table('transaction_plain')
+    op.execute('ALTER TABLE transaction_plain ADD CONSTRAINT pk_transaction_plain PRIMARY KEY (id)')
+    # Секции удаляются вместе с секционированной таблицей
+    _replace_table('transaction_plain')
@@ -0,0 +1,58 @@
+"""order history
+
+Revision ID: d3f8b6a41c57
+Revises: a7c2e5f80b16
+Create Date: 2026-10-17 17:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = 'd3f8b6a41c57'
+down_revision: Union[str, None] = 'a7c2e5f80b16'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Накопленные завершённые заявки переносит `python -m app.jobs.orders` пачками,
+    # а не миграция одной долгой транзакцией
+    op.create_table(
+        'order_history',
+        sa.Column('id', sa.String(), nullable=False),
+        sa.Column('status', postgresql.ENUM(name='status', create_type=False), nullable=False),
+        sa.Column('user_id', postgresql.UUID(as_uuid=False), nullable=False),
+        sa.Column('direction', postgresql.ENUM(name='direction', create_type=False), nullable=False),
+        sa.Column('ticker', sa.String(), nullable=False),
+        sa.Column('qty', sa.Integer(), nullable=False),
+        sa.Column('price', sa.Integer(), nullable=True),
+        sa.Column('filled', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), nullable=False),
+        sa.ForeignKeyConstraint(
+            ['user_id'], ['user.id'],
+            name=op.f('fk_order_history_user_id_user'), ondelete='CASCADE',
+        ),
+        sa.ForeignKeyConstraint(
+            ['ticker'], ['instrument.ticker'],
+            name=op.f('fk_order_history_ticker_instrument'), ondelete='CASCADE',
+        ),
+        sa.PrimaryKeyConstraint('id', name=op.f('pk_order_history')),
+    )
+    op.create_index('ix_order_history_created_at_id', 'order_history', ['created_at', 'id'])
+    op.create_index('ix_order_history_user_id_created_at', 'order_history', ['user_id', 'created_at', 'id'])
+
+
+def downgrade() -> None:
+    # Заявки возвращаются в order, иначе история потеряется вместе с таблицей
+    op.execute(
+        'INSERT INTO "order" (id, status, user_id, direction, ticker, qty, price, filled, created_at) '
+        'SELECT id, status, user_id, direction, ticker, qty, price, filled, created_at FROM order_history'
+    )
+    op.drop_index('ix_order_history_user_id_created_at', table_name='order_history')
+    op.drop_index('ix_order_history_created_at_id', table_name='order_history')
+    op.drop_table('order_history')
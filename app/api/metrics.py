@@ -0,0 +1,20 @@
+from fastapi import APIRouter, Response
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, generate_latest
+
+router = APIRouter()
+
+
+@router.get(
+    '/metrics',
+    response_class=Response,
+    summary='Метрики в текстовом формате Prometheus',
+    tags=['metrics'],
+    include_in_schema=False,
+)
+async def get_metrics() -> Response:
+    # Тип задаётся заголовком: media_type с text/ получил бы второй charset
+    return Response(generate_latest(REGISTRY), headers={'Content-Type': CONTENT_TYPE_LATEST})
+
+
+# Опросы метрик не пишем в лог запросов
+get_metrics._no_log = True
@@ -7,7 +7,10 @@ from app.api.v1.admin.user import router as admin_user_router
 from app.api.v1.instrument import router as instrument_router
 from app.api.v1.order import router as order_router
 from app.api.v1.admin.instrument import router as admin_instrument_router
+from app.api.v1.admin.transaction import router as admin_transaction_router
 from app.api.v1.orderbook import router as orderbook_router
+from app.api.v1.market_data import router as market_data_router
+from app.api.v1.candle import router as candle_router
 
 router = APIRouter(prefix="/api/v1")
 
@@ -15,7 +18,10 @@ router.include_router(instrument_router)
 router.include_router(balance_router)
 router.include_router(order_router)
 router.include_router(orderbook_router)
+router.include_router(market_data_router)
+router.include_router(candle_router)
 
 router.include_router(user_router)
 router.include_router(admin_user_router)
 router.include_router(admin_instrument_router)
+router.include_router(admin_transaction_router)
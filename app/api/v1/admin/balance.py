@@ -64,6 +64,8 @@ async def deposit_to_balance(
             amount=body.amount,
             async_session=session,
         )
+        # Фиксируем до ответа: завершение зависимости выполняется уже после отправки ответа
+        await session.commit()
         return OkResponse()
     except ValueError as e:
         raise HTTPException(status_code=422, detail=str(e))
@@ -93,6 +95,8 @@ async def withdraw_from_balance(
             amount=body.amount,
             async_session=session,
         )
+        # Фиксируем до ответа: завершение зависимости выполняется уже после отправки ответа
+        await session.commit()
         return OkResponse()
     except ValueError as e:
         raise HTTPException(status_code=422, detail=str(e))
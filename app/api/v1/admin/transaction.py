@@ -0,0 +1,81 @@
+import csv
+import io
+from datetime import datetime
+from typing import AsyncIterator, Literal, Optional, Sequence
+
+import orjson
+from fastapi import APIRouter, Depends, Path, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy import Row
+
+from app.core.auth import for_admin
+from app.core.db import AsyncSessionLocal
+from app.crud.v1.transaction import as_utc, transaction_crud
+
+router = APIRouter()
+
+CSV_HEADER = ('id', 'ticker', 'amount', 'price', 'timestamp')
+
+
+def _format_ndjson(rows: Sequence[Row]) -> bytes:
+    return b''.join(
+        orjson.dumps({
+            'id': str(row.id),
+            'ticker': row.ticker,
+            'amount': row.amount,
+            'price': row.price,
+            'timestamp': as_utc(row.timestamp),
+        }) + b'\n'
+        for row in rows
+    )
+
+
+def _format_csv(rows: Sequence[Row]) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(
+        (row.id, row.ticker, row.amount, row.price, as_utc(row.timestamp).isoformat())
+        for row in rows
+    )
+    return buffer.getvalue()
+
+
+async def _export(ticker: str, start: datetime | None, end: datetime | None,
+                  format: str) -> AsyncIterator[bytes | str]:
+    # Своя сессия на время выгрузки: курсор живёт, пока ответ отдаётся клиенту
+    async with AsyncSessionLocal() as session:
+        if format == 'csv':
+            yield ','.join(CSV_HEADER) + '\r\n'
+        formatter = _format_csv if format == 'csv' else _format_ndjson
+        async for rows in transaction_crud.stream_transactions(ticker, session, start=start, end=end):
+            yield formatter(rows)
+
+
+@router.get(
+    '/admin/transactions/{ticker}/export',
+    summary='Выгрузка всех сделок по тикеру за период',
+    tags=['admin'],
+    dependencies=[Depends(for_admin)],
+    response_class=StreamingResponse,
+    responses={
+        200: {
+            'description': 'NDJSON (одна сделка на строку) или CSV с заголовком, в порядке времени',
+            'content': {'application/x-ndjson': {}, 'text/csv': {}},
+        },
+    },
+)
+async def export_transactions(
+        ticker: str = Path(..., description='Тикер инструмента'),
+        start: Optional[datetime] = Query(None, description='Начало периода (включительно)'),
+        end: Optional[datetime] = Query(None, description='Конец периода (не включительно)'),
+        format: Literal['ndjson', 'csv'] = Query('ndjson', description='Формат выгрузки'),
+) -> StreamingResponse:
+    media_type = 'text/csv' if format == 'csv' else 'application/x-ndjson'
+    return StreamingResponse(
+        _export(ticker, start, end, format),
+        media_type=media_type,
+        headers={'Content-Disposition': f'attachment; filename="transactions_{ticker}.{format}"'},
+    )
+
+
+# Выгрузка длится столько, сколько сделок за период: в длительность запросов идёт время до первого байта
+export_transactions._streaming = True
@@ -3,7 +3,7 @@ from uuid import UUID
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.core.auth import for_admin
+from app.core.auth import auth_cache, for_admin
 from app.core.db import get_async_session
 from app.crud.v1.user import user_crud
 from app.models import ErrorMessage
@@ -39,3 +39,21 @@ async def delete_user(
         return User.from_orm(deleted_user)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Внутренняя ошибка сервера delete_user: {str(e)}")
+
+
+@router.get(
+    '/admin/auth/cache',
+    summary='Статистика кэша авторизации',
+    tags=['admin'],
+    dependencies=[Depends(for_admin)],
+    responses={
+        200: {
+            'description': 'Successful Response',
+            'content': {
+                'application/json': {'example': {'hits': 1500, 'misses': 12, 'size': 10}}
+            },
+        },
+    },
+)
+async def get_auth_cache_stats() -> dict[str, int]:
+    return auth_cache.stats()
@@ -0,0 +1,36 @@
+from datetime import datetime
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Path, Query, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.db import get_async_session
+from app.crud.v1.candle import candle_crud
+from app.models.candle import CandleInterval
+from app.schemas.candle import CandleResponse
+
+router = APIRouter()
+
+
+@router.get(
+    '/public/candles/{ticker}',
+    response_model=list[CandleResponse],
+    summary='Получение свечей',
+    tags=['public'],
+)
+async def get_candles(
+    ticker: str = Path(..., description='Тикер инструмента'),
+    interval: CandleInterval = Query(CandleInterval.M1, description='Интервал свечи'),
+    start: Optional[datetime] = Query(None, description='Начало периода (включительно), UTC'),
+    end: Optional[datetime] = Query(None, description='Конец периода (не включительно), UTC'),
+    limit: Optional[int] = Query(
+        100, ge=1, le=1000, description='Максимальное количество свечей'
+    ),
+    session: AsyncSession = Depends(get_async_session),
+):
+    try:
+        return await candle_crud.get_candles(
+            ticker=ticker, interval=interval, session=session, start=start, end=end, limit=limit
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Внутренняя ошибка сервера get_candles: {str(e)}")
@@ -0,0 +1,67 @@
+import asyncio
+
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, status
+
+from app.core.db import AsyncSessionLocal
+from app.crud.v1.instrument import instrument_crud
+from app.crud.v1.order.market_feed import RESYNC, Subscription, market_feed
+
+router = APIRouter()
+
+
+async def _send_updates(websocket: WebSocket, subscription: Subscription) -> None:
+    last_seq = -1
+    message = RESYNC
+    while True:
+        if message is RESYNC:
+            last_seq, snapshot = await market_feed.snapshot(subscription.ticker)
+            await websocket.send_text(snapshot)
+        else:
+            seq, text = message
+            # Обновления, уже учтённые в снимке, пропускаем
+            if seq > last_seq:
+                await websocket.send_text(text)
+                last_seq = seq
+        message = await subscription.queue.get()
+
+
+async def _wait_disconnect(websocket: WebSocket) -> None:
+    while True:
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            return
+
+
+@router.websocket('/public/ws/{ticker}')
+async def market_data_stream(websocket: WebSocket, ticker: str):
+    """
+    Поток рыночных данных по тикеру.
+
+    Первое сообщение - снимок стакана `{"type": "snapshot", "seq", "bids", "asks"}`,
+    далее обновления `{"type": "update", "seq", "bids", "asks", "trades"}` с новыми
+    остатками затронутых уровней (qty=0 - уровень исчез) и сделками. Номера
+    обновлений идут подряд; новый снимок приходит, если стакан был перечитан
+    из БД или клиент не успевал читать.
+    """
+    async with AsyncSessionLocal() as session:
+        instrument = await instrument_crud.get(ticker, session)
+    if instrument is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason='Инструмент не найден')
+        return
+
+    await websocket.accept()
+    # Подписываемся до снимка, чтобы не потерять обновления между ними
+    subscription = market_feed.subscribe(ticker)
+    sender = asyncio.create_task(_send_updates(websocket, subscription))
+    receiver = asyncio.create_task(_wait_disconnect(websocket))
+    try:
+        done, _ = await asyncio.wait({sender, receiver}, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            # Пробрасываем ошибку отправки; разрыв соединения - штатное завершение
+            task.result()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        sender.cancel()
+        receiver.cancel()
+        market_feed.unsubscribe(subscription)
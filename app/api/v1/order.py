@@ -1,15 +1,22 @@
+import asyncio
+from functools import partial
 from typing import Union, List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, Path, Query
+from fastapi import APIRouter, Body, Depends, HTTPException, Path, Query, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.auth import for_admin, get_user
+from app.core.config import settings
 from app.core.db import get_async_session
 from app.core.enums import UserRole
-from app.crud.v1.order import order_crud
+from app.crud.v1.instrument import instrument_crud
+from app.crud.v1.order import order_crud, order_sequencer
+from app.crud.v1.order.order_events import RESYNC, OrderSubscription, order_events
 from app.models.order import Status
 from app.models.user import User
 from app.schemas.order import (
+    BatchOrderResult,
     LimitOrderBody,
     MarketOrderBody,
     OrderResponse,
@@ -34,17 +41,27 @@ async def create_order(
 ):
     try:
         price = getattr(body, 'price', None)
-        
-        order = await order_crud.create_order(
-            user_id=user.id,
-            direction=body.direction,
-            ticker=body.ticker,
-            qty=body.qty,
-            price=price,
-            session=session
+
+        # Очередь тикера создаётся при первой операции, поэтому тикер проверяется
+        # до постановки в очередь: иначе любой тикер из запроса заводил бы свою очередь
+        if not await instrument_crud.exists(body.ticker, session):
+            raise ValueError('Инструмент не найден')
+        await session.rollback()
+
+        # Заявка исполняется в очереди своего тикера, в отдельной сессии
+        sequenced = await order_sequencer.submit(
+            body.ticker,
+            partial(
+                order_crud.create_order,
+                user_id=user.id,
+                direction=body.direction,
+                ticker=body.ticker,
+                qty=body.qty,
+                price=price,
+            )
         )
-        
-        return OrderResponse(success=True, order_id=order.id)
+
+        return OrderResponse(success=True, order_id=sequenced.result.id)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
@@ -52,6 +69,76 @@ async def create_order(
         raise HTTPException(status_code=500, detail=f'Внутренняя ошибка сервера create_order: {str(e)}')
 
 
+def _batch_result(result) -> BatchOrderResult:
+    if isinstance(result, ValueError):
+        return BatchOrderResult(success=False, error=str(result))
+    if isinstance(result, Exception):
+        return BatchOrderResult(success=False, error=f'Внутренняя ошибка сервера create_orders_batch: {str(result)}')
+    return BatchOrderResult(success=True, order_id=result.id)
+
+
+@router.post(
+    '/orders/batch',
+    response_model=List[BatchOrderResult],
+    summary='Создание нескольких заявок',
+    tags=['order'],
+)
+async def create_orders_batch(
+        body: List[Union[LimitOrderBody, MarketOrderBody]] = Body(
+            ..., min_items=1, max_items=settings.orders.batch_max_size,
+            description='Заявки в порядке выставления',
+        ),
+        session: AsyncSession = Depends(get_async_session),
+        user: User = Depends(get_user),
+):
+    try:
+        orders = [(order.ticker, order.direction, order.qty, getattr(order, 'price', None)) for order in body]
+
+        # Балансы всей пачки проверяются одним запросом; не прошедшие проверку
+        # заявки не попадают в очереди тикеров
+        results: list = await order_crud.check_balances(user.id, orders, session)
+        # Заявки по несуществующим инструментам не доходят до очередей тикеров
+        unknown = {ticker for ticker in {order[0] for order in orders}
+                   if not await instrument_crud.exists(ticker, session)}
+        for i, (ticker, *_) in enumerate(orders):
+            if ticker in unknown:
+                results[i] = ValueError('Инструмент не найден')
+        # Соединение проверки возвращается в пул, заявки выставляются в сессиях очередей
+        await session.rollback()
+
+        # Заявки одного тикера выставляются одной операцией его очереди (одна транзакция,
+        # порядок заявок сохраняется), разные тикеры - параллельно
+        groups: dict[str, list[int]] = {}
+        for i, error in enumerate(results):
+            if error is None:
+                groups.setdefault(orders[i][0], []).append(i)
+        outcomes = await asyncio.gather(
+            *(
+                order_sequencer.submit(
+                    ticker,
+                    partial(
+                        order_crud.create_orders,
+                        user_id=user.id,
+                        ticker=ticker,
+                        orders=[orders[i][1:] for i in indexes],
+                    )
+                )
+                for ticker, indexes in groups.items()
+            ),
+            return_exceptions=True,
+        )
+
+        for (ticker, indexes), outcome in zip(groups.items(), outcomes):
+            # Операция тикера упала целиком - ни одна её заявка не зафиксирована
+            created = [outcome] * len(indexes) if isinstance(outcome, Exception) else outcome.result
+            for i, result in zip(indexes, created):
+                results[i] = result
+
+        return [_batch_result(result) for result in results]
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f'Внутренняя ошибка сервера create_orders_batch: {str(e)}')
+
+
 @router.delete(
     '/order/{order_id}',
     response_model=CancelOrderResponse,
@@ -75,13 +162,13 @@ async def cancel_order(
         if order.user_id != user.id and not is_admin:
             raise ValueError(f'Нет доступа к заявке у пользователя {user.id} роль = {user.role}')
 
-        # Отменяем заявку
-        updated_order = await order_crud.cancel_order(
-            order_id=order_id,
-            session=session
+        # Отменяем заявку через очередь тикера, чтобы не гоняться с исполнением
+        sequenced = await order_sequencer.submit(
+            order.ticker,
+            partial(order_crud.cancel_order, order_id=order_id)
         )
 
-        return CancelOrderResponse(success=True, order_id=updated_order.id)
+        return CancelOrderResponse(success=True, order_id=sequenced.result.id)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
@@ -95,8 +182,11 @@ async def cancel_order(
     tags=['order'],
 )
 async def get_all_orders(
+        response: Response,
         limit: Optional[int] = Query(100, ge=1, le=1000, description="Максимальное количество заявок"),
-        offset: Optional[int] = Query(0, ge=0, description="Смещение от начала списка"),
+        cursor: Optional[str] = Query(None, description="Курсор страницы из заголовка X-Next-Cursor прошлого ответа"),
+        offset: Optional[int] = Query(0, ge=0, deprecated=True,
+                                      description="Смещение от начала списка, вместо него используйте cursor"),
         session: AsyncSession = Depends(get_async_session),
         user: User = Depends(get_user),
 ):
@@ -104,8 +194,13 @@ async def get_all_orders(
         db_orders = await order_crud.get_all_orders(
             session=session,
             limit=limit,
-            offset=offset
+            offset=offset,
+            cursor=cursor,
         )
+        # Заявки отдаются от новых к старым; следующая страница - по курсору из заголовка
+        next_cursor = order_crud.next_cursor(db_orders, limit)
+        if next_cursor is not None:
+            response.headers['X-Next-Cursor'] = next_cursor
 
         orders = []
         for order in db_orders:
@@ -126,10 +221,60 @@ async def get_all_orders(
             ))
 
         return orders
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Внутренняя ошибка сервера get_all_orders: {str(e)}")
 
 
+async def _order_event_stream(subscription: OrderSubscription):
+    try:
+        # Первое сообщение сразу отправляет заголовки ответа клиенту
+        yield ': connected\n\n'
+        while True:
+            try:
+                message = await asyncio.wait_for(
+                    subscription.queue.get(), timeout=settings.market_data.heartbeat_interval
+                )
+            except asyncio.TimeoutError:
+                yield ': ping\n\n'
+                continue
+            if message is RESYNC:
+                yield 'event: resync\ndata: {}\n\n'
+                continue
+            seq, data = message
+            yield f'id: {seq}\nevent: order\ndata: {data}\n\n'
+    finally:
+        order_events.unsubscribe(subscription)
+
+
+# Объявлен до '/order/{order_id}', иначе путь будет принят за идентификатор заявки
+@router.get(
+    '/order/stream',
+    summary='Поток изменений заявок пользователя (Server-Sent Events)',
+    tags=['order'],
+    response_class=StreamingResponse,
+    responses={
+        200: {
+            'description': 'События `order` с полями order_id, ticker, status, filled, qty. '
+                           'Событие `resync` - часть событий потеряна, заявки нужно перечитать через GET /order',
+            'content': {'text/event-stream': {}},
+        },
+    },
+)
+async def stream_orders(user: User = Depends(get_user)) -> StreamingResponse:
+    subscription = order_events.subscribe(user.id)
+    return StreamingResponse(
+        _order_event_stream(subscription),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
+# Поток открыт, пока подключён клиент: в длительность запросов идёт время до первого байта
+stream_orders._streaming = True
+
+
 @router.get(
     '/order/{order_id}',
     response_model=OrderDetailResponse,
@@ -1,15 +1,100 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
 from fastapi import Depends, HTTPException, status
 from fastapi.security import APIKeyHeader
-from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 
-from app.core.db import get_async_session
+from app.core.config import settings
+from app.core.db import AsyncSessionLocal
+from app.core.metrics import register_callback
 from app.models import User
 from app.core.enums import UserRole
 
 auth_header = APIKeyHeader(name="Authorization", auto_error=True)
 
 
+@dataclass(slots=True, frozen=True)
+class CachedUser:
+    """Поля пользователя, нужные для авторизации и профиля"""
+    id: str
+    name: str
+    role: UserRole
+    api_key: str
+    is_deleted: bool
+    expires_at: float
+
+
+class AuthCache:
+    """
+    Кэш пользователей по API-ключу с ограниченным временем жизни и вытеснением
+    давно не использованных записей (LRU).
+
+    Кэш живёт в памяти процесса: удаление пользователя через `user_crud.remove`
+    сбрасывает запись сразу, изменения в обход приложения видны не позже чем
+    через `ttl` секунд.
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, CachedUser] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, api_key: str) -> CachedUser | None:
+        entry = self._entries.get(api_key)
+        if entry is None or entry.expires_at <= time.monotonic():
+            self.misses += 1
+            return None
+        self._entries.move_to_end(api_key)
+        self.hits += 1
+        return entry
+
+    def put(self, user: User) -> CachedUser:
+        entry = self._entries[user.api_key] = CachedUser(
+            id=user.id,
+            name=user.name,
+            role=user.role,
+            api_key=user.api_key,
+            is_deleted=bool(user.is_deleted),
+            expires_at=time.monotonic() + self.ttl,
+        )
+        self._entries.move_to_end(user.api_key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, api_key: str) -> None:
+        self._entries.pop(api_key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+
+auth_cache = AuthCache(ttl=settings.auth.cache_ttl, max_size=settings.auth.cache_size)
+
+register_callback(
+    'auth_cache_requests_total',
+    'Обращения к кэшу авторизации',
+    lambda: [(('hit',), auth_cache.hits), (('miss',), auth_cache.misses)],
+    labelnames=('result',),
+    type='counter',
+)
+register_callback(
+    'auth_cache_size',
+    'Количество пользователей в кэше авторизации',
+    lambda: [((), len(auth_cache))],
+)
+
+
 async def get_api_key(api_key_header: str = Depends(auth_header)) -> str:
     try:
         scheme, _, key = api_key_header.partition(" ")
@@ -23,21 +108,30 @@ async def get_api_key(api_key_header: str = Depends(auth_header)) -> str:
         )
 
 
-async def get_user(
-    token: str = Depends(get_api_key),
-    db_session: AsyncSession = Depends(get_async_session),
-) -> User:
-    query = select(User).where(User.api_key == token)
-    result = await db_session.execute(query)
-    db_user = result.scalars().first()
+async def get_user(token: str = Depends(get_api_key)) -> User:
+    cached = auth_cache.get(token)
+    if cached is None:
+        # Сессия открывается только при промахе - на прогретом кэше авторизация не ходит в БД
+        async with AsyncSessionLocal() as db_session:
+            query = select(User).where(User.api_key == token)
+            result = await db_session.execute(query)
+            db_user = result.scalars().first()
+        if db_user is not None:
+            cached = auth_cache.put(db_user)
 
-    if not db_user or db_user.is_deleted:
+    if not cached or cached.is_deleted:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Неверный или отсутствующий API ключ"
         )
 
-    return db_user
+    return User(
+        id=cached.id,
+        name=cached.name,
+        role=cached.role,
+        api_key=cached.api_key,
+        is_deleted=cached.is_deleted,
+    )
 
 
 async def for_admin(user: User = Depends(get_user)) -> User:
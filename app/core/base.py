@@ -2,3 +2,8 @@
 
 from app.core.db import Base  # noqa: F401
 from app.models.user import User  # noqa: F401
+from app.models.balance import Balance  # noqa: F401
+from app.models.instrument import Instrument  # noqa: F401
+from app.models.order import Order, OrderHistory  # noqa: F401
+from app.models.transaction import Transaction  # noqa: F401
+from app.models.candle import Candle  # noqa: F401
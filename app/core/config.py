@@ -1,10 +1,59 @@
-from typing import Any
+from typing import Any, Literal
 
 from pydantic import BaseModel, BaseSettings, PostgresDsn, root_validator
 
 
 class AppConfig(BaseModel):
     workers: int = 4
+    # Отладочный режим: статистика запросов к БД в заголовке X-DB-Stats
+    debug: bool = False
+
+
+class AuthConfig(BaseModel):
+    # Сколько секунд пользователь по API-ключу берётся из кэша без запроса в БД
+    cache_ttl: float = 60.0
+    cache_size: int = 10_000
+
+
+class LoggingConfig(BaseModel):
+    # Доля запросов, которые логируются целиком (ошибки логируются всегда)
+    sample_rate: float = 1.0
+    # Сколько байт тела запроса и ответа попадает в лог
+    max_body_size: int = 2048
+    # Формат записей лога: text - строка, json - одна JSON-запись на строку
+    format: Literal['text', 'json'] = 'text'
+    # Уровень канала трассировки сопоставления заявок (DEBUG - включить трассировку)
+    matching_level: str = 'INFO'
+
+
+class MarketDataConfig(BaseModel):
+    # Сколько обновлений может ждать отправки одному подписчику, дальше - новый снимок
+    max_pending: int = 1000
+    # Как часто (в секундах) слать keep-alive в поток событий по заявкам
+    heartbeat_interval: float = 15.0
+
+
+class PartitionsConfig(BaseModel):
+    # На сколько месяцев вперёд держать созданные секции таблицы сделок
+    months_ahead: int = 2
+    # Как часто (в секундах) приложение проверяет, что секции созданы
+    check_interval: float = 6 * 3600
+    # Секции старше стольких месяцев выгружаются в архив командой archive
+    archive_after_months: int = 12
+    # Каталог для сжатых выгрузок секций
+    archive_dir: str = 'archive'
+
+
+class OrdersConfig(BaseModel):
+    # Сколько заявок можно передать в POST /orders/batch одним запросом
+    batch_max_size: int = 500
+
+
+class OrderHistoryConfig(BaseModel):
+    # Как часто (в секундах) завершённые заявки переносятся из order в order_history
+    compaction_interval: float = 60.0
+    # Сколько заявок переносится одной транзакцией
+    batch_size: int = 1000
 
 
 class DB(BaseModel):
@@ -32,6 +81,12 @@ class DB(BaseModel):
 
 class Settings(BaseSettings):
     app: AppConfig = AppConfig()
+    auth: AuthConfig = AuthConfig()
+    logging: LoggingConfig = LoggingConfig()
+    market_data: MarketDataConfig = MarketDataConfig()
+    partitions: PartitionsConfig = PartitionsConfig()
+    orders: OrdersConfig = OrdersConfig()
+    order_history: OrderHistoryConfig = OrderHistoryConfig()
     db: DB = DB()
 
     class Config:
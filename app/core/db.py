@@ -1,7 +1,9 @@
 import re
+import time
 from typing import AsyncGenerator
 
 from sqlalchemy import MetaData
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from sqlalchemy.ext.asyncio import (
     AsyncAttrs,
     AsyncSession,
@@ -11,6 +13,8 @@ from sqlalchemy.ext.asyncio import (
 from sqlalchemy.orm import DeclarativeBase, declared_attr
 
 from app.core.config import settings
+from app.core.metrics import db_pool_checkout_duration, register_callback
+from app.core.query_stats import instrument_engine
 
 
 class Base(AsyncAttrs, DeclarativeBase):
@@ -36,6 +40,17 @@ class Base(AsyncAttrs, DeclarativeBase):
         return name
 
 
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """Пул соединений, который замеряет, сколько запрос ждал свободное соединение"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            db_pool_checkout_duration.observe(time.perf_counter() - start)
+
+
 # Увеличение лимитов для пула соединений чтобы избежать ошибки TooManyConnectionsError
 engine = create_async_engine(
     settings.db.url,
@@ -44,8 +59,21 @@ engine = create_async_engine(
     pool_timeout=120,
     pool_recycle=1800,
     pool_pre_ping=True,
+    poolclass=TimedQueuePool,
     echo=False
 )
+instrument_engine(engine)
+
+register_callback(
+    'db_pool_connections',
+    'Соединения пула БД: выданные, свободные и сверх pool_size',
+    lambda: [
+        (('checked_out',), engine.pool.checkedout()),
+        (('idle',), engine.pool.checkedin()),
+        (('overflow',), max(engine.pool.overflow(), 0)),
+    ],
+    labelnames=('state',),
+)
 
 
 AsyncSessionLocal = async_sessionmaker(
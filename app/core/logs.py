@@ -1,9 +1,15 @@
+import atexit
+import copy
+import json
 import logging
 import os
+import queue
 from functools import wraps
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from typing import Any
 
+from app.core.config import settings
+
 # TODO: переделать, то директория для логов существует
 LOG_DIR = "logs"
 os.makedirs(LOG_DIR, exist_ok=True)
@@ -12,8 +18,56 @@ os.makedirs(LOG_DIR, exist_ok=True)
 app_logger = logging.getLogger("app_logger")
 app_logger.setLevel(logging.INFO)
 
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-запись на строку - для сборщиков логов"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        # Текст исключения собирает LazyQueueHandler, exc_info до потока записи не доходит
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class LazyQueueHandler(QueueHandler):
+    """
+    Кладёт в очередь запись с уже подставленными аргументами.
+
+    Сообщение и текст исключения собираются в вызывающем потоке, как у
+    стандартного QueueHandler: аргументы (словари, ORM-объекты) могут
+    измениться до того, как до записи дойдёт поток записи, а исключение
+    держало бы в очереди кадры стека. Оформление по шаблону (время, уровень,
+    JSON) и запись в файл выполняются в потоке записи.
+    """
+
+    _exception_formatter = logging.Formatter()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = self._exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
 # Формат логов
-formatter = logging.Formatter("[%(asctime)s] [%(levelname)s] %(message)s")
+if settings.logging.format == "json":
+    formatter = JsonFormatter()
+else:
+    formatter = logging.Formatter("[%(asctime)s] [%(levelname)s] %(message)s")
 
 # Файловый обработчик с ротацией
 file_handler = RotatingFileHandler(
@@ -23,16 +77,26 @@ file_handler = RotatingFileHandler(
     encoding='utf-8'
 )
 file_handler.setFormatter(formatter)
-file_handler.setLevel(logging.INFO)
 
 # Обработчик для вывода в консоль
 console_handler = logging.StreamHandler()
 console_handler.setFormatter(formatter)
-console_handler.setLevel(logging.INFO)
 
-# Добавляем обработчики
-app_logger.addHandler(file_handler)
-app_logger.addHandler(console_handler)
+# Канал трассировки сопоставления: записи по каждому исполнению пишутся на уровне
+# DEBUG и отсекаются проверкой уровня до подстановки аргументов
+matching_logger = app_logger.getChild("matching")
+matching_logger.setLevel(settings.logging.matching_level)
+
+# Уровни задаются на логгерах, обработчики пропускают всё, что до них дошло.
+# Логгер только кладёт записи в очередь, в файл и консоль их пишет фоновый поток,
+# поэтому event loop не ждёт дискового ввода-вывода
+log_queue: queue.SimpleQueue = queue.SimpleQueue()
+app_logger.addHandler(LazyQueueHandler(log_queue))
+
+log_listener = QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+log_listener.start()
+# При завершении процесса дописываем всё, что осталось в очереди
+atexit.register(log_listener.stop)
 
 
 # 🚨 Декоратор для логирования ошибок
@@ -0,0 +1,90 @@
+from typing import Callable, Iterable
+
+from prometheus_client import REGISTRY, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.registry import Collector
+
+# Границы корзин гистограмм длительности по умолчанию, в секундах
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Значения меток -> значение метрики; используется для метрик, снимаемых при опросе
+Samples = Iterable[tuple[tuple[str, ...], float]]
+
+
+class CallbackCollector(Collector):
+    """
+    Метрика, значения которой снимаются функцией в момент опроса.
+
+    Подходит для состояния, которое и так хранится в приложении (стаканы,
+    пул соединений, кэш авторизации): на горячем пути ничего не считается.
+    """
+
+    def __init__(self, name: str, documentation: str, collect: Callable[[], Samples],
+                 labelnames: tuple[str, ...] = (), type: str = 'gauge'):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.family = CounterMetricFamily if type == 'counter' else GaugeMetricFamily
+        self._collect = collect
+
+    def collect(self):
+        family = self.family(self.name, self.documentation, labels=self.labelnames)
+        for values, value in self._collect():
+            family.add_metric([str(label) for label in values], value)
+        yield family
+
+    def describe(self):
+        # Имя известно заранее: реестр проверит его уникальность без вызова функции
+        yield self.family(self.name, self.documentation, labels=self.labelnames)
+
+
+def register_callback(name: str, documentation: str, collect: Callable[[], Samples],
+                      labelnames: tuple[str, ...] = (), type: str = 'gauge') -> CallbackCollector:
+    """Регистрирует метрику состояния, значения которой снимаются функцией при опросе"""
+    collector = CallbackCollector(name, documentation, collect, labelnames, type)
+    REGISTRY.register(collector)
+    return collector
+
+
+# Метрики горячего пути объявлены здесь, чтобы модули приложения импортировали
+# их без циклических зависимостей. Метрики состояния (стаканы, пул, кэш)
+# регистрируются рядом с объектами, которые они описывают.
+http_request_duration = Histogram(
+    'http_request_duration_seconds',
+    'Длительность обработки HTTP-запроса',
+    ('method', 'route', 'status'),
+    buckets=DEFAULT_BUCKETS,
+)
+order_phase_duration = Histogram(
+    'order_phase_duration_seconds',
+    'Длительность этапов выставления заявки: queue, block, match, settle, persist, commit',
+    ('phase',),
+    buckets=DEFAULT_BUCKETS,
+)
+order_fills = Histogram(
+    'order_fills',
+    'Количество исполнений против встречных заявок на одну входящую заявку',
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 250, 1000),
+)
+db_pool_checkout_duration = Histogram(
+    'db_pool_checkout_seconds',
+    'Ожидание соединения из пула БД',
+    buckets=DEFAULT_BUCKETS,
+)
+db_statement_duration = Histogram(
+    'db_statement_duration_seconds',
+    'Длительность одного SQL-запроса',
+    buckets=DEFAULT_BUCKETS,
+)
+db_statements_per_request = Histogram(
+    'db_statements_per_request',
+    'Количество SQL-запросов на один HTTP-запрос',
+    ('method', 'route'),
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100),
+)
+db_time_per_request = Histogram(
+    'db_time_per_request_seconds',
+    'Суммарное время SQL-запросов на один HTTP-запрос',
+    ('method', 'route'),
+    buckets=DEFAULT_BUCKETS,
+)
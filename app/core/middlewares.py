@@ -1,15 +1,19 @@
 import json
+import random
 import time
 import traceback
-from typing import Callable, Awaitable, Any
+from typing import Pattern
 from uuid import uuid4
 
-from fastapi import Request, Response, HTTPException
 from fastapi.routing import APIRoute
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.datastructures import URL, Headers, MutableHeaders
 from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
+from app.core.config import settings
 from app.core.logs import app_logger  # общий логгер
+from app.core.metrics import db_statements_per_request, db_time_per_request, http_request_duration
+from app.core.query_stats import QueryStats, current_query_stats
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
@@ -22,82 +26,217 @@ def add_cors_middleware(app: FastAPI) -> None:
         allow_credentials=True,
         allow_methods=['*'],
         allow_headers=['*'],
+        # Курсор следующей страницы списков должен быть виден браузерным клиентам
+        expose_headers=['X-Next-Cursor'],
     )
 
-def generate_request_id(headers: dict) -> str:
+def generate_request_id(headers: Headers) -> str:
     return headers.get("X-Request-ID", str(uuid4()))
 
 
-def format_log(message: str, req_id: str) -> str:
-    return f"[req_id={req_id}] {message}"
-
-
-class RequestLoggerMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next: Callable[[Request], Awaitable[Response]]) -> Response:
-        req_id = generate_request_id(request.headers)
-        path = request.url.path
+def get_request_id(scope: Scope) -> str:
+    """ID запроса, общий для всех middleware и доступный эндпоинтам как request.state.request_id"""
+    state = scope.setdefault("state", {})
+    request_id = state.get("request_id")
+    if request_id is None:
+        request_id = state["request_id"] = generate_request_id(Headers(scope=scope))
+    return request_id
 
-        route = next((r for r in request.app.routes if isinstance(r, APIRoute) and r.path == path), None)
-        skip_logging = False
-        omit_password = False
 
-        if route:
-            skip_logging = getattr(route.endpoint, "_no_log", False)
-            omit_password = getattr(route.endpoint, "_no_password", False)
+def format_log(message: str, req_id: str) -> str:
+    return f"[req_id={req_id}] {message}"
 
-        start = time.time()
 
-        try:
-            raw_body = await request.body()
+class RequestLoggerMiddleware:
+    """
+    Логирование запросов и ответов, написанное как чистое ASGI-middleware.
+
+    Тела запроса и ответа не буферизуются и не пересобираются: сообщения
+    проходят к приложению и клиенту как есть, а в лог копируются только первые
+    `max_body_size` байт. Флаги эндпоинтов `_no_log` и `_no_password` берутся
+    из таблицы путей, которая строится один раз при первом запросе.
+    Запросы логируются выборочно с долей `sample_rate`, ошибки - всегда.
+    """
+
+    def __init__(self, app: ASGIApp, sample_rate: float | None = None,
+                 max_body_size: int | None = None):
+        self.app = app
+        self.sample_rate = settings.logging.sample_rate if sample_rate is None else sample_rate
+        self.max_body_size = settings.logging.max_body_size if max_body_size is None else max_body_size
+        self._static_flags: dict[str, tuple[bool, bool]] | None = None
+        self._dynamic_flags: list[tuple[Pattern[str], tuple[bool, bool]]] = []
+
+    def _build_route_flags(self, routes: list) -> None:
+        static_flags = {}
+        for route in routes:
+            if not isinstance(route, APIRoute):
+                continue
+            flags = (getattr(route.endpoint, "_no_log", False),
+                     getattr(route.endpoint, "_no_password", False))
+            if not any(flags):
+                continue
+            # Пути с параметрами сверяются по регулярному выражению маршрута
+            if route.param_convertors:
+                self._dynamic_flags.append((route.path_regex, flags))
+            else:
+                static_flags[route.path] = flags
+        self._static_flags = static_flags
+
+    def _route_flags(self, scope: Scope) -> tuple[bool, bool]:
+        """Флаги (_no_log, _no_password) эндпоинта, которому адресован запрос"""
+        if self._static_flags is None:
+            self._build_route_flags(scope["app"].routes)
+        path = scope["path"]
+        flags = self._static_flags.get(path)
+        if flags is not None:
+            return flags
+        for path_regex, flags in self._dynamic_flags:
+            if path_regex.match(path):
+                return flags
+        return False, False
+
+    def _format_body(self, body: bytes, size: int, omit_password: bool) -> str:
+        if not body:
+            return "<empty body>"
+        if omit_password:
             try:
-                body_json = json.loads(raw_body.decode())
-            except Exception:
-                body_json = None
-
-            if omit_password and isinstance(body_json, dict) and "password" in body_json:
-                body_json.pop("password")
-
-            formatted_body = json.dumps(body_json) if body_json else "<non-JSON body>"
-        except Exception:
-            formatted_body = "<error reading body>"
-
-        if not skip_logging:
-            app_logger.info(format_log(f"Started {request.method} {request.url}", req_id))
-            app_logger.info(format_log(f"Body: {formatted_body}", req_id))
+                body_json = json.loads(body)
+            except ValueError:
+                # Обрезанное или не-JSON тело нельзя очистить от пароля - не логируем его
+                return "<body omitted>"
+            if isinstance(body_json, dict):
+                body_json.pop("password", None)
+            return json.dumps(body_json)
+        text = body.decode(errors="ignore")
+        if size > len(body):
+            text += f"... <{size} bytes>"
+        return text
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        skip_logging, omit_password = self._route_flags(scope)
+        if skip_logging:
+            await self.app(scope, receive, send)
+            return
+
+        req_id = get_request_id(scope)
+        sampled = self.sample_rate >= 1 or random.random() < self.sample_rate
+        limit = self.max_body_size
+        request_body = bytearray()
+        response_body = bytearray()
+        sizes = [0, 0]
+        status_code = None
+
+        async def receive_and_copy() -> Message:
+            message = await receive()
+            if message["type"] == "http.request":
+                chunk = message.get("body", b"")
+                sizes[0] += len(chunk)
+                if len(request_body) < limit:
+                    request_body.extend(chunk[:limit - len(request_body)])
+            return message
+
+        async def send_and_copy(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif sampled and message["type"] == "http.response.body":
+                chunk = message.get("body", b"")
+                sizes[1] += len(chunk)
+                if len(response_body) < limit:
+                    response_body.extend(chunk[:limit - len(response_body)])
+            await send(message)
+
+        start = time.perf_counter()
+        if sampled:
+            app_logger.info(format_log(f"Started {scope['method']} {URL(scope=scope)}", req_id))
 
         try:
-            response = await call_next(request)
-            response_body = b""
-            async for chunk in response.body_iterator:
-                response_body += chunk
-
-            new_response = Response(
-                content=response_body,
-                status_code=response.status_code,
-                headers=dict(response.headers),
-                media_type=response.media_type,
-            )
-
-            if not skip_logging:
-                app_logger.info(format_log(f"Completed with status {response.status_code}", req_id))
-                app_logger.info(format_log(f"Response: {response_body.decode(errors='ignore')}", req_id))
-
-            return new_response
-
-        except HTTPException as http_exc:
-            if not skip_logging:
-                app_logger.error(format_log(f"HTTP error: {http_exc.detail}", req_id))
-                app_logger.error(format_log(traceback.format_exc(), req_id))
-            return JSONResponse(status_code=http_exc.status_code, content={"detail": http_exc.detail})
-
+            await self.app(scope, receive_and_copy if sampled else receive, send_and_copy)
         except Exception as exc:
-            if not skip_logging:
-                app_logger.error(format_log(f"Unhandled exception: {str(exc)}", req_id))
-                app_logger.error(format_log(traceback.format_exc(), req_id))
-                app_logger.error(format_log(f"Request failed: {request.method} {request.url}", req_id))
-            return JSONResponse(status_code=500, content={"detail": "Internal Server Error"})
-
+            app_logger.error(format_log(f"Unhandled exception: {str(exc)}", req_id))
+            app_logger.error(format_log(traceback.format_exc(), req_id))
+            app_logger.error(format_log(f"Request failed: {scope['method']} {URL(scope=scope)}", req_id))
+            if status_code is not None:
+                # Ответ уже начал уходить клиенту - заменить его нельзя
+                raise
+            response = JSONResponse(status_code=500, content={"detail": "Internal Server Error"})
+            await response(scope, receive, send_and_copy)
+        finally:
+            if sampled:
+                app_logger.info(format_log(
+                    f"Body: {self._format_body(request_body, sizes[0], omit_password)}", req_id
+                ))
+                app_logger.info(format_log(f"Completed with status {status_code}", req_id))
+                app_logger.info(format_log(
+                    f"Response: {self._format_body(response_body, sizes[1], False)}", req_id
+                ))
+                app_logger.info(format_log(f"Duration: {time.perf_counter() - start:.4f}s", req_id))
+                query_stats = current_query_stats.get()
+                if query_stats is not None:
+                    app_logger.info(format_log(query_stats.summary(), req_id))
+            elif status_code is not None and status_code >= 500:
+                app_logger.error(format_log(
+                    f"{scope['method']} {URL(scope=scope)} completed with status {status_code}", req_id
+                ))
+
+
+
+class MetricsMiddleware:
+    """
+    Длительность запросов и статистика запросов к БД по шаблону маршрута.
+
+    Метка route - это шаблон пути (`/api/v1/order/{order_id}`), а не сам путь,
+    чтобы количество рядов не росло с количеством заявок. Маршрут берётся из
+    scope, куда его кладёт роутер FastAPI после сопоставления.
+
+    На время запроса в `current_query_stats` кладётся счётчик SQL-запросов.
+    В отладочном режиме он отдаётся клиенту в заголовке X-DB-Stats; заголовок
+    уходит с началом ответа, поэтому COMMIT зависимости get_async_session,
+    который выполняется после отправки ответа, в него не попадает.
+
+    Для потоковых эндпоинтов (флаг `_streaming`: SSE, выгрузки) длительностью
+    считается время до начала ответа: поток живёт минутами и часами и иначе
+    сдвигал бы перцентили обычных запросов.
+    """
+
+    def __init__(self, app: ASGIApp, debug: bool | None = None):
+        self.app = app
+        self.debug = settings.app.debug if debug is None else debug
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        first_byte = None
+        query_stats = QueryStats(request_id=get_request_id(scope))
+        token = current_query_stats.set(query_stats)
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status_code, first_byte
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                first_byte = time.perf_counter()
+                if self.debug:
+                    MutableHeaders(scope=message).append("X-DB-Stats", query_stats.header())
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
         finally:
-            if not skip_logging:
-                duration = time.time() - start
-                app_logger.info(format_log(f"Duration: {duration:.4f}s", req_id))
+            current_query_stats.reset(token)
+            route = scope.get("route")
+            route_path = route.path if route is not None else "<unmatched>"
+            streaming = getattr(getattr(route, "endpoint", None), "_streaming", False)
+            end = first_byte if streaming and first_byte is not None else time.perf_counter()
+            http_request_duration.labels(
+                scope["method"], route_path, str(status_code)
+            ).observe(end - start)
+            db_statements_per_request.labels(scope["method"], route_path).observe(query_stats.count)
+            db_time_per_request.labels(scope["method"], route_path).observe(query_stats.total)
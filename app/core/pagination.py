@@ -0,0 +1,26 @@
+import base64
+import binascii
+from datetime import datetime
+
+import orjson
+
+
+def encode_cursor(created_at: datetime, id: str) -> str:
+    """
+    Курсор страницы по ключу (created_at, id) последней выданной записи.
+
+    Для клиента курсор непрозрачен: он только передаёт его обратно
+    в следующий запрос.
+    """
+    payload = orjson.dumps([created_at.isoformat(), id])
+    return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, str]:
+    """Разбирает курсор из `encode_cursor`; ValueError, если курсор испорчен"""
+    try:
+        payload = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, id = orjson.loads(payload)
+        return datetime.fromisoformat(created_at), str(id)
+    except (binascii.Error, orjson.JSONDecodeError, TypeError, ValueError):
+        raise ValueError('Некорректный курсор страницы')
@@ -0,0 +1,76 @@
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from app.core.metrics import db_statement_duration
+
+# Сколько символов самого медленного запроса сохраняется для лога
+MAX_STATEMENT_LENGTH = 500
+
+
+@dataclass(slots=True)
+class QueryStats:
+    """Запросы к БД, выполненные в рамках одного HTTP-запроса"""
+    request_id: str
+    count: int = 0
+    total: float = 0.0
+    slowest: float = 0.0
+    slowest_statement: str = ''
+
+    def add(self, statement: str, duration: float) -> None:
+        self.count += 1
+        self.total += duration
+        if duration > self.slowest:
+            self.slowest = duration
+            self.slowest_statement = statement[:MAX_STATEMENT_LENGTH]
+
+    def header(self) -> str:
+        """Значение отладочного заголовка X-DB-Stats"""
+        return f"count={self.count}; total={self.total * 1000:.2f}ms; slowest={self.slowest * 1000:.2f}ms"
+
+    def summary(self) -> str:
+        """Строка для лога запросов"""
+        text = f"DB: {self.count} statements, {self.total * 1000:.2f}ms"
+        if self.count:
+            text += f", slowest {self.slowest * 1000:.2f}ms: {' '.join(self.slowest_statement.split())}"
+        return text
+
+
+# Статистика текущего HTTP-запроса; вне запроса (фоновые задачи, прогрев стаканов) - None
+current_query_stats: ContextVar[QueryStats | None] = ContextVar("current_query_stats", default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    duration = time.perf_counter() - conn.info["query_start"].pop()
+    db_statement_duration.observe(duration)
+    stats = current_query_stats.get()
+    if stats is not None:
+        stats.add(statement, duration)
+
+
+def _handle_error(exception_context) -> None:
+    # Запрос упал - убираем его отметку времени, иначе стек разъедется
+    connection = exception_context.connection
+    if connection is not None and connection.info.get("query_start"):
+        connection.info["query_start"].pop()
+
+
+def instrument_engine(engine: AsyncEngine) -> None:
+    """
+    Подписывается на выполнение запросов движком.
+
+    События SQLAlchemy синхронные и вызываются в контексте корутины, которая
+    выполняет запрос, поэтому статистика попадает в `current_query_stats`
+    того HTTP-запроса, от имени которого идёт работа с БД.
+    """
+    sync_engine = engine.sync_engine
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(sync_engine, "handle_error", _handle_error)
@@ -1,7 +1,8 @@
 from decimal import Decimal
-from typing import Dict
+from typing import Dict, Iterable
 
-from sqlalchemy import and_, select, update, or_
+from sqlalchemy import Integer, and_, column, select, update, values
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.exc import DataError, IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
@@ -49,6 +50,25 @@ class CRUDBalance(CRUDBase[Balance]):
         amount, blocked_amount = balance_row
         return amount - blocked_amount
 
+    @error_log
+    async def get_user_available_balances(
+            self,
+            user_id: str,
+            tickers: Iterable[str],
+            async_session: AsyncSession,
+    ) -> Dict[str, int]:
+        """Доступные балансы пользователя по нескольким тикерам одним запросом; нет строки - 0"""
+        tickers = set(tickers)
+        result = await async_session.execute(
+            select(self.model.ticker, self.model.amount, self.model.blocked_amount).where(
+                and_(self.model.user_id == user_id, self.model.ticker.in_(tickers))
+            )
+        )
+        available = dict.fromkeys(tickers, 0)
+        for ticker, amount, blocked_amount in result.all():
+            available[ticker] = amount - blocked_amount
+        return available
+
     @error_log
     async def get_user_balances(
             self,
@@ -74,13 +94,11 @@ class CRUDBalance(CRUDBase[Balance]):
             amount: int,
             async_session: AsyncSession,
     ) -> Balance:
-        error_log(f"Начало deposit: user_id={user_id}, ticker={ticker}, amount={amount}")
+        app_logger.debug("Начало deposit: user_id=%s, ticker=%s, amount=%s", user_id, ticker, amount)
         if amount <= 0:
-            error_log(f"Ошибка: сумма пополнения должна быть положительной")
             raise ValueError('Сумма пополнения должна быть положительной')
 
         try:
-            error_log(f"Пытаемся обновить существующий баланс")
             result = await async_session.execute(
                 update(self.model)
                 .where(and_(self.model.user_id == user_id, self.model.ticker == ticker))
@@ -90,29 +108,20 @@ class CRUDBalance(CRUDBase[Balance]):
             balance = result.scalar_one_or_none()
 
             if not balance:
-                error_log(f"Баланс не найден, создаем новый")
+                app_logger.debug("Баланс %s/%s не найден, создаем новый", user_id, ticker)
                 balance = self.model(user_id=user_id, ticker=ticker, amount=amount, blocked_amount=0)
                 async_session.add(balance)
                 await async_session.flush()
-                error_log(f"Новый баланс создан")
 
-            await async_session.commit()
-            error_log(f"Транзакция завершена успешно")
             return balance
 
         except IntegrityError as e:
-            error_log(f"IntegrityError: {str(e)}")
-            await async_session.rollback()
             if 'positive_balance' in str(e):
                 raise ValueError('Итоговый баланс не может быть отрицательным')
             raise ValueError('Ошибка при пополнении баланса')
         except DataError as e:
-            error_log(f"DataError: {str(e)}")
-            await async_session.rollback()
             raise ValueError('Некорректная сумма')
         except Exception as e:
-            error_log(f"Неожиданная ошибка: {str(e)}")
-            await async_session.rollback()
             raise ValueError(f'Ошибка при пополнении баланса: {str(e)}')
 
     @error_log
@@ -127,31 +136,100 @@ class CRUDBalance(CRUDBase[Balance]):
             raise ValueError('Сумма списания должна быть положительной')
 
         try:
-            # Проверяем доступный баланс (с учетом заблокированных средств)
-            available_amount = await self.get_user_available_balance(user_id, ticker, async_session)
-            if available_amount < amount:
-                raise ValueError('Недостаточно доступных средств на балансе')
-
+            # Проверка доступного баланса (с учетом заблокированных средств) и
+            # списание одним условным UPDATE, без отдельной блокировки строки
             result = await async_session.execute(
                 update(self.model)
-                .where(and_(self.model.user_id == user_id, self.model.ticker == ticker))
+                .where(and_(self.model.user_id == user_id,
+                            self.model.ticker == ticker,
+                            self.model.amount - self.model.blocked_amount >= amount))
                 .values(amount=self.model.amount - amount)
                 .returning(self.model)
             )
-            balance = result.scalar_one()
+            balance = result.scalar_one_or_none()
+            if balance is None:
+                raise ValueError('Недостаточно доступных средств на балансе')
 
-            await async_session.commit()
             return balance
 
         except IntegrityError as e:
-            await async_session.rollback()
             if 'positive_balance' in str(e):
                 raise ValueError('Итоговый баланс не может быть отрицательным')
             raise ValueError('Ошибка при списании средств')
         except DataError:
-            await async_session.rollback()
             raise ValueError('Некорректная сумма')
 
+    @error_log
+    async def apply_deltas(
+            self,
+            deltas: Dict[tuple[str, str], list[int]],
+            async_session: AsyncSession,
+    ) -> None:
+        """
+        Применение итоговых изменений балансов одним запросом
+
+        Все существующие строки обновляются одним `UPDATE ... FROM (VALUES ...)`.
+        Строка, которая после изменения ушла бы в минус или у которой блокировка
+        превысила бы баланс, не обновляется - тогда весь расчёт отклоняется.
+        Строки, которых ещё нет (первое зачисление тикера), создаются вторым запросом.
+
+        Args:
+            deltas: (user_id, ticker) -> [изменение amount, изменение blocked_amount]
+            async_session: сессия БД
+        """
+        # Ключи сортируются, чтобы параллельные расчёты блокировали строки в одном порядке
+        rows = [
+            (user_id, ticker, amount, blocked)
+            for (user_id, ticker), (amount, blocked) in sorted(deltas.items())
+            if amount or blocked
+        ]
+        if not rows:
+            return
+
+        delta = values(
+            column('user_id', self.model.user_id.type),
+            column('ticker', self.model.ticker.type),
+            column('amount', Integer),
+            column('blocked_amount', Integer),
+            name='delta',
+        ).data(rows)
+        amount = self.model.amount + delta.c.amount
+        blocked_amount = self.model.blocked_amount + delta.c.blocked_amount
+
+        try:
+            result = await async_session.execute(
+                update(self.model)
+                .where(and_(self.model.user_id == delta.c.user_id,
+                            self.model.ticker == delta.c.ticker,
+                            amount >= 0,
+                            blocked_amount >= 0,
+                            blocked_amount <= amount))
+                .values(amount=amount, blocked_amount=blocked_amount)
+                .returning(self.model.user_id, self.model.ticker)
+            )
+            updated = {tuple(row) for row in result.all()}
+
+            missing = [row for row in rows if (row[0], row[1]) not in updated]
+            if missing:
+                # Без строки баланса можно только получить средства, но не списать
+                if any(amount < 0 or blocked < 0 or blocked > amount
+                       for _, _, amount, blocked in missing):
+                    raise ValueError('Недостаточно средств для расчёта по сделке')
+
+                stmt = insert(self.model).values([
+                    {'user_id': user_id, 'ticker': ticker, 'amount': amount, 'blocked_amount': blocked}
+                    for user_id, ticker, amount, blocked in missing
+                ])
+                # Строку мог успеть создать параллельный расчёт по другому тикеру
+                await async_session.execute(stmt.on_conflict_do_update(
+                    index_elements=[self.model.user_id, self.model.ticker],
+                    set_={'amount': self.model.amount + stmt.excluded.amount,
+                          'blocked_amount': self.model.blocked_amount + stmt.excluded.blocked_amount},
+                ))
+
+        except IntegrityError:
+            raise ValueError('Ошибка при расчёте по сделке')
+
     @error_log
     async def block_funds(
             self,
@@ -165,30 +243,21 @@ class CRUDBalance(CRUDBase[Balance]):
             raise ValueError('Сумма блокировки должна быть положительной')
 
         try:
-            # Строгий порядок блокировок: сначала RUB, потом тикер
-            if ticker != "RUB":
-                await async_session.execute(
-                    select(self.model)
-                    .where(and_(self.model.user_id == user_id, self.model.ticker == "RUB"))
-                    .with_for_update()
-                )
-            # Проверяем доступный баланс
-            available_amount = await self.get_user_available_balance(user_id, ticker, async_session)
-            if available_amount < amount:
-                raise ValueError('Недостаточно доступных средств для блокировки')
-
+            # Проверка доступного баланса и блокировка одним условным UPDATE
             result = await async_session.execute(
                 update(self.model)
-                .where(and_(self.model.user_id == user_id, self.model.ticker == ticker))
+                .where(and_(self.model.user_id == user_id,
+                            self.model.ticker == ticker,
+                            self.model.amount - self.model.blocked_amount >= amount))
                 .values(blocked_amount=self.model.blocked_amount + amount)
                 .returning(self.model)
             )
-            balance = result.scalar_one()
+            balance = result.scalar_one_or_none()
+            if balance is None:
+                raise ValueError('Недостаточно доступных средств для блокировки')
 
-            await async_session.commit()
             return balance
         except IntegrityError as e:
-            await async_session.rollback()
             if 'blocked_not_exceed_amount' in str(e):
                 raise ValueError('Сумма блокировки не может превышать общий баланс')
             raise ValueError('Ошибка при блокировке средств')
@@ -206,31 +275,21 @@ class CRUDBalance(CRUDBase[Balance]):
             raise ValueError('Сумма разблокировки должна быть положительной')
 
         try:
-            # Строгий порядок блокировок: сначала RUB, потом тикер
-            if ticker != "RUB":
-                await async_session.execute(
-                    select(self.model)
-                    .where(and_(self.model.user_id == user_id, self.model.ticker == "RUB"))
-                    .with_for_update()
-                )
             result = await async_session.execute(
-                select(self.model)
-                .where(
-                    and_(self.model.user_id == user_id, self.model.ticker == ticker)
-                )
-                .with_for_update()
+                update(self.model)
+                .where(and_(self.model.user_id == user_id,
+                            self.model.ticker == ticker,
+                            self.model.blocked_amount >= amount))
+                .values(blocked_amount=self.model.blocked_amount - amount)
+                .returning(self.model)
             )
             balance = result.scalar_one_or_none()
 
-            if not balance or balance.blocked_amount < amount:
+            if balance is None:
                 raise ValueError('Недостаточно заблокированных средств для разблокировки')
 
-            balance.blocked_amount -= amount
-            await async_session.commit()
-
             return balance
         except IntegrityError:
-            await async_session.rollback()
             raise ValueError('Ошибка при разблокировке средств')
 
     @error_log
@@ -241,7 +300,6 @@ class CRUDBalance(CRUDBase[Balance]):
             qty: int,
             async_session: AsyncSession,
     ) -> Balance:
-        app_logger.info("block_assets")
         """Блокировка активов для ордера на продажу"""
         return await self.block_funds(user_id, ticker, qty, async_session)
 
@@ -309,15 +367,11 @@ class CRUDBalance(CRUDBase[Balance]):
                 .returning(self.model)
             )).scalar_one()
 
-            await async_session.commit()
-
         except IntegrityError as e:
-            await async_session.rollback()
             if 'positive_balance' in str(e):
                 raise ValueError('Итоговый баланс не может быть отрицательным')
             raise ValueError('Ошибка при списании средств')
         except DataError:
-            await async_session.rollback()
             raise ValueError('Некорректная сумма')
 
     @error_log
@@ -329,27 +383,27 @@ class CRUDBalance(CRUDBase[Balance]):
             session: AsyncSession,
     ) -> bool:
         try:
-            # Строгий порядок блокировок: сначала RUB, потом тикер
-            ticker_balance = (await session.execute(
-                select(self.model)
-                .where(and_(self.model.user_id == user_id, self.model.ticker == ticker))
-                .with_for_update()
-            )).scalar_one()
+            # Неудачная попытка откатывается до точки сохранения, не ломая транзакцию заявки
+            async with session.begin_nested():
+                # Строгий порядок блокировок: сначала RUB, потом тикер
+                ticker_balance = (await session.execute(
+                    select(self.model)
+                    .where(and_(self.model.user_id == user_id, self.model.ticker == ticker))
+                    .with_for_update()
+                )).scalar_one()
 
-            if ticker_balance.amount < amount:
-                raise ValueError('Недостаточно доступных средств для блокировки')
+                if ticker_balance.amount < amount:
+                    raise ValueError('Недостаточно доступных средств для блокировки')
 
-            (await session.execute(
-                update(self.model)
-                .where(and_(self.model.user_id == user_id, self.model.ticker == ticker))
-                .values(blocked_amount=self.model.blocked_amount + amount)
-                .returning(self.model)
-            )).scalar_one()
+                (await session.execute(
+                    update(self.model)
+                    .where(and_(self.model.user_id == user_id, self.model.ticker == ticker))
+                    .values(blocked_amount=self.model.blocked_amount + amount)
+                    .returning(self.model)
+                )).scalar_one()
 
-            await session.commit()
             return True
         except IntegrityError as e:
-            await session.rollback()
             return False
 
     @error_log
@@ -366,154 +420,41 @@ class CRUDBalance(CRUDBase[Balance]):
             session: AsyncSession,
     ) -> bool:
         try:
-            # Строгий порядок блокировок: сначала RUB, потом тикер
-            ticker_user_buy_block = (await session.execute(
-                select(self.model)
-                .where(and_(self.model.user_id == user_buy_id, self.model.ticker == ticker_user_buy))
-                .with_for_update()
-            )).scalar_one()
-            ticker_user_sell_block = (await session.execute(
-                select(self.model)
-                .where(and_(self.model.user_id == user_sell_id, self.model.ticker == ticker_user_sell))
-                .with_for_update()
-            )).scalar_one()
-
-            if ticker_user_buy_block.amount < amount_user_buy:
-                raise ValueError('Недостаточно доступных средств для блокировки')
-
-            if ticker_user_sell_block.amount < amount_user_sell:
-                raise ValueError('Недостаточно доступных средств для блокировки')
-
-            (await session.execute(
-                update(self.model)
-                .where(and_(self.model.user_id == user_buy_id, self.model.ticker == ticker_user_buy))
-                .values(blocked_amount=self.model.blocked_amount + amount_user_buy)
-                .returning(self.model)
-            )).scalar_one()
-            (await session.execute(
-                update(self.model)
-                .where(and_(self.model.user_id == user_sell_id, self.model.ticker == ticker_user_sell))
-                .values(blocked_amount=self.model.blocked_amount + amount_user_sell)
-                .returning(self.model)
-            )).scalar_one()
-
-            await session.commit()
-            return True
-        except IntegrityError as e:
-            await session.rollback()
-            return False
-
-    async def commit_buy(
-            self,
-            user_buy_id: str,
-            ticker_user_buy: str,
-            amount_user_buy: int,
-
-            user_sell_id: str,
-            ticker_user_sell: str,
-            amount_user_sell: int,
-
-            session: AsyncSession,
-    ) -> bool:
-        try:
-            # Строгий порядок блокировок: сначала RUB, потом тикер
-            (await session.execute(
-                select(self.model)
-                .where(or_(and_(self.model.user_id == user_buy_id, self.model.ticker == ticker_user_buy),
-                           and_(self.model.user_id == user_sell_id, self.model.ticker == ticker_user_sell)))
-                .with_for_update()
-            ))
-
-            (await session.execute(
-                update(self.model)
-                .where(and_(self.model.user_id == user_buy_id, self.model.ticker == ticker_user_buy))
-                .values(amount=self.model.amount - amount_user_buy,
-                        blocked_amount=self.model.blocked_amount - amount_user_buy)
-                .returning(self.model)
-            )).scalar_one()
-            (await session.execute(
-                update(self.model)
-                .where(and_(self.model.user_id == user_buy_id, self.model.ticker == ticker_user_sell))
-                .values(amount=self.model.amount + amount_user_sell)
-                .returning(self.model)
-            )).scalar_one()
-
-            (await session.execute(
-                update(self.model)
-                .where(and_(self.model.user_id == user_sell_id, self.model.ticker == ticker_user_sell))
-                .values(amount=self.model.amount - amount_user_sell,
-                        blocked_amount=self.model.blocked_amount - amount_user_sell)
-                .returning(self.model)
-            )).scalar_one()
-            (await session.execute(
-                update(self.model)
-                .where(and_(self.model.user_id == user_sell_id, self.model.ticker == ticker_user_buy))
-                .values(amount=self.model.amount + amount_user_buy)
-                .returning(self.model)
-            )).scalar_one()
-
-            await session.commit()
-            return True
-        except IntegrityError as e:
-            await session.rollback()
-            return False
-
-    async def try_block_and_buy(
-            self,
-            user_buy_id: str,
-            ticker_user_buy: str,
-            amount_user_buy: int,
-
-            user_sell_id: str,
-            ticker_user_sell: str,
-            amount_user_sell: int,
-
-            session: AsyncSession,
-    ) -> bool:
-        try:
-            # Строгий порядок блокировок: сначала RUB, потом тикер
-            ticker_balances = (await session.execute(
-                select(self.model)
-                .where(or_(and_(self.model.user_id == user_buy_id, self.model.ticker == ticker_user_buy),
-                           and_(self.model.user_id == user_sell_id, self.model.ticker == ticker_user_sell)))
-                .with_for_update()
-            )).scalars().all()
-            ticker_balance_buy = [x for x in ticker_balances if x.user_id == user_buy_id][0]
-
-            if ticker_balance_buy.amount - ticker_balance_buy.blocked_amount < amount_user_buy:
-                return False
-
-            (await session.execute(
-                update(self.model)
-                .where(and_(self.model.user_id == user_buy_id, self.model.ticker == ticker_user_buy))
-                .values(amount=self.model.amount - amount_user_buy)
-                .returning(self.model)
-            )).scalar_one()
-            (await session.execute(
-                update(self.model)
-                .where(and_(self.model.user_id == user_buy_id, self.model.ticker == ticker_user_sell))
-                .values(amount=self.model.amount + amount_user_sell)
-                .returning(self.model)
-            )).scalar_one()
-
-            (await session.execute(
-                update(self.model)
-                .where(and_(self.model.user_id == user_sell_id, self.model.ticker == ticker_user_sell))
-                .values(amount=self.model.amount - amount_user_sell,
-                        blocked_amount=self.model.blocked_amount - amount_user_sell)
-                .returning(self.model)
-            )).scalar_one()
-            (await session.execute(
-                update(self.model)
-                .where(and_(self.model.user_id == user_sell_id, self.model.ticker == ticker_user_buy))
-                .values(amount=self.model.amount + amount_user_buy)
-                .returning(self.model)
-            )).scalar_one()
+            # Неудачная попытка откатывается до точки сохранения, не ломая транзакцию заявки
+            async with session.begin_nested():
+                # Строгий порядок блокировок: сначала RUB, потом тикер
+                ticker_user_buy_block = (await session.execute(
+                    select(self.model)
+                    .where(and_(self.model.user_id == user_buy_id, self.model.ticker == ticker_user_buy))
+                    .with_for_update()
+                )).scalar_one()
+                ticker_user_sell_block = (await session.execute(
+                    select(self.model)
+                    .where(and_(self.model.user_id == user_sell_id, self.model.ticker == ticker_user_sell))
+                    .with_for_update()
+                )).scalar_one()
+
+                if ticker_user_buy_block.amount < amount_user_buy:
+                    raise ValueError('Недостаточно доступных средств для блокировки')
+
+                if ticker_user_sell_block.amount < amount_user_sell:
+                    raise ValueError('Недостаточно доступных средств для блокировки')
+
+                (await session.execute(
+                    update(self.model)
+                    .where(and_(self.model.user_id == user_buy_id, self.model.ticker == ticker_user_buy))
+                    .values(blocked_amount=self.model.blocked_amount + amount_user_buy)
+                    .returning(self.model)
+                )).scalar_one()
+                (await session.execute(
+                    update(self.model)
+                    .where(and_(self.model.user_id == user_sell_id, self.model.ticker == ticker_user_sell))
+                    .values(blocked_amount=self.model.blocked_amount + amount_user_sell)
+                    .returning(self.model)
+                )).scalar_one()
 
-            await session.commit()
             return True
         except IntegrityError as e:
-            await session.rollback()
             return False
 
     @error_log
@@ -524,18 +465,12 @@ class CRUDBalance(CRUDBase[Balance]):
             amount: int,
             session: AsyncSession,
     ):
-        try:
-            (await session.execute(
-                update(self.model)
-                .where(and_(self.model.user_id == user_id, self.model.ticker == ticker))
-                .values(blocked_amount=self.model.blocked_amount - amount)
-                .returning(self.model)
-            )).scalar_one()
-
-            await session.commit()
-        except IntegrityError as e:
-            await session.rollback()
-            raise e
+        (await session.execute(
+            update(self.model)
+            .where(and_(self.model.user_id == user_id, self.model.ticker == ticker))
+            .values(blocked_amount=self.model.blocked_amount - amount)
+            .returning(self.model)
+        )).scalar_one()
 
 
 balance_crud = CRUDBalance()
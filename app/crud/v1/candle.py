@@ -0,0 +1,207 @@
+from datetime import datetime, timezone
+
+from sqlalchemy import and_, delete, func, literal, select
+from sqlalchemy.dialects.postgresql import aggregate_order_by, array_agg, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.logs import error_log
+from app.crud.base import CRUDBase
+from app.crud.v1.transaction import as_utc
+from app.models.candle import Candle, CandleInterval
+from app.models.transaction import Transaction
+
+# Начало отсчёта интервалов: свечи всех интервалов выровнены по полуночи UTC
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def candle_start(timestamp: datetime, interval: CandleInterval) -> datetime:
+    """Начало свечи интервала, в которую попадает момент времени"""
+    step = interval.step
+    return EPOCH + (as_utc(timestamp) - EPOCH) // step * step
+
+
+class CRUDCandle(CRUDBase[Candle]):
+    def __init__(self):
+        super().__init__(Candle, primary_key_name='start')
+
+    @error_log
+    async def record_trades(
+            self,
+            trades: list[dict],
+            session: AsyncSession,
+    ) -> None:
+        """
+        Обновление свечей всех интервалов по сделкам одного расчёта
+
+        Сделки сворачиваются в памяти до одной строки на свечу и применяются
+        одним `INSERT ... ON CONFLICT DO UPDATE`: открытие остаётся от первой
+        сделки свечи, закрытие берётся от последней. Сделки тикера проходят
+        через его очередь по одной операции, поэтому закрытие не перепутается.
+
+        Args:
+            trades: сделки в порядке исполнения, как их копит `Settlement`
+            session: сессия БД, та же, в которой записываются сделки
+        """
+        # (ticker, interval, start) -> [open, high, low, close, volume, trades]
+        bars: dict[tuple[str, str, datetime], list[int]] = {}
+        for trade in trades:
+            price = trade['price']
+            for interval in CandleInterval:
+                key = (trade['ticker'], interval.value, candle_start(trade['timestamp'], interval))
+                bar = bars.get(key)
+                if bar is None:
+                    bars[key] = [price, price, price, price, trade['amount'], 1]
+                    continue
+                bar[1] = max(bar[1], price)
+                bar[2] = min(bar[2], price)
+                bar[3] = price
+                bar[4] += trade['amount']
+                bar[5] += 1
+        if not bars:
+            return
+
+        query = insert(self.model).values([
+            {
+                'ticker': ticker, 'interval': interval, 'start': start,
+                'open': bar[0], 'high': bar[1], 'low': bar[2], 'close': bar[3],
+                'volume': bar[4], 'trades': bar[5],
+            }
+            for (ticker, interval, start), bar in sorted(bars.items())
+        ])
+        query = query.on_conflict_do_update(
+            index_elements=[self.model.ticker, self.model.interval, self.model.start],
+            set_={
+                'high': func.greatest(self.model.high, query.excluded.high),
+                'low': func.least(self.model.low, query.excluded.low),
+                'close': query.excluded.close,
+                'volume': self.model.volume + query.excluded.volume,
+                'trades': self.model.trades + query.excluded.trades,
+            },
+        )
+        await session.execute(query)
+
+    @error_log
+    async def get_candles(
+            self,
+            ticker: str,
+            interval: CandleInterval,
+            session: AsyncSession,
+            start: datetime | None = None,
+            end: datetime | None = None,
+            limit: int = 100,
+    ) -> list[dict]:
+        """
+        Последние `limit` свечей тикера за период [start, end) в порядке времени
+
+        Читается только таблица свечей: запрос идёт по первичному ключу
+        (ticker, interval, start). Интервалы без сделок свечей не имеют.
+        """
+        query = select(
+            self.model.start, self.model.open, self.model.high, self.model.low,
+            self.model.close, self.model.volume, self.model.trades,
+        ).where(
+            self.model.ticker == ticker,
+            self.model.interval == interval.value,
+        ).order_by(
+            self.model.start.desc()
+        ).limit(limit)
+        if start is not None:
+            query = query.where(self.model.start >= candle_start(start, interval))
+        if end is not None:
+            query = query.where(self.model.start < as_utc(end))
+
+        result = await session.execute(query)
+        return [dict(row) for row in reversed(result.mappings().all())]
+
+    async def rebuild(
+            self,
+            start: datetime,
+            end: datetime,
+            session: AsyncSession,
+            ticker: str | None = None,
+    ) -> int:
+        """
+        Пересчёт свечей за период [start, end) по истории сделок
+
+        Минутные свечи строятся одним `INSERT ... SELECT` с группировкой по
+        таблице сделок, свечи крупных интервалов - из минутных, так что таблица
+        сделок читается один раз. Свечи периода, по которым сделок больше нет,
+        удаляются. Границы периода должны быть выровнены по самому крупному
+        интервалу, иначе крайние свечи соберутся не целиком.
+
+        Args:
+            start: начало периода (включительно)
+            end: конец периода (не включительно)
+            session: сессия БД
+            ticker: тикер инструмента, по умолчанию - все тикеры
+
+        Returns:
+            Количество построенных минутных свечей
+        """
+        start, end = as_utc(start), as_utc(end)
+
+        def in_period(model_ticker, timestamp):
+            conditions = [timestamp >= start, timestamp < end]
+            if ticker is not None:
+                conditions.append(model_ticker == ticker)
+            return and_(*conditions)
+
+        await session.execute(
+            delete(self.model).where(in_period(self.model.ticker, self.model.start))
+        )
+
+        minute = func.date_bin(CandleInterval.M1.step, Transaction.timestamp, EPOCH).label('start')
+        inserted = await self._insert_from(session, select(
+            Transaction.ticker,
+            literal(CandleInterval.M1.value).label('interval'),
+            minute,
+            array_agg(aggregate_order_by(Transaction.price, Transaction.timestamp, Transaction.id))[1],
+            func.max(Transaction.price),
+            func.min(Transaction.price),
+            array_agg(aggregate_order_by(
+                Transaction.price, Transaction.timestamp.desc(), Transaction.id.desc()
+            ))[1],
+            func.sum(Transaction.amount),
+            func.count(),
+        ).where(
+            in_period(Transaction.ticker, Transaction.timestamp)
+        ).group_by(Transaction.ticker, minute))
+
+        minutes = select(self.model).where(
+            self.model.interval == CandleInterval.M1.value,
+            in_period(self.model.ticker, self.model.start),
+        ).subquery()
+        for interval in CandleInterval:
+            if interval == CandleInterval.M1:
+                continue
+            bucket = func.date_bin(interval.step, minutes.c.start, EPOCH).label('start')
+            await self._insert_from(session, select(
+                minutes.c.ticker,
+                literal(interval.value).label('interval'),
+                bucket,
+                array_agg(aggregate_order_by(minutes.c.open, minutes.c.start))[1],
+                func.max(minutes.c.high),
+                func.min(minutes.c.low),
+                array_agg(aggregate_order_by(minutes.c.close, minutes.c.start.desc()))[1],
+                func.sum(minutes.c.volume),
+                func.sum(minutes.c.trades),
+            ).group_by(minutes.c.ticker, bucket))
+        return inserted
+
+    async def _insert_from(self, session: AsyncSession, bars) -> int:
+        """Вставка свечей из SELECT; свеча, записанная параллельным расчётом, перезаписывается"""
+        query = insert(self.model).from_select(
+            ['ticker', 'interval', 'start', 'open', 'high', 'low', 'close', 'volume', 'trades'], bars,
+        )
+        query = query.on_conflict_do_update(
+            index_elements=[self.model.ticker, self.model.interval, self.model.start],
+            set_={
+                name: getattr(query.excluded, name)
+                for name in ('open', 'high', 'low', 'close', 'volume', 'trades')
+            },
+        )
+        result = await session.execute(query)
+        return result.rowcount
+
+
+candle_crud = CRUDCandle()
@@ -13,6 +13,22 @@ from app.schemas.instrument import (
 class CRUDInstrument(CRUDBase[Instrument]):
     def __init__(self):
         super().__init__(Instrument, primary_key_name='ticker')
+        # Тикеры, существование которых уже проверено в этом процессе
+        self._known: set[str] = set()
+
+    async def exists(self, ticker: str, async_session: AsyncSession) -> bool:
+        """
+        Проверяет, что инструмент существует
+
+        Найденные тикеры запоминаются, поэтому заявки по известному инструменту
+        не обращаются к БД. Неизвестный тикер проверяется в БД каждый раз.
+        """
+        if ticker in self._known:
+            return True
+        if await self.get(ticker, async_session) is None:
+            return False
+        self._known.add(ticker)
+        return True
 
     @error_log
     async def get_all(self, async_session: AsyncSession) -> list[InstrumentResponse]:
@@ -49,6 +65,7 @@ class CRUDInstrument(CRUDBase[Instrument]):
         await self.delete(instrument, async_session)
         await async_session.flush()
         await async_session.commit()
+        self._known.discard(ticker)
 
 
 instrument_crud = CRUDInstrument()
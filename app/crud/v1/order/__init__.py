@@ -1,4 +1,5 @@
 from app.crud.v1.order.crud_order import order_crud
 from app.crud.v1.order.crud_order_v2 import order_crud_v2
+from app.crud.v1.order.sequencer import order_sequencer
 
-__all__ = ["order_crud", "order_crud_v2"]
+__all__ = ["order_crud", "order_crud_v2", "order_sequencer"]
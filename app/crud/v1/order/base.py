@@ -1,15 +1,33 @@
-from typing import Sequence
+from typing import Callable, Sequence
 
-from sqlalchemy import select
+from sqlalchemy import Row, Select, delete, insert, select, tuple_, union_all
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.logs import error_log
+from app.core.pagination import decode_cursor, encode_cursor
 from app.crud.base import CRUDBase
-from app.models import Order
+from app.models import Order, OrderHistory
+from app.models.order import Status
+
+# Столбцы, общие для активных заявок и истории
+ORDER_COLUMNS = ('id', 'status', 'user_id', 'direction', 'ticker', 'qty', 'price', 'filled', 'created_at')
+# Статусы, после которых заявка больше не меняется и переносится в историю
+TERMINAL = (Status.EXECUTED, Status.CANCELLED)
+
+
+def _columns(model: type[Order] | type[OrderHistory]) -> list:
+    return [getattr(model, name) for name in ORDER_COLUMNS]
 
 
 class CRUDOrderBase(CRUDBase[Order]):
-    """Базовый класс для работы с ордерами"""
+    """
+    Базовый класс для работы с ордерами
+
+    Заявки хранятся в двух таблицах: `order` - заявки стакана и недавно
+    завершённые, `order_history` - завершённые заявки, перенесённые задачей
+    `app/jobs/orders.py`. Сопоставление читает только `order`, чтение заявки
+    по ID и списки заявок - обе таблицы.
+    """
 
     def __init__(self):
         super().__init__(Order, primary_key_name='id')
@@ -19,12 +37,52 @@ class CRUDOrderBase(CRUDBase[Order]):
             self,
             id: str,
             session: AsyncSession,
-    ) -> Order:
-        """Получение заявки по ID"""
+    ) -> Order | OrderHistory | None:
+        """Получение заявки по ID; если её нет среди активных - из истории"""
         result = await session.execute(
             select(Order).where(Order.id == id)
         )
-        return result.scalar_one_or_none()
+        order = result.scalar_one_or_none()
+        if order is None:
+            result = await session.execute(
+                select(OrderHistory).where(OrderHistory.id == id)
+            )
+            order = result.scalar_one_or_none()
+        return order
+
+    @staticmethod
+    def _page(filters: Callable[[type], list], limit: int, offset: int, cursor: str | None) -> Select:
+        """
+        Страница заявок обеих таблиц от новых к старым.
+
+        Каждая таблица отдаёт не больше `offset + limit` строк по своему индексу
+        (created_at, id), общий порядок собирается из двух коротких выборок.
+        С курсором выборка продолжается строго после последней заявки прошлой
+        страницы и стоит одинаково на любой глубине. offset оставлен для
+        совместимости: он перебирает пропущенные строки.
+
+        Args:
+            filters: условия отбора для модели таблицы
+        """
+        position = decode_cursor(cursor) if cursor is not None else None
+        branches = []
+        for model in (Order, OrderHistory):
+            branch = select(*_columns(model)).where(*filters(model)).order_by(
+                model.created_at.desc(), model.id.desc()
+            ).limit(limit + (0 if position else offset))
+            if position is not None:
+                branch = branch.where(tuple_(model.created_at, model.id) < tuple_(*position))
+            branches.append(branch)
+        orders = union_all(*branches).subquery()
+        query = select(orders).order_by(orders.c.created_at.desc(), orders.c.id.desc()).limit(limit)
+        return query if position is not None else query.offset(offset)
+
+    @staticmethod
+    def next_cursor(orders: Sequence[Row], limit: int) -> str | None:
+        """Курсор следующей страницы; None, если страница последняя"""
+        if len(orders) < limit:
+            return None
+        return encode_cursor(orders[-1].created_at, orders[-1].id)
 
     @error_log
     async def get_user_orders(
@@ -33,16 +91,13 @@ class CRUDOrderBase(CRUDBase[Order]):
             session: AsyncSession,
             limit: int = 100,
             offset: int = 0,
-    ) -> list[Order]:
-        """Получение списка заявок пользователя"""
+            cursor: str | None = None,
+    ) -> Sequence[Row]:
+        """Получение списка заявок пользователя от новых к старым"""
         result = await session.execute(
-            select(Order)
-            .where(Order.user_id == user_id)
-            .order_by(Order.id.desc())
-            .limit(limit)
-            .offset(offset)
+            self._page(lambda model: [model.user_id == user_id], limit, offset, cursor)
         )
-        return result.scalars().all()
+        return result.all()
 
     @error_log
     async def get_all_orders(
@@ -50,12 +105,39 @@ class CRUDOrderBase(CRUDBase[Order]):
             session: AsyncSession,
             limit: int = 100,
             offset: int = 0,
-    ) -> Sequence[Order]:
-        """Получение списка всех заявок"""
+            cursor: str | None = None,
+    ) -> Sequence[Row]:
+        """Получение списка всех заявок от новых к старым"""
+        result = await session.execute(self._page(lambda model: [], limit, offset, cursor))
+        return result.all()
+
+    @error_log
+    async def move_to_history(
+            self,
+            session: AsyncSession,
+            batch_size: int = 1000,
+    ) -> int:
+        """
+        Перенос пачки завершённых заявок из `order` в `order_history`
+
+        Удаление и вставка выполняются одним запросом, поэтому заявка в любой
+        момент видна ровно в одной таблице. Строки, заблокированные текущим
+        расчётом, пропускаются и будут перенесены следующим вызовом.
+
+        Returns:
+            Количество перенесённых заявок
+        """
+        moved = delete(Order).where(
+            Order.id.in_(
+                select(Order.id)
+                .where(Order.status.in_(TERMINAL))
+                .limit(batch_size)
+                .with_for_update(skip_locked=True)
+            )
+        ).returning(*_columns(Order)).cte('moved')
         result = await session.execute(
-            select(Order)
-            .order_by(Order.id.desc())
-            .limit(limit)
-            .offset(offset)
+            insert(OrderHistory)
+            .from_select(ORDER_COLUMNS, select(*[moved.c[name] for name in ORDER_COLUMNS]))
+            .add_cte(moved, nest_here=True)
         )
-        return result.scalars().all()
+        return result.rowcount
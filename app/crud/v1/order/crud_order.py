@@ -1,13 +1,18 @@
+from uuid import uuid4
+
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, and_, or_, desc, asc
-from datetime import datetime
+from sqlalchemy import select, and_, update
 
-from app.core.logs import app_logger
+from app.core.logs import matching_logger
+from app.core.metrics import order_fills, order_phase_duration
 from app.crud.v1.order.base import CRUDOrderBase
 from app.crud.v1.order.market_data import get_orderbook
+from app.crud.v1.order.market_feed import market_feed
+from app.crud.v1.order.order_events import order_events
+from app.crud.v1.order.order_book import Fill, OrderBook, order_books
+from app.crud.v1.order.settlement import Settlement
 from app.crud.v1.balance import balance_crud
 from app.models.order import Order, Status, Direction, OrderBookScope
-from app.models.transaction import Transaction
 from app.models.balance import Balance
 
 
@@ -35,147 +40,260 @@ class CRUDOrder(CRUDOrderBase):
         Returns:
             Созданная заявка
         """
-        if direction == Direction.SELL:
-            return await self._process_sell_order(
-                user_id=user_id,
-                ticker=ticker,
-                qty=qty,
-                price=price,
-                session=session
-            )
-        else:  # BUY
-            return await self._process_buy_order(
-                user_id=user_id,
-                ticker=ticker,
-                qty=qty,
-                price=price,
-                session=session
-            )
+        async with order_books.acquire(ticker, session) as book:
+            if direction == Direction.SELL:
+                return await self._process_sell_order(
+                    user_id=user_id,
+                    ticker=ticker,
+                    qty=qty,
+                    price=price,
+                    book=book,
+                    session=session
+                )
+            else:  # BUY
+                return await self._process_buy_order(
+                    user_id=user_id,
+                    ticker=ticker,
+                    qty=qty,
+                    price=price,
+                    book=book,
+                    session=session
+                )
 
-    async def _find_matching_orders(self, ticker: str, direction: Direction,
-                                    price: int = None, limit: int = 100,
-                                    session: AsyncSession = None) -> list:
+    async def check_balances(self, user_id: str, orders: list[tuple[str, Direction, int, int | None]],
+                             session: AsyncSession) -> list[ValueError | None]:
         """
-        Поиск подходящих встречных заявок
+        Предварительная проверка балансов для пачки заявок одним запросом
+
+        Заявки проверяются по порядку, каждая резервирует свою потребность
+        так, как если бы встала в стакан целиком: продажа - qty тикера,
+        лимитная покупка - qty * price рублей. Стоимость рыночной покупки
+        известна только по стакану, её проверяет выставление. Проверка
+        предварительная: балансы могут измениться до исполнения, поэтому
+        каждая заявка всё равно проверяется при выставлении.
 
         Args:
-            ticker: тикер инструмента
-            direction: направление заявки (противоположное направление будет искаться)
-            price: цена для сопоставления
-            limit: максимальное количество заявок
+            user_id: идентификатор пользователя
+            orders: заявки (ticker, direction, qty, price), price=None - рыночная
             session: сессия БД
 
         Returns:
-            Список найденных заявок
+            Для каждой заявки - ValueError с причиной отказа или None
         """
-        # Определяем противоположное направление для поиска
-        opposite_direction = Direction.BUY if direction == Direction.SELL else Direction.SELL
-
-        # Формируем базовый запрос
-        stmt = select(Order).where(
-            and_(
-                Order.ticker == ticker,
-                Order.direction == opposite_direction,
-                or_(
-                    Order.status == Status.NEW,
-                    Order.status == Status.PARTIALLY_EXECUTED
-                )
-            )
-        )
+        tickers = {"RUB"} | {ticker for ticker, direction, _, _ in orders if direction == Direction.SELL}
+        available = await balance_crud.get_user_available_balances(user_id, tickers, async_session=session)
 
-        # Если указана цена, добавляем условие по цене
-        if price is not None:
+        errors = []
+        for ticker, direction, qty, price in orders:
             if direction == Direction.SELL:
-                # Для продажи ищем заявки на покупку с ценой >= нашей цены
-                stmt = stmt.where(Order.price >= price)
+                asset, required = ticker, qty
+            elif price is not None:
+                asset, required = "RUB", qty * price
             else:
-                # Для покупки ищем заявки на продажу с ценой <= нашей цены
-                stmt = stmt.where(Order.price <= price)
-
-        # Сортируем по цене и времени создания (лучшая цена в начале, затем по времени создания)
-        if opposite_direction == Direction.BUY:
-            # Для встречных заявок на покупку - сортируем от большей цены к меньшей (продаем тому, кто предлагает больше)
-            stmt = stmt.order_by(desc(Order.price), asc(Order.created_at))
-        else:
-            # Для встречных заявок на продажу - сортируем от меньшей цены к большей (покупаем у того, кто предлагает дешевле)
-            stmt = stmt.order_by(asc(Order.price), asc(Order.created_at))
-
-        stmt = stmt.limit(limit)
-
-        result = await session.execute(stmt)
-        return result.scalars().all()
+                errors.append(None)
+                continue
+            if available[asset] < required:
+                errors.append(ValueError(f'Недостаточно {asset} на балансе для создания заявки'))
+                continue
+            available[asset] -= required
+            errors.append(None)
+        return errors
 
-    async def _update_counterparty_order(self, order: Order, executed_qty: int,
-                                         session: AsyncSession) -> None:
+    async def create_orders(self, user_id: str, ticker: str, orders: list[tuple[Direction, int, int | None]],
+                            session: AsyncSession = None) -> list[Order | ValueError]:
         """
-        Обновление заявки контрагента
+        Выставление нескольких заявок по одному тикеру в одной транзакции
+
+        Подряд идущие лимитные заявки выставляются пачкой (`_create_limit_orders`),
+        рыночная заявка - обычным путём в своей точке сохранения (SAVEPOINT).
+        Отказ откатывает только изменения отклонённой части, её события не
+        публикуются. Всё остальное фиксируется одним COMMIT обработчика очереди тикера.
+        Если отклонённая часть уже успела изменить стакан, откатывается вся операция
+        (см. `_in_savepoint`).
 
         Args:
-            order: заявка для обновления
-            executed_qty: количество, которое было исполнено
+            user_id: идентификатор пользователя
+            ticker: тикер инструмента
+            orders: заявки (direction, qty, price), price=None - рыночная
             session: сессия БД
+
+        Returns:
+            Для каждой заявки - созданная заявка или ValueError с причиной отказа
         """
-        # Обновляем количество исполненного объема
-        order.filled = (order.filled or 0) + executed_qty
+        results = []
+        limit_orders = []
+        for direction, qty, price in orders:
+            if price is not None:
+                limit_orders.append((direction, qty, price))
+                continue
+            if limit_orders:
+                results.extend(await self._create_limit_orders(user_id, ticker, limit_orders, session))
+                limit_orders = []
+            results.extend(await self._in_savepoint(ticker, session, lambda: self._market_order_result(
+                user_id, direction, ticker, qty, session
+            )))
+        if limit_orders:
+            results.extend(await self._create_limit_orders(user_id, ticker, limit_orders, session))
+        return results
+
+    async def _market_order_result(self, user_id: str, direction: Direction, ticker: str,
+                                   qty: int, session: AsyncSession) -> list[Order | ValueError]:
+        order = await self.create_order(user_id=user_id, direction=direction, ticker=ticker,
+                                        qty=qty, session=session)
+        return [order]
+
+    async def _create_limit_orders(self, user_id: str, ticker: str, orders: list[tuple[Direction, int, int]],
+                                   session: AsyncSession) -> list[Order | ValueError]:
+        """Пачка лимитных заявок под одним захватом стакана; сбой расчёта откатывает всю операцию тикера"""
+        async def place() -> list[Order | ValueError]:
+            async with order_books.acquire(ticker, session) as book:
+                return await self._place_limit_orders(user_id, ticker, orders, book, session)
+
+        return await self._in_savepoint(ticker, session, place, size=len(orders))
+
+    @staticmethod
+    async def _in_savepoint(ticker: str, session: AsyncSession, operation,
+                            size: int = 1) -> list[Order | ValueError]:
+        """
+        Выполнение части операции в точке сохранения
 
-        # Обновляем статус заявки
-        if order.filled >= order.qty:
-            order.status = Status.EXECUTED
-        else:
-            order.status = Status.PARTIALLY_EXECUTED
+        Если часть отклонена (ValueError), откатываются её изменения в БД,
+        а накопленные ею события стакана и заявок не публикуются.
 
-        # Разблокируем средства у контрагента в соответствии с исполненным объемом
-        if order.direction == Direction.BUY:
-            # Разблокируем рубли у покупателя
-            if order.price is not None:  # Для лимитной заявки
-                amount_to_unblock = executed_qty * order.price
-                await balance_crud.unblock_funds(
-                    user_id=order.user_id,
-                    ticker="RUB",
-                    amount=amount_to_unblock,
-                    async_session=session
-                )
+        Стакан в памяти в точку сохранения не откатывается: если часть была
+        отклонена после того, как изменила стакан, `order_books.acquire` его
+        сбрасывает, и перечитанный стакан не содержит заявок, выставленных
+        ранее в этой же незафиксированной транзакции. Тогда ошибка
+        пробрасывается и откатывается вся операция тикера. Так бывает, только
+        если балансы изменились параллельно между проверкой и расчётом.
 
-                # Списываем рубли
-                await balance_crud.withdraw(
-                    user_id=order.user_id,
-                    ticker="RUB",
-                    amount=executed_qty * order.price,
-                    async_session=session
-                )
+        Returns:
+            Результат части или `size` копий ошибки
+        """
+        generation = order_books.generation(ticker)
+        feed_savepoint = market_feed.savepoint(ticker)
+        events_savepoint = order_events.savepoint(ticker)
+        try:
+            async with session.begin_nested():
+                return await operation()
+        except ValueError as e:
+            if order_books.generation(ticker) != generation:
+                raise
+            market_feed.rollback_to(ticker, feed_savepoint)
+            order_events.rollback_to(ticker, events_savepoint)
+            return [e] * size
+
+    async def _place_limit_orders(self, user_id: str, ticker: str, orders: list[tuple[Direction, int, int]],
+                                  book: OrderBook, session: AsyncSession) -> list[Order | ValueError]:
+        """
+        Выставление пачки лимитных заявок одного пользователя
 
-                # Начисляем тикеры
-                await balance_crud.deposit(
-                    user_id=order.user_id,
-                    ticker=order.ticker,
-                    amount=executed_qty,
-                    async_session=session
-                )
-        else:  # SELL
-            # Разблокируем тикеры у продавца
-            await balance_crud.unblock_assets(
-                user_id=order.user_id,
-                ticker=order.ticker,
-                qty=executed_qty,
-                async_session=session
-            )
+        Доступные балансы читаются один раз и дальше ведутся в памяти: каждая
+        заявка блокирует свою потребность и сразу исполняется против стакана,
+        заявка, которой не хватило средств или которая исполнилась бы против
+        собственной встречной заявки, отклоняется без обращения к БД.
+        Блокировки и расчёты всех заявок копятся в одном `Settlement`, новые
+        заявки записываются одним INSERT, заявки контрагентов - одним UPDATE,
+        поэтому число запросов не зависит от размера пачки.
 
-            # Списываем тикеры
-            await balance_crud.withdraw(
-                user_id=order.user_id,
-                ticker=order.ticker,
-                amount=executed_qty,
-                async_session=session
+        Args:
+            user_id: идентификатор пользователя
+            ticker: тикер инструмента
+            orders: заявки (direction, qty, price)
+            book: захваченный стакан тикера
+            session: сессия БД
+
+        Returns:
+            Для каждой заявки - созданная заявка или ValueError с причиной отказа
+        """
+        available = await balance_crud.get_user_available_balances(user_id, ("RUB", ticker), async_session=session)
+        settlement = Settlement()
+        results: list[Order | ValueError] = []
+        created: list[Order] = []
+        # ID заявки контрагента -> её итоговое состояние после всей пачки
+        counterparty: dict[str, dict] = {}
+
+        for direction, qty, price in orders:
+            is_buy = direction == Direction.BUY
+            asset, required = ("RUB", qty * price) if is_buy else (ticker, qty)
+            if available[asset] < required:
+                results.append(ValueError(f'Недостаточно {asset} на балансе для создания заявки'))
+                continue
+
+            with order_phase_duration.labels('match').time():
+                try:
+                    fills = book.plan(direction=direction, qty=qty, price=price, user_id=user_id)
+                except ValueError as e:
+                    # Сделка с самим собой - отклоняется только эта заявка, стакан не менялся
+                    results.append(e)
+                    continue
+                book.execute(fills)
+            available[asset] -= required
+            settlement.change(user_id, asset, blocked=required)
+            order_fills.observe(len(fills))
+            market_feed.filled(ticker, direction, fills)
+
+            executed_qty = 0
+            for fill in fills:
+                settlement.record(user_id=user_id, ticker=ticker, qty=fill.qty, price=fill.price)
+                # Блокировки снимаются так же, как в `_match_orders`
+                if is_buy:
+                    settlement.trade(ticker=ticker, buyer_id=user_id, seller_id=fill.user_id, qty=fill.qty,
+                                     price=fill.price, buyer_blocked=fill.qty * price, seller_blocked=fill.qty)
+                    available["RUB"] += fill.qty * (price - fill.price)
+                    available[ticker] += fill.qty
+                else:
+                    settlement.trade(ticker=ticker, buyer_id=fill.user_id, seller_id=user_id, qty=fill.qty,
+                                     price=fill.price, buyer_blocked=fill.qty * fill.price, seller_blocked=fill.qty)
+                    available["RUB"] += fill.qty * fill.price
+                status = Status.EXECUTED if fill.is_complete else Status.PARTIALLY_EXECUTED
+                counterparty[fill.order_id] = {'id': fill.order_id, 'filled': fill.filled, 'status': status}
+                order_events.order_changed(ticker, fill.user_id, fill.order_id, status, fill.filled, fill.order_qty)
+                executed_qty += fill.qty
+
+            # ID назначается заранее, чтобы поставить остаток в стакан до записи в БД
+            order = Order(
+                id=str(uuid4()),
+                user_id=user_id,
+                direction=direction,
+                ticker=ticker,
+                qty=qty,
+                price=price,
+                status=await self._determine_order_status(executed_qty, qty),
+                filled=executed_qty
             )
+            book.add(order.id, user_id, direction, price, qty, executed_qty)
+            market_feed.level_changed(ticker, direction, price)
+            order_events.order_changed(ticker, user_id, order.id, order.status, executed_qty, qty)
+            created.append(order)
+            results.append(order)
+
+        with order_phase_duration.labels('persist').time():
+            session.add_all(created)
+            await session.flush()
+            if counterparty:
+                await session.execute(update(Order), list(counterparty.values()))
+        with order_phase_duration.labels('settle').time():
+            await settlement.apply(session)
+        return results
+
+    async def _update_counterparty_order(self, ticker: str, fill: Fill, session: AsyncSession) -> None:
+        """
+        Обновление заявки контрагента
 
-            # Начисляем рубли
-            if order.price is not None:  # Для лимитной заявки
-                await balance_crud.deposit(
-                    user_id=order.user_id,
-                    ticker="RUB",
-                    amount=executed_qty * order.price,
-                    async_session=session
-                )
+        Args:
+            ticker: тикер инструмента
+            fill: исполнение против заявки контрагента
+            session: сессия БД
+        """
+        # Обновляем исполненный объем и статус заявки, балансы меняются в расчёте по заявке
+        status = Status.EXECUTED if fill.is_complete else Status.PARTIALLY_EXECUTED
+        await session.execute(
+            update(Order)
+            .where(Order.id == fill.order_id)
+            .values(filled=fill.filled, status=status)
+        )
+        order_events.order_changed(ticker, fill.user_id, fill.order_id, status, fill.filled, fill.order_qty)
 
     async def _create_cancelled_order(self, user_id: str, direction: Direction, ticker: str, qty: int,
                                       price: int = None, session: AsyncSession = None) -> Order:
@@ -193,7 +311,7 @@ class CRUDOrder(CRUDOrderBase):
         Returns:
             Созданная заявка
         """
-        app_logger.info("create cancel order")
+        matching_logger.debug("create cancel order")
         order = Order(
             user_id=user_id,
             direction=direction,
@@ -203,66 +321,12 @@ class CRUDOrder(CRUDOrderBase):
             status=Status.CANCELLED,
             filled=0
         )
-        session.add(order)
-        await session.flush()
-        await session.commit()
+        with order_phase_duration.labels('persist').time():
+            session.add(order)
+            await session.flush()
+        order_events.order_changed(ticker, user_id, order.id, order.status, 0, qty)
         return order
 
-    async def _create_transaction_and_deposit(self, user_id: str, ticker: str, executable_qty: int,
-                                              price: int, receiver_ticker: str, session: AsyncSession) -> tuple:
-        """
-        Создание транзакции и начисление средств
-
-        Args:
-            user_id: идентификатор пользователя
-            ticker: тикер транзакции
-            executable_qty: исполняемое количество
-            price: цена исполнения
-            receiver_ticker: тикер получателя средств (RUB для продажи, ticker для покупки)
-            session: сессия БД
-
-        Returns:
-            tuple: (сумма транзакции, исполненное количество)
-        """
-        # Проверяем, что количество положительное
-        if executable_qty <= 0:
-            return 0, 0
-
-        # Создаем транзакцию
-        transaction = Transaction(
-            user_id=user_id,
-            ticker=ticker,
-            amount=executable_qty,
-            price=price,
-            timestamp=datetime.utcnow()
-        )
-        session.add(transaction)
-
-        # Делаем flush, чтобы transaction получил id из базы
-        await session.flush()
-
-        # Начисляем средства
-        transaction_amount = executable_qty * price
-
-        if receiver_ticker == "RUB":
-            # Для продажи - начисляем рубли
-            await balance_crud.deposit(
-                user_id=user_id,
-                ticker=receiver_ticker,
-                amount=transaction_amount,
-                async_session=session
-            )
-            return transaction_amount, executable_qty
-        else:
-            # Для покупки - начисляем тикеры
-            await balance_crud.deposit(
-                user_id=user_id,
-                ticker=receiver_ticker,
-                amount=executable_qty,
-                async_session=session
-            )
-            return transaction_amount, executable_qty
-
     async def _create_order(self, user_id: str, direction: Direction, ticker: str,
                             qty: int, price: int, status: Status, filled: int,
                             session: AsyncSession) -> Order:
@@ -291,9 +355,10 @@ class CRUDOrder(CRUDOrderBase):
             status=status,
             filled=filled
         )
-        session.add(order)
-        await session.flush()
-        await session.commit()
+        with order_phase_duration.labels('persist').time():
+            session.add(order)
+            await session.flush()
+        order_events.order_changed(ticker, user_id, order.id, status, filled, qty)
         return order
 
     async def _determine_order_status(self, executed_qty: int, qty: int) -> Status:
@@ -314,140 +379,79 @@ class CRUDOrder(CRUDOrderBase):
         else:
             return Status.PARTIALLY_EXECUTED
 
-    async def _match_orders(self, user_id: str, ticker: str, qty: int, price_levels: list,
-                            is_buy: bool, price: int = None, session: AsyncSession = None) -> tuple:
+    async def _match_orders(self, user_id: str, ticker: str, qty: int, is_buy: bool,
+                            book: OrderBook, price: int = None, fills: list[Fill] = None,
+                            session: AsyncSession = None) -> tuple:
         """
-        Сопоставление заявок - исполнение заявки против существующих в стакане
+        Сопоставление заявок - исполнение заявки против стакана в памяти
 
         Args:
             user_id: идентификатор пользователя
             ticker: тикер инструмента
             qty: требуемое количество для исполнения
-            price_levels: уровни цен стакана (bid_levels для продажи, ask_levels для покупки)
             is_buy: флаг направления (True - покупка, False - продажа)
+            book: стакан тикера
             price: цена нашей заявки (для лимитного ордера)
+            fills: готовый план исполнения из `book.plan` (для рыночного ордера)
             session: сессия БД
 
         Returns:
             tuple: (исполненное количество, потраченная/полученная сумма)
         """
-        app_logger.info("match orders")
+        matching_logger.debug("match orders")
         executed_qty = 0
         total_amount = 0
 
-        if not price_levels:
-            return executed_qty, total_amount
-
         # Направление нашей заявки
         direction = Direction.BUY if is_buy else Direction.SELL
 
-        # Находим заявки контрагентов в БД
-        counterparty_orders = await self._find_matching_orders(
-            ticker=ticker,
-            direction=direction,
-            price=price,
-            session=session
-        )
-
-        # Выполняем заявки контрагентов в соответствии с приоритетом
-        remaining_qty = qty
-
-        # Сначала обрабатываем заявки из базы данных по приоритету цены и времени
-        for counterparty_order in counterparty_orders:
-            if remaining_qty <= 0:
-                break
-
-            # Сколько можно исполнить из этой заявки
-            unfilled_qty = counterparty_order.qty - (counterparty_order.filled or 0)
-            match_qty = min(remaining_qty, unfilled_qty)
-
-            if match_qty <= 0:
-                continue
-
-            # Цена исполнения - цена из заявки контрагента (лучшая цена для нас)
-            execution_price = counterparty_order.price
-
-            # Создаем транзакцию и начисляем средства
-            if is_buy:
-                # Покупка: списываем рубли, начисляем тикеры
-                transaction_amount, exec_qty = await self._create_transaction_and_deposit(
-                    user_id=user_id,
-                    ticker=ticker,
-                    executable_qty=match_qty,
-                    price=execution_price,
-                    receiver_ticker=ticker,  # Покупаем тикер
-                    session=session
-                )
-            else:
-                # Продажа: списываем тикеры, начисляем рубли
-                transaction_amount, exec_qty = await self._create_transaction_and_deposit(
-                    user_id=user_id,
-                    ticker=ticker,
-                    executable_qty=match_qty,
-                    price=execution_price,
-                    receiver_ticker="RUB",  # Получаем рубли
-                    session=session
-                )
-
-            # Обновляем заявку контрагента
-            await self._update_counterparty_order(
-                order=counterparty_order,
-                executed_qty=match_qty,
-                session=session
-            )
-
-            executed_qty += exec_qty
-            total_amount += transaction_amount
-            remaining_qty -= exec_qty
-
-        # Если остается невыполненное количество, выполняем заявки из стакана
-        # Эта часть нужна, если в BD нет соответствующих заявок или их недостаточно
-        if remaining_qty > 0:
-            for level in price_levels:
-                if remaining_qty <= 0:
-                    break
-
-                level_price = level["price"]
-                level_qty = level["qty"]
-
-                # Проверяем, что уровень еще имеет ненулевое количество
-                if level_qty <= 0:
-                    continue
-
-                # Сколько можно исполнить на этом уровне цены
-                executable_qty = min(remaining_qty, level_qty)
-
-                # Создаем транзакцию и начисляем средства
+        # Сопоставление целиком происходит в памяти, в БД пишем только результат
+        with order_phase_duration.labels('match').time():
+            if fills is None:
+                fills = book.plan(direction=direction, qty=qty, price=price, user_id=user_id)
+            book.execute(fills)
+        order_fills.observe(len(fills))
+        market_feed.filled(ticker, direction, fills)
+
+        with order_phase_duration.labels('settle').time():
+            settlement = Settlement()
+            for fill in fills:
+                matching_logger.debug("fill order %s: qty=%s price=%s filled=%s/%s",
+                                      fill.order_id, fill.qty, fill.price, fill.filled, fill.order_qty)
+                settlement.record(user_id=user_id, ticker=ticker, qty=fill.qty, price=fill.price)
+                await self._update_counterparty_order(ticker=ticker, fill=fill, session=session)
+
+                # Обе стороны снимают блокировку с исполненной части: контрагент - по цене
+                # своей заявки, мы - по цене, по которой блокировали (лимитная цена или цена сделки)
                 if is_buy:
-                    # Покупка: списываем рубли, начисляем тикеры
-                    transaction_amount, exec_qty = await self._create_transaction_and_deposit(
-                        user_id=user_id,
+                    settlement.trade(
                         ticker=ticker,
-                        executable_qty=executable_qty,
-                        price=level_price,
-                        receiver_ticker=ticker,  # Покупаем тикер
-                        session=session
+                        buyer_id=user_id,
+                        seller_id=fill.user_id,
+                        qty=fill.qty,
+                        price=fill.price,
+                        buyer_blocked=fill.qty * (price or fill.price),
+                        seller_blocked=fill.qty,
                     )
                 else:
-                    # Продажа: списываем тикеры, начисляем рубли
-                    transaction_amount, exec_qty = await self._create_transaction_and_deposit(
-                        user_id=user_id,
+                    settlement.trade(
                         ticker=ticker,
-                        executable_qty=executable_qty,
-                        price=level_price,
-                        receiver_ticker="RUB",  # Получаем рубли
-                        session=session
+                        buyer_id=fill.user_id,
+                        seller_id=user_id,
+                        qty=fill.qty,
+                        price=fill.price,
+                        buyer_blocked=fill.qty * fill.price,
+                        seller_blocked=fill.qty,
                     )
 
-                # Учитываем исполненное количество и сумму
-                executed_qty += exec_qty
-                total_amount += transaction_amount
-                remaining_qty -= exec_qty
+                executed_qty += fill.qty
+                total_amount += fill.qty * fill.price
 
-        await session.commit()
+            # Сделки и балансы всех участников записываются разом в конце сопоставления
+            await settlement.apply(session)
         return executed_qty, total_amount
 
-    async def _process_sell_order(self, user_id: str, ticker: str, qty: int,
+    async def _process_sell_order(self, user_id: str, ticker: str, qty: int, book: OrderBook,
                                   price: int = None, session: AsyncSession = None) -> Order:
         """
         Обработка заявки на продажу
@@ -456,6 +460,7 @@ class CRUDOrder(CRUDOrderBase):
             user_id: идентификатор пользователя
             ticker: тикер инструмента
             qty: количество
+            book: стакан тикера
             price: цена (для лимитной заявки)
             session: сессия БД
 
@@ -481,29 +486,18 @@ class CRUDOrder(CRUDOrderBase):
         # else:
         #     return await order_crud_v2.sell_limit(user_id=user_id, ticker=ticker, qty=qty, price=price, session=session)
 
-        app_logger.info("start sell")
+        matching_logger.debug("start sell")
         if is_market_order:
-            app_logger.info("start market sell")
-            # 3. Рыночная заявка - проверяем наличие спроса (заявок на покупку)
-            orderbook = await self.get_orderbook(ticker=ticker, session=session, levels=OrderBookScope.BID, user_id=user_id)
-            bid_levels = orderbook["bid_levels"]
-            app_logger.info(f"bid_levels: {bid_levels}")
-            if not bid_levels:
-                # 4. Нет заявок на покупку - отменяем заявку
-                return await self._create_cancelled_order(
-                    user_id=user_id,
-                    direction=Direction.SELL,
-                    ticker=ticker,
-                    qty=qty,
-                    price=None,
-                    session=session
-                )
-
-            # Проверяем, хватит ли заявок на покупку
-            total_available_qty = sum(level["qty"] for level in bid_levels)
-            app_logger.info(f"total_available_qty: {total_available_qty}")
+            matching_logger.debug("start market sell")
+            # 3. Рыночная заявка - набираем план исполнения по лучшим заявкам на покупку,
+            # обход стакана останавливается, как только набрано нужное количество
+            with order_phase_duration.labels('match').time():
+                fills = book.plan(Direction.SELL, qty, user_id=user_id)
+            total_available_qty = sum(fill.qty for fill in fills)
+            matching_logger.debug("total_available_qty: %s", total_available_qty)
             if total_available_qty < qty:
-                app_logger.info("total_available_qty < qty")
+                # 4. Спроса недостаточно - отменяем заявку
+                matching_logger.debug("total_available_qty < qty")
                 return await self._create_cancelled_order(
                     user_id=user_id,
                     direction=Direction.SELL,
@@ -514,29 +508,31 @@ class CRUDOrder(CRUDOrderBase):
                 )
             else:
                 # Блокируем тикеры на балансе для доступного количества
-                await balance_crud.block_assets(
-                    user_id=user_id,
-                    ticker=ticker,
-                    qty=qty,
-                    async_session=session
-                )
+                with order_phase_duration.labels('block').time():
+                    await balance_crud.block_assets(
+                        user_id=user_id,
+                        ticker=ticker,
+                        qty=qty,
+                        async_session=session
+                    )
 
                 # Исполняем заявку на доступное количество
                 executed_qty, total_received = await self._match_orders(
                     user_id=user_id,
                     ticker=ticker,
                     qty=qty,
-                    price_levels=bid_levels,
                     is_buy=False,  # Продажа
+                    book=book,
+                    fills=fills,
                     session=session
                 )
 
                 if executed_qty != qty:
-                    #TODO правльно не сработает, потому что выше мы уже начислили деньги
+                    # Исполненная часть уже рассчитана, снимаем блокировку с остатка
                     await balance_crud.unblock_assets(
                         user_id=user_id,
                         ticker=ticker,
-                        qty=total_available_qty,
+                        qty=qty - executed_qty,
                         async_session=session
                     )
                     return await self._create_cancelled_order(
@@ -548,21 +544,7 @@ class CRUDOrder(CRUDOrderBase):
                         session=session
                     )
 
-                # Разблокируем и списываем тикеры
-                await balance_crud.unblock_assets(
-                    user_id=user_id,
-                    ticker=ticker,
-                    qty=executed_qty,
-                    async_session=session
-                )
-
-                await balance_crud.withdraw(
-                    user_id=user_id,
-                    ticker=ticker,
-                    amount=executed_qty,
-                    async_session=session
-                )
-
+                # Тикеры уже разблокированы и списаны в расчёте по сделкам
                 return await self._create_order(
                     user_id=user_id,
                     direction=Direction.SELL,
@@ -574,64 +556,36 @@ class CRUDOrder(CRUDOrderBase):
                     session=session
                 )
         else:
-            app_logger.info("total_available_qty >= qty")
+            matching_logger.debug("total_available_qty >= qty")
             # Лимитная заявка
             # 4. Блокируем тикеры
-            await balance_crud.block_assets(
-                user_id=user_id,
-                ticker=ticker,
-                qty=qty,
-                async_session=session
-            )
-
-            # 5-6. Сопоставляем данные
-            orderbook = await self.get_orderbook(ticker=ticker, session=session, levels=OrderBookScope.BID, user_id=user_id)
-            # Для продажи ищем заявки на покупку с ценой >= нашей цены (сортируем по убыванию цены)
-            bid_levels = [level for level in orderbook["bid_levels"] if level["price"] >= price]
-
-            # Сортируем по убыванию цены, чтобы продать по наиболее высокой цене сначала
-            bid_levels.sort(key=lambda x: x["price"], reverse=True)
-
-            # Проверяем, достаточно ли встречных заявок на покупку для полного исполнения
-            total_available_qty = sum(level["qty"] for level in bid_levels)
-
-            # Определяем максимальное количество, которое можно исполнить сразу
-            max_executable_qty = min(qty, total_available_qty)
-
+            with order_phase_duration.labels('block').time():
+                await balance_crud.block_assets(
+                    user_id=user_id,
+                    ticker=ticker,
+                    qty=qty,
+                    async_session=session
+                )
 
-            # Исполняем подходящие заявки в пределах доступного количества
+            # 5-6. Сопоставляем с заявками на покупку с ценой >= нашей цены
             executed_qty, total_received = await self._match_orders(
                 user_id=user_id,
                 ticker=ticker,
-                qty=max_executable_qty,  # Используем ограниченное количество
-                price_levels=bid_levels,
+                qty=qty,
                 is_buy=False,  # Продажа
+                book=book,
                 price=price,
                 session=session
             )
 
-            # Разблокируем исполненную часть и списываем тикеры
-            if executed_qty > 0:
-                await balance_crud.unblock_assets(
-                    user_id=user_id,
-                    ticker=ticker,
-                    qty=executed_qty,
-                    async_session=session
-                )
-
-                await balance_crud.withdraw(
-                    user_id=user_id,
-                    ticker=ticker,
-                    amount=executed_qty,
-                    async_session=session
-                )
-
+            # Исполненная часть тикеров разблокирована и списана в расчёте по сделкам,
+            # неисполненный остаток остаётся заблокированным под заявку в стакане
             # Определяем статус заявки
             # Для лимитной заявки: даже если нет исполнения (executed_qty=0), она остаётся активной в статусе NEW
             status = await self._determine_order_status(executed_qty, qty)
 
-            # Создаем заявку
-            return await self._create_order(
+            # Создаем заявку и ставим неисполненный остаток в стакан
+            order = await self._create_order(
                 user_id=user_id,
                 direction=Direction.SELL,
                 ticker=ticker,
@@ -641,8 +595,11 @@ class CRUDOrder(CRUDOrderBase):
                 filled=executed_qty,
                 session=session
             )
+            book.add(order.id, user_id, Direction.SELL, price, qty, executed_qty)
+            market_feed.level_changed(ticker, Direction.SELL, price)
+            return order
 
-    async def _process_buy_order(self, user_id: str, ticker: str, qty: int,
+    async def _process_buy_order(self, user_id: str, ticker: str, qty: int, book: OrderBook,
                                  price: int = None, session: AsyncSession = None) -> Order:
         """
         Обработка заявки на покупку
@@ -651,6 +608,7 @@ class CRUDOrder(CRUDOrderBase):
             user_id: идентификатор пользователя
             ticker: тикер инструмента
             qty: количество
+            book: стакан тикера
             price: цена (для лимитной заявки)
             session: сессия БД
 
@@ -667,12 +625,14 @@ class CRUDOrder(CRUDOrderBase):
         #     return await order_crud_v2.buy_limit(user_id, ticker, qty, price, session)
 
         if is_market_order:
-            # Рыночная заявка - проверяем наличие предложения
-            orderbook = await self.get_orderbook(ticker=ticker, session=session, levels=OrderBookScope.ASK, user_id=user_id)
-            ask_levels = orderbook["ask_levels"]
+            # Рыночная заявка - набираем план исполнения по самым дешёвым заявкам на продажу,
+            # обход стакана останавливается, как только набрано нужное количество
+            with order_phase_duration.labels('match').time():
+                fills = book.plan(Direction.BUY, qty, user_id=user_id)
+            available_qty = sum(fill.qty for fill in fills)
 
-            if not ask_levels:
-                # Нет заявок на продажу - отменяем заявку
+            if available_qty < qty:
+                # Предложения недостаточно - отменяем заявку
                 return await self._create_cancelled_order(
                     user_id=user_id,
                     direction=Direction.BUY,
@@ -683,32 +643,7 @@ class CRUDOrder(CRUDOrderBase):
                 )
 
             # Считаем, сколько рублей потребуется
-            required_amount = 0
-            available_qty = 0
-
-            # Сортируем уровни по возрастанию цены, чтобы покупать сначала по самой низкой цене
-            sorted_ask_levels = sorted(ask_levels, key=lambda x: x["price"])
-
-            for ask_level in sorted_ask_levels:
-                ask_price = ask_level["price"]
-                ask_qty = ask_level["qty"]
-
-                executable_qty = min(qty - available_qty, ask_qty)
-                required_amount += executable_qty * ask_price
-                available_qty += executable_qty
-
-                if available_qty >= qty:
-                    break
-
-            if available_qty < qty:
-                return await self._create_cancelled_order(
-                    user_id=user_id,
-                    direction=Direction.BUY,
-                    ticker=ticker,
-                    qty=qty,
-                    price=None,
-                    session=session
-                )
+            required_amount = sum(fill.qty * fill.price for fill in fills)
 
             # Для полного исполнения рыночного ордера, когда в стакане достаточно заявок на продажу
 
@@ -723,28 +658,31 @@ class CRUDOrder(CRUDOrderBase):
                 raise ValueError('Недостаточно RUB на балансе для выполнения заявки')
 
             # Блокируем рубли на балансе
-            await balance_crud.block_funds(
-                user_id=user_id,
-                ticker="RUB",
-                amount=required_amount,
-                async_session=session
-            )
+            with order_phase_duration.labels('block').time():
+                await balance_crud.block_funds(
+                    user_id=user_id,
+                    ticker="RUB",
+                    amount=required_amount,
+                    async_session=session
+                )
 
             # Исполняем заявку полностью
             executed_qty, spent_amount = await self._match_orders(
                 user_id=user_id,
                 ticker=ticker,
                 qty=qty,
-                price_levels=sorted_ask_levels,
                 is_buy=True,
+                book=book,
+                fills=fills,
                 session=session
             )
 
             if executed_qty != qty:
+                # Потраченное уже рассчитано, снимаем блокировку с остатка
                 await balance_crud.unblock_funds(
                     user_id=user_id,
                     ticker="RUB",
-                    amount=required_amount,
+                    amount=required_amount - spent_amount,
                     async_session=session
                 )
                 return await self._create_cancelled_order(
@@ -756,21 +694,7 @@ class CRUDOrder(CRUDOrderBase):
                     session=session
                 )
 
-            # Разблокируем рубли и списываем потраченные
-            await balance_crud.unblock_funds(
-                user_id=user_id,
-                ticker="RUB",
-                amount=required_amount,
-                async_session=session
-            )
-
-            await balance_crud.withdraw(
-                user_id=user_id,
-                ticker="RUB",
-                amount=spent_amount,
-                async_session=session
-            )
-
+            # Рубли разблокированы и списаны в расчёте по сделкам
             # Создаем исполненную заявку
             return await self._create_order(
                 user_id=user_id,
@@ -798,74 +722,33 @@ class CRUDOrder(CRUDOrderBase):
                 raise ValueError('Недостаточно RUB на балансе для создания заявки')
 
             # Блокируем рубли
-            await balance_crud.block_funds(
-                user_id=user_id,
-                ticker="RUB",
-                amount=required_amount,
-                async_session=session
-            )
-
-            # Проверяем, можно ли исполнить заявку сразу
-            orderbook = await self.get_orderbook(ticker=ticker, session=session, levels=OrderBookScope.ASK, user_id=user_id)
-
-            # Для покупки ищем заявки на продажу с ценой <= нашей цены
-            ask_levels = [level for level in orderbook["ask_levels"] if level["price"] <= price]
-
-            # Сортируем по возрастанию цены, чтобы покупать сначала по самой низкой цене
-            ask_levels.sort(key=lambda x: x["price"])
-
-            # Проверяем, достаточно ли тикеров в стакане для полного исполнения заявки
-            total_available_qty = sum(level["qty"] for level in ask_levels)
-
-            # Определяем максимальное количество, которое можно исполнить
-            # Если доступных тикеров меньше, чем запрошено, ограничиваем исполняемое количество
-            max_executable_qty = min(qty, total_available_qty)
+            with order_phase_duration.labels('block').time():
+                await balance_crud.block_funds(
+                    user_id=user_id,
+                    ticker="RUB",
+                    amount=required_amount,
+                    async_session=session
+                )
 
-            # Исполняем подходящие заявки в пределах доступного количества
+            # Исполняем сразу против заявок на продажу с ценой <= нашей цены
             executed_qty, spent_amount = await self._match_orders(
                 user_id=user_id,
                 ticker=ticker,
-                qty=max_executable_qty,  # Используем ограниченное количество
-                price_levels=ask_levels,
+                qty=qty,
                 is_buy=True,  # Покупка
+                book=book,
                 price=price,
                 session=session
             )
 
-            # Разблокируем только часть средств, которая была фактически потрачена
-            if executed_qty > 0:
-                # Разблокируем сначала всю заблокированную сумму
-                await balance_crud.unblock_funds(
-                    user_id=user_id,
-                    ticker="RUB",
-                    amount=required_amount,
-                    async_session=session
-                )
-
-                # Списываем фактически потраченные средства
-                await balance_crud.withdraw(
-                    user_id=user_id,
-                    ticker="RUB",
-                    amount=spent_amount,
-                    async_session=session
-                )
-
-                # Если есть неисполненная часть заявки, блокируем средства заново только для оставшихся тикеров
-                remaining_qty = qty - executed_qty
-                if remaining_qty > 0:
-                    remaining_amount_to_block = remaining_qty * price
-                    await balance_crud.block_funds(
-                        user_id=user_id,
-                        ticker="RUB",
-                        amount=remaining_amount_to_block,
-                        async_session=session
-                    )
+            # Расчёт по сделкам списал потраченное и снял блокировку с исполненной части
+            # по нашей цене, под неисполненный остаток остаётся remaining_qty * price
 
             # Определяем статус заявки
             status = await self._determine_order_status(executed_qty, qty)
 
-            # Создаем заявку
-            return await self._create_order(
+            # Создаем заявку и ставим неисполненный остаток в стакан
+            order = await self._create_order(
                 user_id=user_id,
                 direction=Direction.BUY,
                 ticker=ticker,
@@ -875,11 +758,49 @@ class CRUDOrder(CRUDOrderBase):
                 filled=executed_qty,
                 session=session
             )
+            book.add(order.id, user_id, Direction.BUY, price, qty, executed_qty)
+            market_feed.level_changed(ticker, Direction.BUY, price)
+            return order
+
+    async def get_user_order_tickers(self, user_id: str, session: AsyncSession) -> list[str]:
+        """Тикеры, по которым у пользователя есть заявки в стакане"""
+        result = await session.execute(
+            select(Order.ticker).distinct().where(
+                Order.user_id == user_id,
+                Order.status.in_([Status.NEW, Status.PARTIALLY_EXECUTED]),
+            )
+        )
+        return list(result.scalars())
+
+    async def cancel_user_orders(self, user_id: str, ticker: str, session: AsyncSession = None) -> int:
+        """
+        Отмена всех заявок пользователя в стакане тикера
+
+        Операция очереди тикера: вызывается через `order_sequencer.submit`, как
+        и отмена одной заявки, поэтому стакан меняет только обработчик очереди,
+        а события публикуются после COMMIT этой операции.
+
+        Args:
+            user_id: идентификатор пользователя
+            ticker: тикер инструмента
+            session: сессия БД
 
-    async def cancel_user_orders(self, user_id: str, session: AsyncSession = None):
-        orders = await self.get_user_orders(user_id, session)
-        for order in orders:
-            await self._cancel_order(order, session)
+        Returns:
+            Количество отменённых заявок
+        """
+        async with order_books.acquire(ticker, session) as book:
+            # Отменять есть что только у заявок стакана, история не читается
+            result = await session.execute(
+                select(Order).where(
+                    Order.user_id == user_id,
+                    Order.ticker == ticker,
+                    Order.status.in_([Status.NEW, Status.PARTIALLY_EXECUTED]),
+                )
+            )
+            orders = result.scalars().all()
+            for order in orders:
+                await self._cancel_locked_order(order, book, session)
+        return len(orders)
 
     async def cancel_order(self, order_id: str, session: AsyncSession) -> Order:
         """
@@ -905,12 +826,23 @@ class CRUDOrder(CRUDOrderBase):
         return await self._cancel_order(order, session)
 
     async def _cancel_order(self, order: Order, session: AsyncSession) -> Order:
+        async with order_books.acquire(order.ticker, session) as book:
+            # Заявка могла исполниться, пока мы ждали доступа к стакану
+            await session.refresh(order)
+            return await self._cancel_locked_order(order, book, session)
+
+    async def _cancel_locked_order(self, order: Order, book: OrderBook,
+                                   session: AsyncSession) -> Order:
         # Определяем количество невыполненных активов/средств
         unfilled_qty = order.qty - (order.filled or 0)
 
         if unfilled_qty <= 0:
             raise ValueError('В заявке нет невыполненной части для отмены')
 
+        # Снимаем заявку со стакана
+        book.remove(order.id)
+        market_feed.level_changed(order.ticker, order.direction, order.price)
+
         # Разблокируем средства в зависимости от направления заявки
         if order.direction == Direction.SELL:
             # Разблокировка тикеров при отмене заявки на продажу
@@ -953,7 +885,9 @@ class CRUDOrder(CRUDOrderBase):
 
         # Обновляем статус заявки
         order.status = Status.CANCELLED
-        await session.commit()
+        await session.flush()
+        order_events.order_changed(order.ticker, order.user_id, order.id, order.status,
+                                   order.filled or 0, order.qty)
 
         return order
 
@@ -1,17 +1,18 @@
 import json
-import sys
 from typing import Sequence
 
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, and_, or_, asc, update, desc
-from datetime import datetime
 
-from app.core.logs import error_log, app_logger
+from app.core.logs import error_log, matching_logger
 from app.crud.v1.order.base import CRUDOrderBase
+from app.crud.v1.order.fill_calculator import calculate_fill
+from app.crud.v1.order.order_book import order_books
+from app.crud.v1.order.order_events import order_events
+from app.crud.v1.order.settlement import Settlement
 from app.crud.v1.balance import balance_crud
 from app.models.order import Order, Status, Direction
-from app.models.transaction import Transaction
 
 
 class CRUDOrderV2(CRUDOrderBase):
@@ -24,7 +25,7 @@ class CRUDOrderV2(CRUDOrderBase):
             ticker: str,
             qty: int,
             session: AsyncSession) -> Order:
-        app_logger.error("start market buy order")
+        matching_logger.debug("start market buy order")
         # Находим заявки контрагентов в БД
         counterparty_orders = await self._get_sell_orders(
             ticker=ticker,
@@ -32,17 +33,20 @@ class CRUDOrderV2(CRUDOrderBase):
             session=session
         )
 
-        user_balance = await balance_crud.get_user_ticker_balance(user_id, ticker="RUB", session=session)
+        # Рубли рыночной заявки не блокируются, бюджет - доступный остаток,
+        # итоговое списание всё равно проверяется при расчёте
+        user_balance = await balance_crud.get_user_available_balance(user_id, ticker="RUB", async_session=session)
 
         # Выполняем заявки контрагентов в соответствии с приоритетом
         remaining_qty = qty
         remaining_balance = user_balance
 
+        settlement = Settlement()
         # Сначала обрабатываем заявки из базы данных по приоритету цены и времени
         for counterparty_order in counterparty_orders:
 
-            app_logger.info(
-                f"exec remaining_qty: {remaining_qty}, counterparty_order: {counterparty_order.__dict__}")
+            matching_logger.debug("exec remaining_qty: %s, counterparty_order: %s",
+                                  remaining_qty, counterparty_order.__dict__)
 
             if remaining_qty <= 0:
                 break
@@ -53,35 +57,32 @@ class CRUDOrderV2(CRUDOrderBase):
                 max_price=remaining_balance,
                 session=session)
 
-            success_buy = await balance_crud.try_block_and_buy(
-                user_buy_id=user_id,
-                ticker_user_buy="RUB",
-                amount_user_buy=buy_count * counterparty_order.price,
-
-                user_sell_id=counterparty_order.user_id,
-                ticker_user_sell=ticker,
-                amount_user_sell=buy_count,
+            if buy_count <= 0:
+                continue
 
-                session=session
+            # Рубли рыночной заявки не блокировались, продавец снимает блокировку тикеров
+            settlement.trade(
+                ticker=ticker,
+                buyer_id=user_id,
+                seller_id=counterparty_order.user_id,
+                qty=buy_count,
+                price=counterparty_order.price,
+                seller_blocked=buy_count,
             )
-            if not success_buy:
-                await self._release_fill(counterparty_order.id, buy_count, session)
-                continue
 
-            transaction = Transaction(
+            settlement.record(
                 user_id=user_id,
                 ticker=ticker,
-                amount=buy_count,
+                qty=buy_count,
                 price=counterparty_order.price,
-                timestamp=datetime.utcnow()
             )
-            session.add(transaction)
-            await session.flush()
-            # TODO откатить транзакцию, если будут с этим проблемы
 
             remaining_qty -= buy_count
             remaining_balance -= buy_count * counterparty_order.price
 
+        # Сделки и балансы всех участников записываются разом в конце сопоставления
+        await settlement.apply(session)
+
         if len(counterparty_orders) == 0:
             return await self._create_order(
                 user_id=user_id,
@@ -125,7 +126,7 @@ class CRUDOrderV2(CRUDOrderBase):
             qty: int,
             price: int,
             session: AsyncSession) -> Order:
-        app_logger.error("start buy limit")
+        matching_logger.debug("start buy limit")
 
         success_block = await balance_crud.try_block_ticker(user_id, ticker="RUB", amount=qty * price, session=session)
         if not success_block:
@@ -142,10 +143,11 @@ class CRUDOrderV2(CRUDOrderBase):
         # Выполняем заявки контрагентов в соответствии с приоритетом
         remaining_qty = qty
         remaining_balance = qty * price
+        settlement = Settlement()
         # Сначала обрабатываем заявки из базы данных по приоритету цены и времени
         for counterparty_order in counterparty_orders:
-            app_logger.info(
-                f"exec remaining_qty: {remaining_qty}, counterparty_order: {counterparty_order.__dict__}")
+            matching_logger.debug("exec remaining_qty: %s, counterparty_order: %s",
+                                  remaining_qty, counterparty_order.__dict__)
 
             if remaining_qty <= 0:
                 break
@@ -156,35 +158,32 @@ class CRUDOrderV2(CRUDOrderBase):
                 max_price=remaining_balance,
                 session=session)
 
-            success_buy = await balance_crud.commit_buy(
-                user_buy_id=user_id,
-                ticker_user_buy="RUB",
-                amount_user_buy=buy_count * counterparty_order.price,
-
-                user_sell_id=counterparty_order.user_id,
-                ticker_user_sell=ticker,
-                amount_user_sell=buy_count,
+            if buy_count <= 0:
+                continue
 
-                session=session
+            settlement.trade(
+                ticker=ticker,
+                buyer_id=user_id,
+                seller_id=counterparty_order.user_id,
+                qty=buy_count,
+                price=counterparty_order.price,
+                buyer_blocked=buy_count * counterparty_order.price,
+                seller_blocked=buy_count,
             )
-            if not success_buy:
-                await self._release_fill(counterparty_order.id, buy_count, session)
-                continue
 
-            transaction = Transaction(
+            settlement.record(
                 user_id=user_id,
                 ticker=ticker,
-                amount=buy_count,
+                qty=buy_count,
                 price=counterparty_order.price,
-                timestamp=datetime.utcnow()
             )
-            session.add(transaction)
-            await session.flush()
 
             remaining_qty -= buy_count
             remaining_balance -= buy_count * counterparty_order.price
 
-        app_logger.error("2")
+        # Сделки и балансы всех участников записываются разом в конце сопоставления
+        await settlement.apply(session)
+
         if len(counterparty_orders) == 0:
             return await self._create_order(
                 user_id=user_id,
@@ -227,7 +226,7 @@ class CRUDOrderV2(CRUDOrderBase):
             ticker: str,
             qty: int,
             session: AsyncSession) -> Order:
-        app_logger.info(f"start market sell order")
+        matching_logger.debug("start market sell order")
 
         success_block = await balance_crud.try_block_ticker(user_id, ticker=ticker, amount=qty, session=session)
         if not success_block:
@@ -243,10 +242,11 @@ class CRUDOrderV2(CRUDOrderBase):
         # Выполняем заявки контрагентов в соответствии с приоритетом
         remaining_qty = qty
 
+        settlement = Settlement()
         # Сначала обрабатываем заявки из базы данных по приоритету цены и времени
         for counterparty_order in counterparty_orders:
-            app_logger.info(
-                f"exec remaining_qty: {remaining_qty}, counterparty_order: {counterparty_order.__dict__}")
+            matching_logger.debug("exec remaining_qty: %s, counterparty_order: %s",
+                                  remaining_qty, counterparty_order.__dict__)
             if remaining_qty <= 0:
                 break
 
@@ -255,37 +255,35 @@ class CRUDOrderV2(CRUDOrderBase):
             sell_count = await self._try_fill(
                 counterparty_order.id,
                 remaining_qty,
-                max_price=sys.maxsize,
+                max_price=None,
                 session=session)
-            app_logger.info(f"sell_count: {sell_count}")
-
-            success_buy = await balance_crud.commit_buy(
-                user_buy_id=counterparty_order.user_id,
-                ticker_user_buy="RUB",
-                amount_user_buy=sell_count * counterparty_order.price,
+            matching_logger.debug("sell_count: %s", sell_count)
 
-                user_sell_id=user_id,
-                ticker_user_sell=ticker,
-                amount_user_sell=sell_count,
+            if sell_count <= 0:
+                continue
 
-                session=session
+            settlement.trade(
+                ticker=ticker,
+                buyer_id=counterparty_order.user_id,
+                seller_id=user_id,
+                qty=sell_count,
+                price=counterparty_order.price,
+                buyer_blocked=sell_count * counterparty_order.price,
+                seller_blocked=sell_count,
             )
-            if not success_buy:
-                await self._release_fill(counterparty_order.id, sell_count, session)
-                continue
 
-            transaction = Transaction(
+            settlement.record(
                 user_id=counterparty_order.user_id,
                 ticker=ticker,
-                amount=sell_count,
+                qty=sell_count,
                 price=counterparty_order.price,
-                timestamp=datetime.utcnow()
             )
-            session.add(transaction)
-            await session.flush()
 
             remaining_qty -= sell_count
 
+        # Сделки и балансы всех участников записываются разом в конце сопоставления
+        await settlement.apply(session)
+
         if len(counterparty_orders) == 0:
             return await self._create_order(
                 user_id=user_id,
@@ -328,7 +326,7 @@ class CRUDOrderV2(CRUDOrderBase):
             qty: int,
             price: int,
             session: AsyncSession) -> Order:
-        app_logger.info("start limit sell order")
+        matching_logger.debug("start limit sell order")
 
         success_block = await balance_crud.try_block_ticker(user_id, ticker=ticker, amount=qty, session=session)
         if not success_block:
@@ -345,51 +343,49 @@ class CRUDOrderV2(CRUDOrderBase):
         # Выполняем заявки контрагентов в соответствии с приоритетом
         remaining_qty = qty
 
+        settlement = Settlement()
         # Сначала обрабатываем заявки из базы данных по приоритету цены и времени
         for counterparty_order in counterparty_orders:
-            app_logger.info(
-                f"exec remaining_qty: {remaining_qty}, counterparty_order: {counterparty_order.__dict__}")
+            matching_logger.debug("exec remaining_qty: %s, counterparty_order: %s",
+                                  remaining_qty, counterparty_order.__dict__)
             if remaining_qty <= 0:
                 break
 
             sell_count = await self._try_fill(
                 counterparty_order.id,
                 max_amount=remaining_qty,
-                max_price=sys.maxsize,
+                max_price=None,
                 session=session)
-            app_logger.info(f"sell_count: {sell_count}")
-
-            success_buy = await balance_crud.commit_buy(
-                user_buy_id=counterparty_order.user_id,
-                ticker_user_buy="RUB",
-                amount_user_buy=sell_count * counterparty_order.price,
+            matching_logger.debug("sell_count: %s", sell_count)
 
-                user_sell_id=user_id,
-                ticker_user_sell=ticker,
-                amount_user_sell=sell_count,
+            if sell_count <= 0:
+                continue
 
-                session=session
+            settlement.trade(
+                ticker=ticker,
+                buyer_id=counterparty_order.user_id,
+                seller_id=user_id,
+                qty=sell_count,
+                price=counterparty_order.price,
+                buyer_blocked=sell_count * counterparty_order.price,
+                seller_blocked=sell_count,
             )
-            if not success_buy:
-                await self._release_fill(counterparty_order.id, sell_count, session)
-                continue
-            app_logger.info(f"commit_buy")
 
-            transaction = Transaction(
+            settlement.record(
                 user_id=counterparty_order.user_id,
                 ticker=ticker,
-                amount=sell_count,
+                qty=sell_count,
                 price=counterparty_order.price,
-                timestamp=datetime.utcnow()
             )
-            session.add(transaction)
-            await session.flush()
 
             remaining_qty -= sell_count
 
-        app_logger.info(f"finish remaining_qty: {remaining_qty}")
+        # Сделки и балансы всех участников записываются разом в конце сопоставления
+        await settlement.apply(session)
+
+        matching_logger.debug("finish remaining_qty: %s", remaining_qty)
         if len(counterparty_orders) == 0:
-            app_logger.info(f"create empty order")
+            matching_logger.debug("create empty order")
             return await self._create_order(
                 user_id=user_id,
                 direction=Direction.SELL,
@@ -402,7 +398,7 @@ class CRUDOrderV2(CRUDOrderBase):
             )
 
         if remaining_qty == 0:
-            app_logger.info(f"create executed order")
+            matching_logger.debug("create executed order")
             return await self._create_order(
                 user_id=user_id,
                 direction=Direction.SELL,
@@ -414,7 +410,7 @@ class CRUDOrderV2(CRUDOrderBase):
                 session=session
             )
         if remaining_qty > 0:
-            app_logger.info(f"create PARTIALLY_EXECUTED order")
+            matching_logger.debug("create PARTIALLY_EXECUTED order")
             await balance_crud.release_ticker(user_id, ticker=ticker, amount=remaining_qty, session=session)
             return await self._create_order(
                 user_id=user_id,
@@ -567,72 +563,41 @@ class CRUDOrderV2(CRUDOrderBase):
             self,
             order_id: str,
             max_amount: int,
-            max_price: int,
+            max_price: int | None,
             session: AsyncSession) -> int:
+        order = (await session.execute(
+            select(self.model)
+            .where(and_(self.model.id == order_id,
+                        or_(self.model.status == Status.NEW,
+                            self.model.status == Status.PARTIALLY_EXECUTED)))
+            .with_for_update()
+        )).scalar_one_or_none()
+
+        if not order:
+            matching_logger.debug("not order:%s", order_id)
+            return 0
+
+        matching_logger.debug("try fill order:%s", order.__dict__)
+        ostatok = order.qty - order.filled
+        block, _ = calculate_fill(ostatok, max_amount, order.price, budget=max_price)
+        matching_logger.debug("block with price:%s", block)
+        if block <= 0:
+            return 0
+
+        status = Status.EXECUTED if ostatok - block == 0 else Status.PARTIALLY_EXECUTED
         try:
-            order = (await session.execute(
-                select(self.model)
-                .where(and_(self.model.id == order_id,
-                            or_(self.model.status == Status.NEW,
-                                self.model.status == Status.PARTIALLY_EXECUTED)))
-                .with_for_update()
-            )).scalar_one_or_none()
-
-            if not order:
-                app_logger.info(f"not order:{order_id}")
-                return 0
-
-            app_logger.info(f"try fill order:{order.__dict__}")
-            ostatok = order.qty - order.filled
-            block = min(ostatok, max_amount)
-            app_logger.info(f"block without price:{block}")
-
-            while block * order.price > max_price:
-                block -= 1
-            app_logger.info(f"block with price:{block}")
-            if block <= 0:
-                return 0
-
-            if ostatok - block == 0:
-                (await session.execute(
+            # Неудачное исполнение откатывается до точки сохранения, не ломая транзакцию заявки
+            async with session.begin_nested():
+                await session.execute(
                     update(self.model)
                     .where(and_(self.model.id == order.id))
-                    .values(filled=self.model.filled + block, status=Status.EXECUTED)
-                    .returning(self.model)
-                )).scalar_one()
-            else:
-                (await session.execute(
-                    update(self.model)
-                    .where(and_(self.model.id == order.id))
-                    .values(filled=self.model.filled + block, status=Status.PARTIALLY_EXECUTED)
-                    .returning(self.model)
-                )).scalar_one()
-
-            await session.commit()
-            return block
-        except IntegrityError as e:
-            await session.rollback()
+                    .values(filled=self.model.filled + block, status=status)
+                )
+        except IntegrityError:
             return 0
-
-    async def _release_fill(
-            self,
-            order_id: str,
-            qty: int,
-            session: AsyncSession):
-        try:
-            order = (await session.execute(
-                update(self.model)
-                .where(and_(self.model.id == order_id))
-                .values(filled=self.model.filled - qty)
-                .returning(self.model)
-            )).scalar_one()
-            if order.status != Status.CANCELLED:
-                order.status = Status.PARTIALLY_EXECUTED
-
-            await session.commit()
-        except IntegrityError as e:
-            await session.rollback()
-            raise e
+        order_events.order_changed(order.ticker, order.user_id, order.id, status,
+                                   order.filled + block, order.qty)
+        return block
 
     async def _create_order(self, user_id: str, direction: Direction, ticker: str,
                             qty: int, price: int, status: Status, filled: int,
@@ -664,7 +629,8 @@ class CRUDOrderV2(CRUDOrderBase):
         )
         session.add(order)
         await session.flush()
-        await session.commit()
+        # V2 сопоставляет заявки напрямую в БД, стакан в памяти больше не актуален
+        order_books.invalidate(ticker)
         return order
 
 
@@ -0,0 +1,20 @@
+def calculate_fill(available: int, wanted: int, price: int,
+                   budget: int | None = None) -> tuple[int, int]:
+    """
+    Сколько можно исполнить против одной встречной заявки
+
+    Args:
+        available: неисполненный остаток встречной заявки
+        wanted: сколько ещё нужно исполнить по входящей заявке
+        price: цена встречной заявки
+        budget: сколько рублей можно потратить (None - без ограничения)
+
+    Returns:
+        tuple: (исполняемое количество, его стоимость)
+    """
+    qty = min(available, wanted)
+    if budget is not None and price > 0:
+        # Наибольшее количество, стоимость которого укладывается в бюджет
+        qty = min(qty, budget // price)
+    qty = max(qty, 0)
+    return qty, qty * price
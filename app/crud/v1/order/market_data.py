@@ -2,6 +2,7 @@ from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.logs import error_log
+from app.crud.v1.order.order_book import order_books
 from app.models import Order
 from app.models.order import Direction, Status, OrderBookScope
 
@@ -27,6 +28,15 @@ async def get_orderbook(
     Returns:
         Словарь с уровнями спроса (bid) и предложения (ask)
     """
+    if user_id is None:
+        # Общий стакан отдаём из кеша; при промахе он поднимается из БД
+        book = await order_books.get(ticker, session)
+        return {
+            "bid_levels": book.levels(Direction.BUY, limit or None)
+            if levels in (OrderBookScope.ALL, OrderBookScope.BID) else [],
+            "ask_levels": book.levels(Direction.SELL, limit or None)
+            if levels in (OrderBookScope.ALL, OrderBookScope.ASK) else [],
+        }
 
     bids = []
     asks = []
@@ -0,0 +1,187 @@
+import asyncio
+from datetime import datetime, timezone
+
+import orjson
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.core.config import settings
+from app.core.db import AsyncSessionLocal
+from app.core.logs import app_logger
+from app.core.metrics import register_callback
+from app.crud.v1.order.order_book import Fill, order_books
+from app.models.order import Direction
+
+# Маркер в очереди подписчика: накопленные обновления сброшены, нужен новый снимок
+RESYNC = None
+
+
+class Subscription:
+    """Очередь сообщений одного подписчика на тикер"""
+
+    def __init__(self, ticker: str, max_pending: int):
+        self.ticker = ticker
+        self.queue: asyncio.Queue[tuple[int, str] | None] = asyncio.Queue(max_pending)
+
+    def push(self, message: tuple[int, str] | None) -> None:
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # Клиент не успевает читать: вместо накопленных обновлений отдадим ему свежий снимок
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC)
+
+
+class _Staged:
+    """Изменения стакана одной операции, ещё не зафиксированные в БД"""
+    __slots__ = ('levels', 'trades')
+
+    def __init__(self):
+        self.levels: set[tuple[Direction, int]] = set()
+        self.trades: list[dict] = []
+
+
+class MarketFeed:
+    """
+    Поток рыночных данных по тикерам: снимок стакана плюс инкрементальные обновления.
+
+    CRUD-операции над заявками отмечают затронутые ценовые уровни и сделки,
+    но только для тикеров, у которых есть подписчики, поэтому без подписчиков
+    поток ничего не стоит. Обработчик очереди тикера публикует отмеченное
+    одним сообщением после COMMIT операции, так что клиенты не видят
+    изменений, которые затем откатились.
+
+    Обновление несёт абсолютный остаток каждого затронутого уровня (0 - уровень
+    исчез) и порядковый номер `seq`. Снимок несёт номер, на котором он снят:
+    клиент применяет к нему обновления с большим номером. Если стакан был
+    сброшен или клиент отстал, ему приходит новый снимок.
+    """
+
+    def __init__(self, session_factory: async_sessionmaker[AsyncSession] = AsyncSessionLocal,
+                 max_pending: int = 1000):
+        self._session_factory = session_factory
+        self.max_pending = max_pending
+        self._subscribers: dict[str, set[Subscription]] = {}
+        self._staged: dict[str, _Staged] = {}
+        self._seq: dict[str, int] = {}
+        order_books.on_invalidate(self.resync)
+
+    def subscribe(self, ticker: str) -> Subscription:
+        subscription = Subscription(ticker, self.max_pending)
+        self._subscribers.setdefault(ticker, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        subscribers = self._subscribers.get(subscription.ticker)
+        if subscribers is None:
+            return
+        subscribers.discard(subscription)
+        if not subscribers:
+            del self._subscribers[subscription.ticker]
+            self._staged.pop(subscription.ticker, None)
+
+    def subscribers(self) -> int:
+        return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    async def snapshot(self, ticker: str) -> tuple[int, str]:
+        """Полный стакан тикера и номер последнего опубликованного обновления"""
+        book = order_books.peek(ticker)
+        if book is None:
+            async with self._session_factory() as session:
+                book = await order_books.get(ticker, session)
+        # Между чтением стакана и номера нет await - они согласованы
+        seq = self._seq.get(ticker, 0)
+        return seq, orjson.dumps({
+            "type": "snapshot",
+            "ticker": ticker,
+            "seq": seq,
+            "bids": book.levels(Direction.BUY),
+            "asks": book.levels(Direction.SELL),
+        }).decode()
+
+    def _stage(self, ticker: str) -> _Staged | None:
+        if ticker not in self._subscribers:
+            return None
+        staged = self._staged.get(ticker)
+        if staged is None:
+            staged = self._staged[ticker] = _Staged()
+        return staged
+
+    def level_changed(self, ticker: str, direction: Direction, price: int | None) -> None:
+        """Заявка встала в стакан или снята с него"""
+        staged = self._stage(ticker)
+        if staged is not None and price is not None:
+            staged.levels.add((direction, price))
+
+    def filled(self, ticker: str, taker_direction: Direction, fills: list[Fill]) -> None:
+        """Входящая заявка исполнилась против заявок стакана"""
+        staged = self._stage(ticker)
+        if staged is None or not fills:
+            return
+        timestamp = datetime.now(timezone.utc).isoformat()
+        for fill in fills:
+            staged.levels.add((fill.direction, fill.price))
+            staged.trades.append({
+                "price": fill.price,
+                "qty": fill.qty,
+                "side": taker_direction.value,
+                "timestamp": timestamp,
+            })
+
+    def publish(self, ticker: str) -> None:
+        """Рассылает изменения зафиксированной операции"""
+        staged = self._staged.pop(ticker, None)
+        subscribers = self._subscribers.get(ticker)
+        if staged is None or not subscribers:
+            return
+        book = order_books.peek(ticker)
+        if book is None:
+            self.resync(ticker)
+            return
+
+        update = {"type": "update", "ticker": ticker, "seq": 0, "bids": [], "asks": [], "trades": staged.trades}
+        for direction, price in sorted(staged.levels, key=lambda level: (level[0].value, level[1])):
+            side = update["bids"] if direction == Direction.BUY else update["asks"]
+            side.append({"price": price, "qty": book.level_qty(direction, price)})
+        seq = update["seq"] = self._seq[ticker] = self._seq.get(ticker, 0) + 1
+        # Сообщение сериализуется один раз и расходится всем подписчикам
+        message = (seq, orjson.dumps(update).decode())
+        for subscription in subscribers:
+            subscription.push(message)
+
+    def discard(self, ticker: str) -> None:
+        """Операция откатилась - её изменения не публикуются"""
+        self._staged.pop(ticker, None)
+
+    def savepoint(self, ticker: str) -> int:
+        """Отметка в накопленных сделках операции перед частью, которая может откатиться"""
+        staged = self._staged.get(ticker)
+        return len(staged.trades) if staged is not None else 0
+
+    def rollback_to(self, ticker: str, savepoint: int) -> None:
+        """
+        Часть операции после отметки откатилась - её сделки не публикуются.
+
+        Затронутые ею уровни остаются отмеченными: обновление несёт их
+        фактический остаток в стакане, лишний уровень клиенту не вредит.
+        """
+        staged = self._staged.get(ticker)
+        if staged is not None:
+            del staged.trades[savepoint:]
+
+    def resync(self, ticker: str) -> None:
+        """Стакан в памяти сброшен - подписчики получат новый снимок"""
+        self._staged.pop(ticker, None)
+        for subscription in self._subscribers.get(ticker, ()):
+            subscription.push(RESYNC)
+        if ticker in self._subscribers:
+            app_logger.info(f"market feed {ticker} resync")
+
+
+market_feed = MarketFeed(max_pending=settings.market_data.max_pending)
+
+register_callback(
+    'market_feed_subscribers',
+    'Подписчики потока рыночных данных',
+    lambda: [((), market_feed.subscribers())],
+)
@@ -0,0 +1,402 @@
+import asyncio
+from bisect import bisect_left, insort
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from itertools import islice
+from typing import AsyncIterator, Callable, Iterator
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.logs import app_logger
+from app.core.metrics import register_callback
+from app.crud.v1.order.fill_calculator import calculate_fill
+from app.models.order import Order, Status, Direction
+
+
+@dataclass(slots=True)
+class BookOrder:
+    """Лимитная заявка, стоящая в стакане"""
+    order_id: str
+    user_id: str
+    direction: Direction
+    price: int
+    qty: int
+    filled: int = 0
+
+    @property
+    def remaining(self) -> int:
+        return self.qty - self.filled
+
+
+@dataclass(slots=True)
+class Fill:
+    """Результат исполнения против одной встречной заявки"""
+    order_id: str
+    user_id: str
+    direction: Direction
+    price: int
+    qty: int
+    filled: int
+    order_qty: int
+
+    @property
+    def is_complete(self) -> bool:
+        return self.filled >= self.order_qty
+
+
+class _BookSide:
+    """
+    Одна сторона стакана: отсортированные цены, FIFO-очереди на каждом уровне
+    и агрегированный остаток уровня, который поддерживается инкрементально
+    """
+
+    def __init__(self, descending: bool):
+        self.descending = descending
+        self.prices: list[int] = []
+        self.levels: dict[int, deque[BookOrder]] = {}
+        self.totals: dict[int, int] = {}
+
+    def add(self, entry: BookOrder) -> None:
+        queue = self.levels.get(entry.price)
+        if queue is None:
+            queue = self.levels[entry.price] = deque()
+            self.totals[entry.price] = 0
+            insort(self.prices, entry.price)
+        queue.append(entry)
+        self.totals[entry.price] += entry.remaining
+
+    def best_prices(self) -> Iterator[int]:
+        """Цены от лучшей к худшей"""
+        return reversed(self.prices) if self.descending else iter(self.prices)
+
+    def crosses(self, level_price: int, limit_price: int | None) -> bool:
+        """Подходит ли уровень под лимитную цену встречной заявки"""
+        if limit_price is None:
+            return True
+        if self.descending:
+            return level_price >= limit_price
+        return level_price <= limit_price
+
+    def compact(self, price: int) -> None:
+        """Убирает исполненные/отменённые заявки из головы очереди и пустой уровень"""
+        queue = self.levels.get(price)
+        if queue is None:
+            return
+        while queue and queue[0].remaining <= 0:
+            queue.popleft()
+        if not queue:
+            del self.levels[price]
+            del self.totals[price]
+            del self.prices[bisect_left(self.prices, price)]
+
+
+class OrderBook:
+    """
+    Биржевой стакан одного тикера в памяти процесса.
+
+    Стакан владеет сопоставлением заявок: `match` исполняет входящую заявку
+    против лучших уровней с приоритетом цена-время и возвращает список
+    исполнений, которые затем записываются в БД. Стоимость сопоставления
+    зависит только от количества затронутых заявок, а не от глубины стакана.
+    """
+
+    def __init__(self, ticker: str):
+        self.ticker = ticker
+        self._bids = _BookSide(descending=True)
+        self._asks = _BookSide(descending=False)
+        self._index: dict[str, BookOrder] = {}
+        # Счётчик изменений: по нему видно, трогали ли стакан во время операции
+        self.version = 0
+
+    def _side(self, direction: Direction) -> _BookSide:
+        return self._bids if direction == Direction.BUY else self._asks
+
+    def __contains__(self, order_id: str) -> bool:
+        return order_id in self._index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def add(self, order_id: str, user_id: str, direction: Direction,
+            price: int, qty: int, filled: int = 0) -> None:
+        """Ставит лимитную заявку (или её остаток) в конец очереди своего уровня"""
+        if qty - filled <= 0 or order_id in self._index:
+            return
+        entry = BookOrder(order_id, user_id, direction, price, qty, filled)
+        self._index[order_id] = entry
+        self._side(direction).add(entry)
+        self.version += 1
+
+    def remove(self, order_id: str) -> BookOrder | None:
+        """Снимает заявку со стакана (отмена)"""
+        entry = self._index.pop(order_id, None)
+        if entry is None:
+            return None
+        side = self._side(entry.direction)
+        side.totals[entry.price] -= entry.remaining
+        # Заявка остаётся в очереди как "пустая" и вычищается при следующем проходе
+        entry.qty = entry.filled
+        side.compact(entry.price)
+        self.version += 1
+        return entry
+
+    def level_qty(self, direction: Direction, price: int) -> int:
+        """Неисполненный остаток ценового уровня (0 - уровня нет)"""
+        return self._side(direction).totals.get(price, 0)
+
+    def depth(self, direction: Direction) -> tuple[int, int]:
+        """Количество ценовых уровней и суммарный остаток одной стороны стакана"""
+        side = self._side(direction)
+        return len(side.prices), sum(side.totals.values())
+
+    def levels(self, direction: Direction, limit: int | None = None,
+               exclude_user: str | None = None) -> list[dict]:
+        """
+        Агрегированные уровни одной стороны стакана
+
+        Args:
+            direction: сторона стакана (BUY - bid, SELL - ask)
+            limit: максимальное количество уровней
+            exclude_user: не учитывать заявки этого пользователя
+
+        Returns:
+            Список уровней [{"price": ..., "qty": ...}] от лучшей цены к худшей
+        """
+        side = self._side(direction)
+        if exclude_user is None:
+            # Агрегаты уже посчитаны - берём первые limit уровней
+            return [
+                {"price": price, "qty": side.totals[price]}
+                for price in islice(side.best_prices(), limit)
+            ]
+
+        result = []
+        for price in side.best_prices():
+            if limit is not None and len(result) >= limit:
+                break
+            qty = sum(
+                entry.remaining for entry in side.levels[price]
+                if entry.user_id != exclude_user
+            )
+            if qty > 0:
+                result.append({"price": price, "qty": qty})
+        return result
+
+    def plan(self, direction: Direction, qty: int, price: int | None = None,
+             user_id: str | None = None) -> list[Fill]:
+        """
+        План исполнения входящей заявки без изменения стакана.
+
+        Обход уровней останавливается, как только набрано нужное количество,
+        поэтому проверка ликвидности рыночной заявки стоит столько же, сколько
+        само исполнение, а не проход по всей стороне стакана.
+
+        Защита от сделки с самим собой - отмена входящей заявки: если до
+        набора нужного количества очередь доходит до собственной заявки
+        пользователя, входящая заявка отклоняется целиком. Встречная заявка
+        остаётся в стакане, стакан не меняется. Пропускать свои заявки нельзя:
+        остаток лимитной заявки встал бы в стакан по цене, пересекающей
+        собственную встречную заявку.
+
+        Args:
+            direction: направление входящей заявки
+            qty: количество к исполнению
+            price: лимитная цена (None - рыночная заявка)
+            user_id: владелец заявки
+
+        Returns:
+            Список исполнений в порядке приоритета цена-время
+
+        Raises:
+            ValueError: заявка исполнилась бы против собственной заявки пользователя
+        """
+        opposite = Direction.SELL if direction == Direction.BUY else Direction.BUY
+        side = self._side(opposite)
+        fills: list[Fill] = []
+        remaining = qty
+
+        for level_price in side.best_prices():
+            if remaining <= 0 or not side.crosses(level_price, price):
+                break
+            for entry in side.levels[level_price]:
+                if remaining <= 0:
+                    break
+                if entry.remaining <= 0:
+                    continue
+                if user_id is not None and entry.user_id == user_id:
+                    raise ValueError('Заявка исполнилась бы против собственной встречной заявки')
+                take, _ = calculate_fill(entry.remaining, remaining, entry.price)
+                remaining -= take
+                fills.append(Fill(
+                    order_id=entry.order_id,
+                    user_id=entry.user_id,
+                    direction=entry.direction,
+                    price=entry.price,
+                    qty=take,
+                    filled=entry.filled + take,
+                    order_qty=entry.qty,
+                ))
+        return fills
+
+    def execute(self, fills: list[Fill]) -> None:
+        """Применяет к стакану план, полученный из `plan` без промежуточных изменений"""
+        touched: set[tuple[Direction, int]] = set()
+        for fill in fills:
+            entry = self._index[fill.order_id]
+            entry.filled = fill.filled
+            self._side(entry.direction).totals[entry.price] -= fill.qty
+            touched.add((entry.direction, entry.price))
+            if entry.remaining <= 0:
+                del self._index[entry.order_id]
+
+        for direction, price in touched:
+            self._side(direction).compact(price)
+        if fills:
+            self.version += 1
+
+    def match(self, direction: Direction, qty: int, price: int | None = None,
+              user_id: str | None = None) -> list[Fill]:
+        """Исполнение входящей заявки против встречной стороны стакана"""
+        fills = self.plan(direction, qty, price, user_id)
+        self.execute(fills)
+        return fills
+
+
+class OrderBookRegistry:
+    """Стаканы всех тикеров; стакан поднимается из БД при первом обращении"""
+
+    def __init__(self):
+        self._books: dict[str, OrderBook] = {}
+        self._locks: dict[str, asyncio.Lock] = {}
+        self._load_locks: dict[str, asyncio.Lock] = {}
+        self._invalidate_callbacks: list[Callable[[str], None]] = []
+        # тикер -> сколько раз стакан сбрасывался
+        self._generations: dict[str, int] = {}
+
+    def lock(self, ticker: str) -> asyncio.Lock:
+        """Блокировка, сериализующая изменения стакана тикера внутри процесса"""
+        lock = self._locks.get(ticker)
+        if lock is None:
+            lock = self._locks[ticker] = asyncio.Lock()
+        return lock
+
+    @asynccontextmanager
+    async def acquire(self, ticker: str, session: AsyncSession) -> AsyncIterator[OrderBook]:
+        """
+        Эксклюзивный доступ к стакану тикера на время операции.
+
+        Если операция упала после того, как стакан был изменён, стакан
+        сбрасывается и при следующем обращении перечитывается из БД.
+        """
+        async with self.lock(ticker):
+            book = await self.get(ticker, session)
+            version = book.version
+            try:
+                yield book
+            except BaseException:
+                if book.version != version:
+                    self.invalidate(ticker)
+                raise
+
+    async def get(self, ticker: str, session: AsyncSession) -> OrderBook:
+        book = self._books.get(ticker)
+        if book is not None:
+            return book
+
+        load_lock = self._load_locks.get(ticker)
+        if load_lock is None:
+            load_lock = self._load_locks[ticker] = asyncio.Lock()
+        # Одновременные промахи по одному тикеру читают БД один раз
+        async with load_lock:
+            book = self._books.get(ticker)
+            if book is None:
+                books = await self._load(session, ticker)
+                book = self._books[ticker] = books.get(ticker, OrderBook(ticker))
+        return book
+
+    async def warm_up(self, session: AsyncSession) -> None:
+        """Поднимает стаканы всех тикеров с активными заявками одним запросом"""
+        for ticker, book in (await self._load(session)).items():
+            self._books.setdefault(ticker, book)
+
+    def peek(self, ticker: str) -> OrderBook | None:
+        """Стакан тикера, если он уже поднят в память"""
+        return self._books.get(ticker)
+
+    def on_invalidate(self, callback: Callable[[str], None]) -> None:
+        """Подписка на сброс стакана (например, чтобы разослать новый снимок)"""
+        self._invalidate_callbacks.append(callback)
+
+    def books(self) -> list[OrderBook]:
+        """Стаканы, уже поднятые в память"""
+        return list(self._books.values())
+
+    def generation(self, ticker: str) -> int:
+        """Номер поколения стакана: меняется при каждом сбросе"""
+        return self._generations.get(ticker, 0)
+
+    def invalidate(self, ticker: str) -> None:
+        """Сбрасывает стакан, при следующем обращении он будет перечитан из БД"""
+        self._generations[ticker] = self.generation(ticker) + 1
+        if self._books.pop(ticker, None) is not None:
+            app_logger.info(f"orderbook {ticker} invalidated")
+            for callback in self._invalidate_callbacks:
+                callback(ticker)
+
+    async def _load(self, session: AsyncSession, ticker: str | None = None) -> dict[str, OrderBook]:
+        query = (
+            select(Order.ticker, Order.id, Order.user_id, Order.direction,
+                   Order.price, Order.qty, Order.filled)
+            .where(
+                Order.status.in_([Status.NEW, Status.PARTIALLY_EXECUTED]),
+                Order.price.isnot(None),
+            )
+            .order_by(Order.created_at, Order.id)
+        )
+        if ticker is not None:
+            query = query.where(Order.ticker == ticker)
+
+        books: dict[str, OrderBook] = {}
+        result = await session.execute(query)
+        for book_ticker, order_id, user_id, direction, price, qty, filled in result.all():
+            book = books.get(book_ticker)
+            if book is None:
+                book = books[book_ticker] = OrderBook(book_ticker)
+            book.add(order_id, user_id, direction, price, qty, filled or 0)
+        app_logger.info(
+            f"orderbooks loaded: {', '.join(f'{t}={len(b)}' for t, b in books.items()) or 'empty'}"
+        )
+        return books
+
+
+order_books = OrderBookRegistry()
+
+
+def _collect_depth(value_index: int):
+    def collect():
+        for book in order_books.books():
+            for direction, side in ((Direction.BUY, 'bid'), (Direction.SELL, 'ask')):
+                yield (book.ticker, side), book.depth(direction)[value_index]
+    return collect
+
+
+register_callback(
+    'orderbook_levels',
+    'Количество ценовых уровней в стакане',
+    _collect_depth(0),
+    labelnames=('ticker', 'side'),
+)
+register_callback(
+    'orderbook_depth',
+    'Суммарный неисполненный объём заявок в стакане',
+    _collect_depth(1),
+    labelnames=('ticker', 'side'),
+)
+register_callback(
+    'orderbook_orders',
+    'Количество заявок в стакане',
+    lambda: [((book.ticker,), len(book)) for book in order_books.books()],
+    labelnames=('ticker',),
+)
@@ -0,0 +1,118 @@
+import asyncio
+
+import orjson
+
+from app.core.config import settings
+from app.core.metrics import register_callback
+from app.models.order import Status
+
+# Маркер в очереди подписчика: события потеряны, клиенту нужно перечитать заявки
+RESYNC = None
+
+
+class OrderSubscription:
+    """Очередь событий по заявкам одного пользователя для одного подключения"""
+
+    def __init__(self, user_id: str, max_pending: int):
+        self.user_id = user_id
+        self.queue: asyncio.Queue[tuple[int, str] | None] = asyncio.Queue(max_pending)
+
+    def push(self, message: tuple[int, str] | None) -> None:
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # Клиент не успевает читать: сообщаем, что нужно перечитать заявки через GET /order
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC)
+
+
+class OrderEvents:
+    """
+    События изменения статуса и исполненного объёма заявок пользователя.
+
+    CRUD-методы сообщают об изменении заявки только для пользователей, у которых
+    есть открытые подключения, остальные изменения ничего не стоят. Изменения
+    копятся по тикеру и рассылаются обработчиком очереди тикера после COMMIT,
+    поэтому клиент не видит исполнений, которые затем откатились.
+    """
+
+    def __init__(self, max_pending: int = 1000):
+        self.max_pending = max_pending
+        self._subscribers: dict[str, set[OrderSubscription]] = {}
+        # тикер -> [(user_id, событие)] изменений операции, ещё не зафиксированных в БД
+        self._staged: dict[str, list[tuple[str, dict]]] = {}
+        self._seq = 0
+
+    def subscribe(self, user_id: str) -> OrderSubscription:
+        subscription = OrderSubscription(user_id, self.max_pending)
+        self._subscribers.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: OrderSubscription) -> None:
+        subscribers = self._subscribers.get(subscription.user_id)
+        if subscribers is None:
+            return
+        subscribers.discard(subscription)
+        if not subscribers:
+            del self._subscribers[subscription.user_id]
+
+    def subscribers(self) -> int:
+        return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def order_changed(self, ticker: str, user_id: str, order_id: str, status: Status,
+                      filled: int, qty: int) -> None:
+        """
+        Изменение заявки в рамках текущей операции над стаканом тикера
+
+        Args:
+            ticker: тикер, в очереди которого выполняется операция
+            user_id: владелец заявки
+            order_id: идентификатор заявки
+            status: новый статус
+            filled: исполненное количество
+            qty: количество в заявке
+        """
+        if user_id not in self._subscribers:
+            return
+        self._staged.setdefault(ticker, []).append((user_id, {
+            "order_id": order_id,
+            "ticker": ticker,
+            "status": status.value,
+            "filled": filled,
+            "qty": qty,
+        }))
+
+    def publish(self, ticker: str) -> None:
+        """Рассылает изменения зафиксированной операции"""
+        for user_id, event in self._staged.pop(ticker, ()):
+            subscribers = self._subscribers.get(user_id)
+            if not subscribers:
+                continue
+            self._seq += 1
+            message = (self._seq, orjson.dumps(event).decode())
+            for subscription in subscribers:
+                subscription.push(message)
+
+    def discard(self, ticker: str) -> None:
+        """Операция откатилась - её изменения не публикуются"""
+        self._staged.pop(ticker, None)
+
+    def savepoint(self, ticker: str) -> int:
+        """Отметка в накопленных изменениях операции перед частью, которая может откатиться"""
+        return len(self._staged.get(ticker, ()))
+
+    def rollback_to(self, ticker: str, savepoint: int) -> None:
+        """Часть операции после отметки откатилась - её изменения не публикуются"""
+        staged = self._staged.get(ticker)
+        if staged is not None:
+            del staged[savepoint:]
+
+
+order_events = OrderEvents(max_pending=settings.market_data.max_pending)
+
+register_callback(
+    'order_events_subscribers',
+    'Подключения к потоку событий по заявкам пользователей',
+    lambda: [((), order_events.subscribers())],
+)
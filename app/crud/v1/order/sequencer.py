@@ -0,0 +1,134 @@
+import asyncio
+import contextvars
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Generic, TypeVar
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.core.db import AsyncSessionLocal
+from app.core.logs import app_logger
+from app.core.metrics import order_phase_duration
+from app.crud.v1.order.market_feed import market_feed
+from app.crud.v1.order.order_events import order_events
+from app.crud.v1.order.order_book import order_books
+
+T = TypeVar('T')
+
+Operation = Callable[..., Awaitable[T]]
+
+
+@dataclass(slots=True)
+class SequencedResult(Generic[T]):
+    """Результат операции вместе с её порядковым номером в очереди тикера"""
+    seq: int
+    result: T
+
+
+class OrderSequencer:
+    """
+    Единственный писатель для каждого тикера.
+
+    Все операции над заявками тикера (выставление, отмена) проходят через
+    одну упорядоченную очередь, которую разбирает одна задача-обработчик.
+    Поэтому стакан тикера меняется строго последовательно и сопоставлению
+    не нужны блокировки строк в БД, а разные тикеры обрабатываются
+    параллельно независимыми задачами.
+
+    Каждая операция выполняется в своей сессии как одна транзакция: CRUD-методы
+    только отправляют изменения в БД, а фиксирует их обработчик одним COMMIT
+    до того, как возьмёт следующую операцию.
+    """
+
+    def __init__(self, session_factory: async_sessionmaker[AsyncSession] = AsyncSessionLocal):
+        self._session_factory = session_factory
+        self._queues: dict[str, asyncio.Queue] = {}
+        self._workers: dict[str, asyncio.Task] = {}
+        self._seq: dict[str, int] = {}
+
+    async def submit(self, ticker: str, operation: Operation[T]) -> SequencedResult[T]:
+        """
+        Ставит операцию в очередь тикера и ждёт её результата
+
+        Очередь и обработчик тикера создаются при первой операции и живут до
+        остановки, поэтому тикер из запроса клиента нужно проверить до вызова.
+
+        Args:
+            ticker: тикер, к стакану которого относится операция
+            operation: корутина-функция, принимающая именованный аргумент session
+
+        Returns:
+            SequencedResult: порядковый номер операции и её результат
+        """
+        queue = self._queue(ticker)
+        seq = self._seq[ticker] = self._seq.get(ticker, 0) + 1
+        future = asyncio.get_running_loop().create_future()
+        queue.put_nowait((seq, operation, future, time.perf_counter(), contextvars.copy_context()))
+        return SequencedResult(seq=seq, result=await future)
+
+    def tickers(self) -> list[str]:
+        """Тикеры, у которых есть очередь"""
+        return list(self._queues)
+
+    def _queue(self, ticker: str) -> asyncio.Queue:
+        queue = self._queues.get(ticker)
+        if queue is None:
+            queue = self._queues[ticker] = asyncio.Queue()
+            self._workers[ticker] = asyncio.create_task(
+                self._consume(ticker, queue), name=f"sequencer-{ticker}"
+            )
+        return queue
+
+    async def _consume(self, ticker: str, queue: asyncio.Queue) -> None:
+        while True:
+            seq, operation, future, enqueued_at, context = await queue.get()
+            order_phase_duration.labels('queue').observe(time.perf_counter() - enqueued_at)
+            try:
+                # Операция выполняется в контексте отправителя, чтобы её запросы к БД
+                # попали в статистику того HTTP-запроса, который её поставил
+                result = await asyncio.create_task(self._run(ticker, operation), context=context)
+            except Exception as e:
+                app_logger.error(f"sequencer {ticker} #{seq} failed: {e}")
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+            finally:
+                queue.task_done()
+
+    async def _run(self, ticker: str, operation: Operation[Any]) -> Any:
+        async with self._session_factory() as session:
+            try:
+                result = await operation(session=session)
+            except Exception:
+                market_feed.discard(ticker)
+                order_events.discard(ticker)
+                await session.rollback()
+                raise
+            try:
+                with order_phase_duration.labels('commit').time():
+                    await session.commit()
+            except Exception:
+                # Стакан уже изменён операцией, а её запись в БД не зафиксирована;
+                # подписчики рыночных данных получат новый снимок после сброса
+                market_feed.discard(ticker)
+                order_events.discard(ticker)
+                order_books.invalidate(ticker)
+                await session.rollback()
+                raise
+            market_feed.publish(ticker)
+            order_events.publish(ticker)
+            return result
+
+    async def shutdown(self) -> None:
+        """Дожидается уже принятых операций и останавливает обработчики"""
+        await asyncio.gather(*(queue.join() for queue in self._queues.values()))
+        for worker in self._workers.values():
+            worker.cancel()
+        await asyncio.gather(*self._workers.values(), return_exceptions=True)
+        self._queues.clear()
+        self._workers.clear()
+
+
+order_sequencer = OrderSequencer()
@@ -0,0 +1,74 @@
+from datetime import datetime, timezone
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.crud.v1.balance import balance_crud
+from app.crud.v1.candle import candle_crud
+from app.crud.v1.transaction import transaction_crud
+
+
+class Settlement:
+    """
+    Расчёты по одной входящей заявке.
+
+    Исполнения не трогают балансы по одному: изменения копятся как итоговые
+    приращения по каждой паре (пользователь, тикер) и применяются одним
+    запросом в конце сопоставления. Число затронутых строк баланса зависит
+    от количества разных контрагентов, а не от количества исполнений.
+    Сделки тоже копятся и записываются одним INSERT, затронутые ими свечи
+    обновляются ещё одним запросом в той же транзакции.
+    """
+
+    def __init__(self):
+        # (user_id, ticker) -> [изменение amount, изменение blocked_amount]
+        self.deltas: dict[tuple[str, str], list[int]] = {}
+        self.transactions: list[dict] = []
+
+    def __len__(self) -> int:
+        return len(self.deltas)
+
+    def change(self, user_id: str, ticker: str, amount: int = 0, blocked: int = 0) -> None:
+        """Добавляет приращение к балансу пользователя по тикеру"""
+        delta = self.deltas.get((user_id, ticker))
+        if delta is None:
+            delta = self.deltas[(user_id, ticker)] = [0, 0]
+        delta[0] += amount
+        delta[1] += blocked
+
+    def trade(self, ticker: str, buyer_id: str, seller_id: str, qty: int, price: int,
+              buyer_blocked: int = 0, seller_blocked: int = 0) -> None:
+        """
+        Сделка между покупателем и продавцом
+
+        Args:
+            ticker: тикер инструмента
+            buyer_id: покупатель, платит рубли и получает тикер
+            seller_id: продавец, отдаёт тикер и получает рубли
+            qty: количество
+            price: цена сделки
+            buyer_blocked: сколько рублей покупателя снять с блокировки
+            seller_blocked: сколько тикеров продавца снять с блокировки
+        """
+        cost = qty * price
+        self.change(buyer_id, "RUB", amount=-cost, blocked=-buyer_blocked)
+        self.change(buyer_id, ticker, amount=qty)
+        self.change(seller_id, ticker, amount=-qty, blocked=-seller_blocked)
+        self.change(seller_id, "RUB", amount=cost)
+
+    def record(self, user_id: str, ticker: str, qty: int, price: int) -> None:
+        """Добавляет сделку в историю транзакций"""
+        self.transactions.append({
+            'user_id': user_id,
+            'ticker': ticker,
+            'amount': qty,
+            'price': price,
+            'timestamp': datetime.now(timezone.utc),
+        })
+
+    async def apply(self, session: AsyncSession) -> None:
+        """Записывает накопленные сделки и изменения балансов и очищает накопитель"""
+        await transaction_crud.create_many(self.transactions, session=session)
+        await candle_crud.record_trades(self.transactions, session=session)
+        await balance_crud.apply_deltas(self.deltas, async_session=session)
+        self.deltas = {}
+        self.transactions = []
@@ -1,5 +1,7 @@
 from datetime import datetime, timezone
-from sqlalchemy import select
+from typing import AsyncIterator, Sequence
+
+from sqlalchemy import Row, func, insert, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.logs import error_log
@@ -7,6 +9,13 @@ from app.crud.base import CRUDBase
 from app.models.transaction import Transaction
 
 
+def as_utc(timestamp: datetime | None) -> datetime | None:
+    """Время сделки с часовым поясом: наивные значения в БД записаны в UTC"""
+    if timestamp is not None and timestamp.tzinfo is None:
+        return timestamp.replace(tzinfo=timezone.utc)
+    return timestamp
+
+
 class CRUDTransaction(CRUDBase[Transaction]):
     def __init__(self):
         super().__init__(Transaction, primary_key_name='id')
@@ -17,24 +26,79 @@ class CRUDTransaction(CRUDBase[Transaction]):
             ticker: str,
             session: AsyncSession,
             limit: int = 100,
-    ) -> list[Transaction]:
+    ) -> list[dict]:
         """Получение списка транзакций по тикеру"""
 
-        query = select(Transaction).where(
-            Transaction.ticker == ticker
+        query = select(
+            Transaction.ticker, Transaction.amount, Transaction.price, Transaction.timestamp
+        ).where(
+            Transaction.ticker == ticker,
+            # Секции будущих месяцев создаются заранее; граница по now() отсекает их
+            # при выполнении, и чтение начинается сразу с секции текущего месяца
+            Transaction.timestamp <= func.now(),
         ).order_by(
             Transaction.timestamp.desc()
         ).limit(limit)
 
+        # Берём строки, а не ORM-объекты: правка времени у объектов помечала их
+        # изменёнными, и при коммите сессии по каждой сделке уходил UPDATE
         result = await session.execute(query)
-        transactions = result.scalars().all()
+        return [
+            {**row, 'timestamp': as_utc(row['timestamp'])}
+            for row in result.mappings()
+        ]
+
+    async def stream_transactions(
+            self,
+            ticker: str,
+            session: AsyncSession,
+            start: datetime | None = None,
+            end: datetime | None = None,
+            batch_size: int = 1000,
+    ) -> AsyncIterator[Sequence[Row]]:
+        """
+        Сделки по тикеру за период [start, end) пачками в порядке времени
 
-        # Добавляем информацию о временной зоне к каждой транзакции
-        for transaction in transactions:
-            if transaction.timestamp and transaction.timestamp.tzinfo is None:
-                transaction.timestamp = transaction.timestamp.replace(tzinfo=timezone.utc)
+        Строки читаются курсором на стороне сервера БД по `batch_size` штук,
+        поэтому память процесса не зависит от размера выгрузки.
 
-        return transactions
+        Args:
+            ticker: тикер инструмента
+            session: сессия БД, занята на всё время выгрузки
+            start: начало периода (включительно), время без часового пояса - UTC
+            end: конец периода (не включительно), время без часового пояса - UTC
+            batch_size: сколько строк читать из курсора за раз
+
+        Returns:
+            Асинхронный итератор пачек строк (id, ticker, amount, price, timestamp)
+        """
+        query = select(
+            Transaction.id, Transaction.ticker, Transaction.amount,
+            Transaction.price, Transaction.timestamp,
+        ).where(
+            Transaction.ticker == ticker
+        ).order_by(
+            Transaction.timestamp, Transaction.id
+        ).execution_options(yield_per=batch_size)
+        # asyncpg считает время без часового пояса местным временем сервера приложения
+        if start is not None:
+            query = query.where(Transaction.timestamp >= as_utc(start))
+        if end is not None:
+            query = query.where(Transaction.timestamp < as_utc(end))
+
+        result = await session.stream(query)
+        async for rows in result.partitions():
+            yield rows
+
+    @error_log
+    async def create_many(
+            self,
+            rows: list[dict],
+            session: AsyncSession,
+    ) -> None:
+        """Запись пачки транзакций одним INSERT ... VALUES (...), (...)"""
+        if rows:
+            await session.execute(insert(Transaction).values(rows))
 
 
 transaction_crud = CRUDTransaction()
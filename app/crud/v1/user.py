@@ -1,11 +1,14 @@
+import asyncio
 import uuid
+from functools import partial
 
 from fastapi import HTTPException, status
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.core.auth import auth_cache
 from app.core.enums import UserRole
 from app.crud.base import CRUDBase
-from app.crud.v1.order import crud_order
+from app.crud.v1.order import order_crud, order_sequencer
 from app.models.user import User
 
 
@@ -32,15 +35,28 @@ class CRUDUser(CRUDBase[User]):
 
     async def remove(self, user_id: int, async_session: AsyncSession | None = None):
         user = await self.get_by_id(user_id, async_session)
-        await crud_order.order_crud.cancel_user_orders(user_id, async_session)
         if not user or user.is_deleted:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND, detail='User not found'
             )
+        # Сначала пользователь удаляется и теряет доступ: пока отменяются его
+        # заявки, по ещё действующему ключу нельзя выставить новые
         user.is_deleted = True
         await async_session.flush()
         await async_session.refresh(user)
         await async_session.commit()
+        auth_cache.invalidate(user.api_key)
+
+        # Заявки отменяются операциями очередей тикеров, как DELETE /order/{id}:
+        # стакан тикера меняет только его обработчик, каждая операция - своя транзакция.
+        # Тикеры читаются после фиксации удаления; очереди всех тикеров с обработчиком
+        # тоже получают отмену - в них могут ждать заявки, принятые до удаления
+        tickers = set(await order_crud.get_user_order_tickers(user.id, async_session))
+        tickers.update(order_sequencer.tickers())
+        await asyncio.gather(*(
+            order_sequencer.submit(ticker, partial(order_crud.cancel_user_orders, user_id=user.id, ticker=ticker))
+            for ticker in tickers
+        ))
         return user
 
 
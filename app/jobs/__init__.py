@@ -0,0 +1 @@
+'''Фоновые задачи обслуживания БД, запускаются отдельно от API.'''
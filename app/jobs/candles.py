@@ -0,0 +1,82 @@
+"""
+Построение свечей по истории сделок.
+
+Свечи новых сделок обновляются при расчёте заявки, задача нужна для
+истории, накопленной до их появления, и для пересчёта после ручных правок
+таблицы сделок. Период разбивается на сутки UTC, каждые сутки считаются
+отдельной транзакцией: свечи всех интервалов внутри суток собираются
+целиком, а блокировки строк свечей не держатся долго.
+
+Конец периода по умолчанию - начало текущих суток: свечи идущих суток
+ведёт расчёт заявок, и пересчёт во время торгов может перезаписать свечу
+без сделки, зафиксированной параллельно.
+
+Запуск (БД берётся из настроек приложения):
+```sh
+python -m app.jobs.candles --start 2025-01-01
+python -m app.jobs.candles --start 2025-05-01 --end 2025-05-02 --ticker MEMECOIN
+```
+"""
+import argparse
+import asyncio
+from datetime import datetime, timezone
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.core.db import AsyncSessionLocal
+from app.core.logs import app_logger
+from app.crud.v1.candle import candle_crud, candle_start
+from app.crud.v1.transaction import as_utc
+from app.models.candle import CandleInterval
+
+DAY = CandleInterval.D1.step
+
+
+async def backfill_candles(
+        start: datetime,
+        end: datetime | None = None,
+        ticker: str | None = None,
+        session_factory: async_sessionmaker[AsyncSession] = AsyncSessionLocal,
+) -> int:
+    """
+    Пересчёт свечей за сутки, покрывающие период [start, end)
+
+    Args:
+        start: начало периода, округляется вниз до суток
+        end: конец периода, округляется вверх до суток; по умолчанию - начало текущих суток
+        ticker: тикер инструмента, по умолчанию - все тикеры
+        session_factory: фабрика сессий БД
+
+    Returns:
+        Количество построенных минутных свечей
+    """
+    day = candle_start(start, CandleInterval.D1)
+    if end is None:
+        end = candle_start(datetime.now(timezone.utc), CandleInterval.D1)
+    elif candle_start(end, CandleInterval.D1) != as_utc(end):
+        end = candle_start(end, CandleInterval.D1) + DAY
+    else:
+        end = as_utc(end)
+
+    total = 0
+    while day < end:
+        async with session_factory() as session:
+            built = await candle_crud.rebuild(day, day + DAY, session=session, ticker=ticker)
+            await session.commit()
+        app_logger.info(f"candles backfill {ticker or '*'} {day.date()}: {built} minute bars")
+        total += built
+        day += DAY
+    return total
+
+
+async def main(args: argparse.Namespace) -> None:
+    total = await backfill_candles(args.start, args.end, args.ticker)
+    print(f'minute bars: {total}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--start', type=datetime.fromisoformat, required=True, help='начало периода, UTC')
+    parser.add_argument('--end', type=datetime.fromisoformat, help='конец периода, UTC')
+    parser.add_argument('--ticker', help='только этот тикер')
+    asyncio.run(main(parser.parse_args()))
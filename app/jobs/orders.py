@@ -0,0 +1,67 @@
+"""
+Перенос завершённых заявок в историю.
+
+Исполненные и отменённые заявки переносятся из таблицы `order` в
+`order_history` пачками по `order_history.batch_size`, каждая пачка - своей
+транзакцией. В `order` остаются заявки стакана и завершённые с прошлого
+прохода, так что её размер следует за ликвидностью стакана, а не за всем
+объёмом торгов. Приложение делает проход раз в
+`order_history.compaction_interval` секунд; воркеры не мешают друг другу,
+потому что строки, взятые другим проходом, пропускаются.
+
+Первый перенос накопленной истории (запуск после миграции):
+```sh
+python -m app.jobs.orders
+```
+"""
+import argparse
+import asyncio
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.core.config import settings
+from app.core.db import AsyncSessionLocal
+from app.core.logs import app_logger
+from app.crud.v1.order import order_crud
+
+
+async def compact_orders(batch_size: int = settings.order_history.batch_size,
+                         session_factory: async_sessionmaker[AsyncSession] = AsyncSessionLocal) -> int:
+    """
+    Перенос всех завершённых заявок в историю
+
+    Returns:
+        Количество перенесённых заявок
+    """
+    total = 0
+    while True:
+        async with session_factory() as session:
+            moved = await order_crud.move_to_history(session, batch_size=batch_size)
+            await session.commit()
+        total += moved
+        if moved < batch_size:
+            break
+    if total:
+        app_logger.info(f"orders moved to history: {total}")
+    return total
+
+
+async def maintain_orders(interval: float = settings.order_history.compaction_interval) -> None:
+    """Фоновая задача приложения: переносит завершённые заявки в историю"""
+    while True:
+        try:
+            await compact_orders()
+        except Exception as e:
+            app_logger.error(f"Can't move orders to history: {e}")
+        await asyncio.sleep(interval)
+
+
+async def main(args: argparse.Namespace) -> None:
+    total = await compact_orders(args.batch_size)
+    print(f'moved: {total}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--batch-size', type=int, default=settings.order_history.batch_size)
+    asyncio.run(main(parser.parse_args()))
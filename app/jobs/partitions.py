@@ -0,0 +1,190 @@
+"""
+Обслуживание секций таблицы сделок.
+
+Таблица `transaction` секционирована по месяцам (UTC) по времени сделки,
+секция месяца называется `transaction_YYYY_MM`. Секции по умолчанию нет
+намеренно: с ней Postgres не может читать секции по порядку времени и
+запрос последних сделок перестаёт останавливаться на самой новой секции.
+Поэтому секции должны быть созданы заранее - приложение проверяет это при
+старте и затем раз в `partitions.check_interval` секунд.
+
+Архивирование отсоединяет секции старше `partitions.archive_after_months`
+месяцев, выгружает их в `<archive_dir>/transaction_YYYY_MM.csv.gz` и удаляет
+из БД. Вернуть выгрузку можно так:
+```sh
+gunzip -c transaction_2025_01.csv.gz | psql -c 'COPY transaction FROM STDIN (FORMAT csv, HEADER)'
+```
+(секция месяца должна существовать).
+
+Запуск (БД берётся из настроек приложения):
+```sh
+python -m app.jobs.partitions ensure --months-ahead 3
+python -m app.jobs.partitions archive --older-than 12 --dir /var/backups/tochka
+```
+"""
+import argparse
+import asyncio
+import gzip
+import os
+import re
+from datetime import datetime, timezone
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from app.core.config import settings
+from app.core.db import engine as default_engine
+from app.core.logs import app_logger
+
+TABLE = 'transaction'
+PARTITION_NAME = re.compile(rf'^{TABLE}_(\d{{4}})_(\d{{2}})$')
+# Ключ блокировки, чтобы воркеры приложения не создавали секции одновременно
+ADVISORY_LOCK = 0x7472616e
+
+
+def month_start(timestamp: datetime, months: int = 0) -> datetime:
+    """Начало месяца (UTC), сдвинутого на `months` от месяца момента времени"""
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc)
+    index = timestamp.year * 12 + timestamp.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def partition_name(month: datetime) -> str:
+    return f'{TABLE}_{month.year:04d}_{month.month:02d}'
+
+
+async def ensure_partitions(months_ahead: int = settings.partitions.months_ahead,
+                            engine: AsyncEngine = default_engine) -> list[str]:
+    """
+    Создание секций текущего месяца и `months_ahead` следующих
+
+    Returns:
+        Имена созданных секций
+    """
+    current = month_start(datetime.now(timezone.utc))
+    created = []
+    async with engine.begin() as conn:
+        await conn.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': ADVISORY_LOCK})
+        existing = set(await _partitions(conn))
+        for offset in range(months_ahead + 1):
+            month = month_start(current, offset)
+            name = partition_name(month)
+            if name in existing:
+                continue
+            await conn.execute(text(
+                f'CREATE TABLE {name} PARTITION OF "{TABLE}" '
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{month_start(month, 1).isoformat()}')"
+            ))
+            created.append(name)
+    if created:
+        app_logger.info(f"transaction partitions created: {', '.join(created)}")
+    return created
+
+
+async def archive_partitions(older_than: int = settings.partitions.archive_after_months,
+                             directory: str = settings.partitions.archive_dir,
+                             engine: AsyncEngine = default_engine) -> list[str]:
+    """
+    Выгрузка в архив и удаление секций, закончившихся больше `older_than` месяцев назад
+
+    Секция сначала отсоединяется (DETACH ... CONCURRENTLY не блокирует
+    запись в таблицу сделок), затем выгружается в сжатый CSV и удаляется.
+    Если прервалось само отсоединение, секция остаётся в состоянии
+    "detach pending" и при следующем запуске доотсоединяется через
+    DETACH ... FINALIZE. Если прервалась выгрузка, отсоединённая секция
+    остаётся в БД и будет выгружена при следующем запуске.
+
+    Returns:
+        Пути к созданным файлам
+    """
+    cutoff = month_start(datetime.now(timezone.utc), -older_than)
+    os.makedirs(directory, exist_ok=True)
+    files = []
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level='AUTOCOMMIT')
+        attached = set(await _partitions(conn))
+        pending = set(await _partitions(conn, detach_pending=True))
+        for name in sorted(await _tables(conn)):
+            year, month = map(int, PARTITION_NAME.match(name).groups())
+            if month_start(datetime(year, month, 1), 1) > cutoff:
+                continue
+            if name in pending:
+                # Прерванный DETACH ... CONCURRENTLY нельзя повторить, только завершить
+                await conn.execute(text(f'ALTER TABLE "{TABLE}" DETACH PARTITION {name} FINALIZE'))
+            elif name in attached:
+                await conn.execute(text(f'ALTER TABLE "{TABLE}" DETACH PARTITION {name} CONCURRENTLY'))
+            files.append(await _export(conn, name, directory))
+            await conn.execute(text(f'DROP TABLE {name}'))
+            app_logger.info(f"transaction partition {name} archived to {files[-1]}")
+    return files
+
+
+async def _export(conn, name: str, directory: str) -> str:
+    """Выгрузка таблицы в gzip-CSV; файл появляется под своим именем только целиком"""
+    path = os.path.join(directory, f'{name}.csv.gz')
+    raw = await conn.get_raw_connection()
+    with gzip.open(f'{path}.part', 'wb') as f:
+        async def write(chunk: bytes) -> None:
+            f.write(chunk)
+
+        status = await raw.driver_connection.copy_from_table(name, output=write, format='csv', header=True)
+    copied = int(status.split()[-1])
+    rows = (await conn.execute(text(f'SELECT count(*) FROM {name}'))).scalar_one()
+    if copied != rows:
+        raise RuntimeError(f'{name}: выгружено {copied} строк из {rows}')
+    os.replace(f'{path}.part', path)
+    return path
+
+
+async def _partitions(conn, detach_pending: bool = False) -> list[str]:
+    """Секции, присоединённые к таблице сделок; с `detach_pending` - только недоотсоединённые"""
+    query = (
+        'SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+        'WHERE i.inhparent = CAST(:table AS regclass)'
+    )
+    if detach_pending:
+        query += ' AND i.inhdetachpending'
+    result = await conn.execute(text(query), {'table': f'"{TABLE}"'})
+    return list(result.scalars())
+
+
+async def _tables(conn) -> list[str]:
+    """Таблицы секций в текущей схеме, в том числе отсоединённые"""
+    result = await conn.execute(text(
+        "SELECT relname FROM pg_class WHERE relkind = 'r' "
+        "AND relnamespace = CAST(current_schema() AS regnamespace) AND relname LIKE :prefix"
+    ), {'prefix': f'{TABLE}\\_%'})
+    return [name for name in result.scalars() if PARTITION_NAME.match(name)]
+
+
+async def maintain_partitions(interval: float = settings.partitions.check_interval) -> None:
+    """Фоновая задача приложения: держит секции созданными заранее"""
+    while True:
+        try:
+            await ensure_partitions()
+        except Exception as e:
+            app_logger.error(f"Can't ensure transaction partitions: {e}")
+        await asyncio.sleep(interval)
+
+
+async def main(args: argparse.Namespace) -> None:
+    if args.command == 'ensure':
+        created = await ensure_partitions(args.months_ahead)
+        print(f"created: {', '.join(created) or '-'}")
+    else:
+        files = await archive_partitions(args.older_than, args.dir)
+        print(f"archived: {', '.join(files) or '-'}")
+    await default_engine.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    ensure = commands.add_parser('ensure', help='создать секции заранее')
+    ensure.add_argument('--months-ahead', type=int, default=settings.partitions.months_ahead)
+    archive = commands.add_parser('archive', help='выгрузить и удалить старые секции')
+    archive.add_argument('--older-than', type=int, default=settings.partitions.archive_after_months,
+                         help='возраст секции в месяцах')
+    archive.add_argument('--dir', default=settings.partitions.archive_dir, help='каталог для выгрузок')
+    asyncio.run(main(parser.parse_args()))
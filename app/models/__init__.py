@@ -2,5 +2,6 @@ from app.models.user import User
 from app.models.balance import Balance  
 from app.models.instrument import Instrument  
 from app.models.error_message import ErrorMessage
-from app.models.order import Order  
+from app.models.order import Order, OrderHistory  
 from app.models.transaction import Transaction  
+from app.models.candle import Candle  
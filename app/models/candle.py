@@ -0,0 +1,48 @@
+import enum
+from datetime import timedelta
+
+from sqlalchemy import Column, String, Integer, BigInteger, ForeignKey, PrimaryKeyConstraint
+from sqlalchemy.dialects.postgresql import TIMESTAMP
+
+from app.core.db import Base
+
+
+class CandleInterval(enum.Enum):
+    M1 = "1m"
+    M5 = "5m"
+    H1 = "1h"
+    D1 = "1d"
+
+    @property
+    def step(self) -> timedelta:
+        return _STEPS[self]
+
+
+_STEPS = {
+    CandleInterval.M1: timedelta(minutes=1),
+    CandleInterval.M5: timedelta(minutes=5),
+    CandleInterval.H1: timedelta(hours=1),
+    CandleInterval.D1: timedelta(days=1),
+}
+
+
+# Модель Candle - OHLCV-свеча по тикеру за интервал, начинающийся в start (UTC)
+class Candle(Base):
+    __tablename__ = "candle"
+    __table_args__ = (
+        # Чтение свечей идёт по (ticker, interval) в порядке времени - ровно по ключу
+        PrimaryKeyConstraint("ticker", "interval", "start"),
+    )
+
+    ticker = Column(
+        String, ForeignKey('instrument.ticker', ondelete="CASCADE"), nullable=False
+    )
+    interval = Column(String, nullable=False)
+    start = Column(TIMESTAMP(timezone=True), nullable=False)
+
+    open = Column(Integer, nullable=False)
+    high = Column(Integer, nullable=False)
+    low = Column(Integer, nullable=False)
+    close = Column(Integer, nullable=False)
+    volume = Column(BigInteger, nullable=False)
+    trades = Column(Integer, nullable=False)
@@ -2,7 +2,7 @@ import enum
 import datetime
 from uuid import uuid4
 
-from sqlalchemy import Column, String, Integer, Enum, ForeignKey, DateTime
+from sqlalchemy import Column, String, Integer, Enum, ForeignKey, DateTime, Index, text
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import validates
 from sqlalchemy.sql import functions
@@ -31,6 +31,19 @@ class OrderBookScope(enum.Enum):
 # Модель Order
 class Order(Base):
     __tablename__ = "order"
+    __table_args__ = (
+        # Активные заявки стакана: по нему идут сопоставление и загрузка стакана,
+        # исполненные и отменённые заявки в индекс не попадают
+        Index(
+            "ix_order_active_book",
+            "ticker", "direction", "price", "created_at",
+            postgresql_where=text("status IN ('NEW', 'PARTIALLY_EXECUTED')"),
+            postgresql_include=["id", "user_id", "qty", "filled"],
+        ),
+        # Списки заявок (всех и пользователя) листаются по ключу (created_at, id)
+        Index("ix_order_created_at_id", "created_at", "id"),
+        Index("ix_order_user_id_created_at", "user_id", "created_at", "id"),
+    )
 
     id = Column(String, primary_key=True, default=lambda: str(uuid4()))
     status = Column(Enum(Status), nullable=False)
@@ -59,3 +72,29 @@ class Order(Base):
         if value is not None and value < 0:
             raise ValueError(f"{key} должен быть не отрицательный.")
         return value
+
+
+# Модель OrderHistory - исполненные и отменённые заявки. Задача app/jobs/orders.py
+# переносит их сюда из таблицы order, чтобы та содержала только заявки стакана
+class OrderHistory(Base):
+    __tablename__ = "order_history"
+    __table_args__ = (
+        Index("ix_order_history_created_at_id", "created_at", "id"),
+        Index("ix_order_history_user_id_created_at", "user_id", "created_at", "id"),
+    )
+
+    id = Column(String, primary_key=True)
+    status = Column(Enum(Status), nullable=False)
+    user_id = Column(
+        UUID(as_uuid=False), ForeignKey('user.id', ondelete="CASCADE"), nullable=False
+    )
+    direction = Column(Enum(Direction), nullable=False)
+    ticker = Column(
+        String,
+        ForeignKey("instrument.ticker", ondelete="CASCADE"),
+        nullable=False,
+    )
+    qty = Column(Integer, nullable=False)
+    price = Column(Integer, nullable=True)
+    filled = Column(Integer, nullable=True)
+    created_at = Column(DateTime(timezone=True), nullable=False)
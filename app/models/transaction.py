@@ -1,17 +1,25 @@
-from datetime import datetime
+from datetime import datetime, timezone
 from uuid import uuid4
 
-from sqlalchemy import Column, String, Integer, DateTime, ForeignKey
+from sqlalchemy import Column, String, Integer, DateTime, ForeignKey, Index
 from sqlalchemy.dialects.postgresql import UUID, TIMESTAMP
 
 from app.core.db import Base
 
 
+# Таблица секционирована по месяцам времени сделки (миграция a7c2e5f80b16), поэтому
+# время входит в первичный ключ. Секции create_all не создаёт: их создаёт и архивирует
+# app/jobs/partitions.py, без секции месяца запись сделок в него невозможна
 class Transaction(Base):
     __tablename__ = "transaction"
+    __table_args__ = (
+        # Лента сделок по тикеру и выгрузка за период читают индекс по порядку
+        Index("ix_transaction_ticker_timestamp", "ticker", "timestamp", "id"),
+        {"postgresql_partition_by": 'RANGE ("timestamp")'},
+    )
 
     id = Column(UUID(as_uuid=False), primary_key=True, default=uuid4)
-    user = Column(
+    user_id = Column(
         UUID(as_uuid=False), ForeignKey('user.id', ondelete="CASCADE"), nullable=False
     )
     ticker = Column(
@@ -21,4 +29,6 @@ class Transaction(Base):
     amount = Column(Integer, nullable=False)
     price = Column(Integer, nullable=False)
 
-    created_at = Column(TIMESTAMP(timezone=True), default=datetime.utcnow, nullable=False)
+    timestamp = Column(
+        TIMESTAMP(timezone=True), primary_key=True, default=lambda: datetime.now(timezone.utc), nullable=False
+    )
@@ -0,0 +1,27 @@
+from datetime import datetime
+
+from pydantic import BaseModel, Field
+
+
+class CandleResponse(BaseModel):
+    """Схема для ответа с одной OHLCV-свечой"""
+    start: datetime = Field(..., description="Начало интервала свечи (UTC)")
+    open: int = Field(..., description="Цена первой сделки")
+    high: int = Field(..., description="Максимальная цена")
+    low: int = Field(..., description="Минимальная цена")
+    close: int = Field(..., description="Цена последней сделки")
+    volume: int = Field(..., description="Суммарное количество")
+    trades: int = Field(..., description="Количество сделок")
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "start": "2025-05-16T12:59:00Z",
+                "open": 100,
+                "high": 105,
+                "low": 98,
+                "close": 103,
+                "volume": 42,
+                "trades": 7
+            }
+        }
@@ -44,6 +44,13 @@ class OrderResponse(BaseModel):
     order_id: str
 
 
+class BatchOrderResult(BaseModel):
+    """Результат одной заявки из пачки, в порядке заявок запроса"""
+    success: bool
+    order_id: Optional[str] = Field(None, description="ID созданной заявки")
+    error: Optional[str] = Field(None, description="Причина отказа, если заявка не создана")
+
+
 class CancelOrderResponse(BaseModel):
     success: bool
     order_id: str
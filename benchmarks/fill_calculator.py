@@ -0,0 +1,48 @@
+"""
+Микробенчмарк расчёта объёма исполнения.
+
+Сравнивает прежний подбор количества под бюджет (уменьшение на единицу,
+пока стоимость не уложится в бюджет) с арифметическим `calculate_fill`
+на заявках разного объёма.
+
+Запуск:
+```sh
+python -m benchmarks.fill_calculator
+```
+"""
+import argparse
+import timeit
+
+from app.crud.v1.order.fill_calculator import calculate_fill
+
+
+def linear_fill(available: int, wanted: int, price: int, budget: int) -> int:
+    """Подбор, который раньше выполнялся в CRUDOrderV2._try_fill"""
+    block = min(available, wanted)
+    while block * price > budget:
+        block -= 1
+    return max(block, 0)
+
+
+def main(args: argparse.Namespace) -> None:
+    price = 100
+    print(f'{"qty":>12}{"linear, us":>14}{"arithmetic, us":>16}')
+    for qty in args.qty:
+        # Бюджета хватает на 1% объёма - худший случай для линейного подбора
+        budget = qty * price // 100
+        assert linear_fill(qty, qty, price, budget) == calculate_fill(qty, qty, price, budget)[0]
+
+        linear = min(timeit.repeat(
+            lambda: linear_fill(qty, qty, price, budget), number=args.number, repeat=3
+        )) / args.number
+        arithmetic = min(timeit.repeat(
+            lambda: calculate_fill(qty, qty, price, budget), number=args.number, repeat=3
+        )) / args.number
+        print(f'{qty:>12}{linear * 1e6:>14.2f}{arithmetic * 1e6:>16.3f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--qty', type=int, nargs='+', default=[100, 10_000, 1_000_000])
+    parser.add_argument('--number', type=int, default=10)
+    main(parser.parse_args())
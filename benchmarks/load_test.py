@@ -0,0 +1,357 @@
+"""
+Нагрузочный тест HTTP API биржи.
+
+Создаёт отдельную БД, поднимает приложение из `main.py` через uvicorn
+в отдельном процессе (в отладочном режиме, чтобы ответы несли заголовок
+X-DB-Stats), регистрирует пользователей через `/public/register`, пополняет
+их балансы через `/admin/balance/deposit` и гоняет смесь операций:
+лимитные и рыночные заявки, отмены и чтение стакана.
+
+По каждой операции печатает количество, ошибки, пропускную способность,
+p50/p99 задержки и среднее число SQL-запросов. С `--baseline` сравнивает
+результат с сохранённым прогоном - так тест запускается в CI. Изменение p99
+только печатается: на общих машинах CI задержки слишком шумные, порог
+включается явно через `--latency-tolerance`. С ошибкой тест завершается, если
+выросло число SQL-запросов на операцию или число ошибок.
+
+Запуск (сервер БД берётся из настроек приложения):
+```sh
+pip install -r benchmarks/requirements.txt
+python -m benchmarks.load_test --users 2000 --operations 20000 --concurrency 64
+python -m benchmarks.load_test --json result.json
+python -m benchmarks.load_test --baseline result.json
+```
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from uuid import uuid4
+
+import httpx
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app.core.base import Base
+from app.core.config import DB, settings
+from app.core.enums import UserRole
+from app.jobs.partitions import ensure_partitions
+from app.models import User
+
+OPERATIONS = ('limit', 'market', 'cancel', 'orderbook')
+MID_PRICE = 100
+
+
+@dataclass
+class OperationStats:
+    latencies: list[float] = field(default_factory=list)
+    statements: list[int] = field(default_factory=list)
+    errors: int = 0
+
+    def report(self, elapsed: float) -> dict:
+        latencies = sorted(self.latencies)
+        count = len(latencies)
+        return {
+            'count': count,
+            'errors': self.errors,
+            'throughput': count / elapsed if elapsed else 0.0,
+            'p50_ms': percentile(latencies, 0.50) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+            'statements': sum(self.statements) / len(self.statements) if self.statements else 0.0,
+        }
+
+
+@dataclass
+class Trader:
+    user_id: str
+    api_key: str
+    open_orders: list[str] = field(default_factory=list)
+
+    @property
+    def headers(self) -> dict:
+        return {'Authorization': f'TOKEN {self.api_key}'}
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def parse_mix(mix: str) -> dict[str, float]:
+    weights = {}
+    for item in mix.split(','):
+        name, _, weight = item.partition('=')
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f'unknown operation {name}, expected one of {OPERATIONS}')
+        weights[name] = float(weight)
+    return weights
+
+
+def statements_from(response: httpx.Response) -> int | None:
+    """Количество SQL-запросов из отладочного заголовка X-DB-Stats"""
+    header = response.headers.get('X-DB-Stats')
+    if header is None:
+        return None
+    for part in header.split(';'):
+        key, _, value = part.strip().partition('=')
+        if key == 'count':
+            return int(value)
+    return None
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def prepare_database(db: DB, database: str) -> str:
+    """Создаёт пустую БД со схемой приложения и администратором, возвращает его API-ключ"""
+    admin_engine = create_async_engine(settings.db.url, isolation_level='AUTOCOMMIT')
+    async with admin_engine.connect() as conn:
+        await conn.execute(text(f'DROP DATABASE IF EXISTS {database}'))
+        await conn.execute(text(f'CREATE DATABASE {database}'))
+    await admin_engine.dispose()
+
+    engine = create_async_engine(db.url)
+    api_key = f'key-{uuid4()}'
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(User.__table__.insert().values(
+            id=str(uuid4()), name='load-test-admin', role=UserRole.ADMIN, api_key=api_key, is_deleted=False,
+        ))
+    await ensure_partitions(engine=engine)
+    await engine.dispose()
+    return api_key
+
+
+async def drop_database(database: str) -> None:
+    engine = create_async_engine(settings.db.url, isolation_level='AUTOCOMMIT')
+    async with engine.connect() as conn:
+        await conn.execute(text(f'DROP DATABASE IF EXISTS {database} WITH (FORCE)'))
+    await engine.dispose()
+
+
+def start_server(database: str, port: int, sample_rate: float) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        'DB__NAME': database,
+        'APP__DEBUG': 'true',
+        'LOGGING__SAMPLE_RATE': str(sample_rate),
+    }
+    return subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'main:app', '--port', str(port), '--log-level', 'warning'],
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+
+
+async def wait_ready(client: httpx.AsyncClient, server: subprocess.Popen, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f'server exited with code {server.returncode}')
+        try:
+            await client.get('/metrics')
+            return
+        except httpx.TransportError:
+            await asyncio.sleep(0.2)
+    raise RuntimeError('server did not start in time')
+
+
+async def gather_limited(limit: int, coroutines) -> list:
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(coroutine):
+        async with semaphore:
+            return await coroutine
+
+    return await asyncio.gather(*(run(coroutine) for coroutine in coroutines))
+
+
+async def seed(client: httpx.AsyncClient, admin_key: str, tickers: list[str], users: int,
+               concurrency: int) -> list[Trader]:
+    admin = {'Authorization': f'TOKEN {admin_key}'}
+    for ticker in tickers:
+        response = await client.post('/api/v1/admin/instrument', headers=admin,
+                                     json={'ticker': ticker, 'name': ticker})
+        response.raise_for_status()
+
+    async def register(i: int) -> Trader:
+        response = await client.post('/api/v1/public/register', json={'name': f'trader{i}'})
+        response.raise_for_status()
+        body = response.json()
+        trader = Trader(user_id=body['id'], api_key=body['api_key'])
+        for ticker, amount in (('RUB', 10_000_000), *((ticker, 100_000) for ticker in tickers)):
+            response = await client.post('/api/v1/admin/balance/deposit', headers=admin, json={
+                'user_id': trader.user_id, 'ticker': ticker, 'amount': amount,
+            })
+            response.raise_for_status()
+        return trader
+
+    return await gather_limited(concurrency, (register(i) for i in range(users)))
+
+
+async def run_operation(client: httpx.AsyncClient, name: str, trader: Trader, ticker: str,
+                        rng: random.Random) -> httpx.Response | None:
+    direction = rng.choice(('BUY', 'SELL'))
+    if name == 'limit':
+        response = await client.post('/api/v1/order', headers=trader.headers, json={
+            'direction': direction,
+            'ticker': ticker,
+            'qty': rng.randint(1, 10),
+            'price': MID_PRICE + rng.randint(-5, 5),
+        })
+        if response.status_code == 200:
+            trader.open_orders.append(response.json()['order_id'])
+        return response
+    if name == 'market':
+        return await client.post('/api/v1/order', headers=trader.headers, json={
+            'direction': direction, 'ticker': ticker, 'qty': rng.randint(1, 3),
+        })
+    if name == 'cancel':
+        if not trader.open_orders:
+            return None
+        order_id = trader.open_orders.pop(rng.randrange(len(trader.open_orders)))
+        return await client.delete(f'/api/v1/order/{order_id}', headers=trader.headers)
+    return await client.get(f'/api/v1/public/orderbook/{ticker}')
+
+
+async def drive(client: httpx.AsyncClient, traders: list[Trader], tickers: list[str],
+                weights: dict[str, float], operations: int, concurrency: int,
+                seed_value: int) -> tuple[dict[str, OperationStats], float]:
+    stats: dict[str, OperationStats] = defaultdict(OperationStats)
+    names = list(weights)
+    remaining = operations
+
+    async def worker(worker_id: int) -> None:
+        nonlocal remaining
+        rng = random.Random(seed_value + worker_id)
+        while remaining > 0:
+            remaining -= 1
+            name = rng.choices(names, weights=[weights[n] for n in names])[0]
+            start = time.perf_counter()
+            response = await run_operation(client, name, rng.choice(traders), rng.choice(tickers), rng)
+            if response is None:
+                continue
+            elapsed = time.perf_counter() - start
+            operation = stats[name]
+            operation.latencies.append(elapsed)
+            # Отказ по бизнес-правилу (нет средств, заявка уже исполнена) - ожидаемый ответ
+            if response.status_code >= 500:
+                operation.errors += 1
+            statements = statements_from(response)
+            if statements is not None:
+                operation.statements.append(statements)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    return stats, time.perf_counter() - start
+
+
+def print_report(report: dict) -> None:
+    print(f'{"operation":<12}{"count":>8}{"errors":>8}{"ops/s":>10}{"p50, ms":>10}{"p99, ms":>10}{"SQL/op":>8}')
+    for name, row in report['operations'].items():
+        print(f'{name:<12}{row["count"]:>8}{row["errors"]:>8}{row["throughput"]:>10.1f}'
+              f'{row["p50_ms"]:>10.2f}{row["p99_ms"]:>10.2f}{row["statements"]:>8.2f}')
+    print(f'total: {report["throughput"]:.1f} ops/s in {report["elapsed"]:.1f}s')
+
+
+def print_comparison(report: dict, baseline: dict) -> None:
+    """Изменение p99 относительно сохранённого прогона"""
+    for name, row in report['operations'].items():
+        base = baseline['operations'].get(name)
+        if base is None or not base['p99_ms']:
+            continue
+        change = (row['p99_ms'] / base['p99_ms'] - 1) * 100
+        print(f'{name}: p99 {base["p99_ms"]:.2f}ms -> {row["p99_ms"]:.2f}ms ({change:+.0f}%)')
+
+
+def compare(report: dict, baseline: dict, latency_tolerance: float | None,
+            statements_tolerance: float) -> list[str]:
+    """Регрессии относительно сохранённого прогона; p99 проверяется, только если задан порог"""
+    problems = []
+    for name, row in report['operations'].items():
+        base = baseline['operations'].get(name)
+        if base is None:
+            continue
+        if latency_tolerance is not None and row['p99_ms'] > base['p99_ms'] * (1 + latency_tolerance):
+            problems.append(f'{name}: p99 {row["p99_ms"]:.2f}ms > baseline {base["p99_ms"]:.2f}ms')
+        # Прогон без заголовка X-DB-Stats (старая версия приложения) не даёт базы для сравнения
+        if base['statements'] and row['statements'] > base['statements'] * (1 + statements_tolerance):
+            problems.append(f'{name}: {row["statements"]:.2f} SQL/op > baseline {base["statements"]:.2f}')
+        if row['errors'] > base['errors']:
+            problems.append(f'{name}: {row["errors"]} errors > baseline {base["errors"]}')
+    return problems
+
+
+async def main(args: argparse.Namespace) -> int:
+    db = DB(**{**settings.db.dict(exclude={'url'}), 'name': args.database})
+    admin_key = await prepare_database(db, args.database)
+    port = free_port()
+    server = start_server(args.database, port, args.log_sample_rate)
+    tickers = [f'LT{i}' for i in range(args.tickers)]
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    try:
+        async with httpx.AsyncClient(base_url=f'http://127.0.0.1:{port}', limits=limits, timeout=60) as client:
+            await wait_ready(client, server)
+            start = time.perf_counter()
+            traders = await seed(client, admin_key, tickers, args.users, args.concurrency)
+            print(f'seeded {len(traders)} users in {time.perf_counter() - start:.1f}s')
+
+            stats, elapsed = await drive(client, traders, tickers, args.mix, args.operations,
+                                         args.concurrency, args.seed)
+    finally:
+        server.terminate()
+        server.wait()
+        if not args.keep:
+            await drop_database(args.database)
+
+    report = {
+        'elapsed': elapsed,
+        'throughput': sum(len(s.latencies) for s in stats.values()) / elapsed,
+        'operations': {name: stats[name].report(elapsed) for name in OPERATIONS if name in stats},
+    }
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print_comparison(report, baseline)
+        problems = compare(report, baseline, args.latency_tolerance, args.statements_tolerance)
+        for problem in problems:
+            print(f'REGRESSION {problem}')
+        return 1 if problems else 0
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=2_000)
+    parser.add_argument('--tickers', type=int, default=4)
+    parser.add_argument('--operations', type=int, default=20_000)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--mix', type=parse_mix, default='limit=55,market=15,cancel=15,orderbook=15',
+                        help='веса операций, например limit=55,market=15,cancel=15,orderbook=15')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--database', default='bench_load_test')
+    parser.add_argument('--log-sample-rate', type=float, default=0.0,
+                        help='доля запросов, которые сервер пишет в лог (ошибки пишутся всегда)')
+    parser.add_argument('--json', help='сохранить результат в файл')
+    parser.add_argument('--baseline', help='сравнить с результатом из файла')
+    parser.add_argument('--latency-tolerance', type=float,
+                        help='допустимый рост p99, например 1.0 (по умолчанию p99 не проверяется)')
+    parser.add_argument('--statements-tolerance', type=float, default=0.0)
+    parser.add_argument('--keep', action='store_true', help='не удалять БД после прогона')
+    sys.exit(asyncio.run(main(parser.parse_args())))
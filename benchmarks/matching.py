@@ -0,0 +1,199 @@
+"""
+Воспроизводимый бенчмарк сопоставления заявок без HTTP.
+
+Генерирует поток заявок по зерну (глубина стакана, распределение цен, доля
+рыночных заявок), сначала выставляет заявки, формирующие стакан, затем
+прогоняет замеряемый поток через `order_crud.create_order` (v1) или
+`order_crud_v2` в отдельной схеме БД, по одной транзакции на заявку.
+Печатает заявки в секунду, исполнения в секунду и SQL-запросов на заявку.
+
+Одно и то же зерно даёт один и тот же поток, поэтому замеры до и после
+изменения сравнимы один к одному. Поток можно сохранить в файл и
+воспроизвести на другой версии кода, даже если генератор изменился.
+
+Запуск (БД берётся из настроек приложения):
+```sh
+python -m benchmarks.matching --orders 5000 --depth 500 --seed 7
+python -m benchmarks.matching --crud v2 --save-stream stream.json
+python -m benchmarks.matching --load-stream stream.json
+```
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from dataclasses import asdict, dataclass
+
+from sqlalchemy import func, select, text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from app.core.base import Base
+from app.core.config import settings
+from app.core.query_stats import QueryStats, current_query_stats, instrument_engine
+from app.crud.v1.balance import balance_crud
+from app.crud.v1.order import order_crud, order_crud_v2
+from app.crud.v1.order.order_book import order_books
+from app.crud.v1.user import user_crud
+from app.jobs.partitions import ensure_partitions
+from app.models import Instrument, Transaction
+from app.models.order import Direction
+
+TICKER = 'BENCH'
+
+
+@dataclass(slots=True)
+class OrderSpec:
+    """Одна заявка потока; price=None - рыночная"""
+    user: int
+    direction: str
+    qty: int
+    price: int | None
+
+
+def generate_stream(args: argparse.Namespace) -> tuple[list[OrderSpec], list[OrderSpec]]:
+    """Заявки, формирующие стакан, и замеряемый поток"""
+    rng = random.Random(args.seed)
+
+    def price() -> int:
+        if args.distribution == 'normal':
+            offset = round(rng.gauss(0, args.spread / 2))
+        else:
+            offset = rng.randint(-args.spread, args.spread)
+        return max(1, args.mid + offset)
+
+    def order(market: bool) -> OrderSpec:
+        return OrderSpec(
+            user=rng.randrange(args.users),
+            direction=rng.choice(('BUY', 'SELL')),
+            qty=rng.randint(1, args.max_qty),
+            price=None if market else price(),
+        )
+
+    # Стакан без пересечений: покупки ниже середины, продажи выше
+    book = []
+    for _ in range(args.depth):
+        spec = order(market=False)
+        offset = 1 + abs(spec.price - args.mid)
+        spec.price = max(1, args.mid - offset) if spec.direction == 'BUY' else args.mid + offset
+        book.append(spec)
+    stream = [order(market=rng.random() < args.market_ratio) for _ in range(args.orders)]
+    return book, stream
+
+
+async def seed_users(session: AsyncSession, users: int, balance: int) -> list[str]:
+    session.add_all([Instrument(ticker=ticker, name=ticker) for ticker in ('RUB', TICKER)])
+    await session.flush()
+    user_ids = []
+    for i in range(users):
+        user = await user_crud.add_user(f'bench{i}', session)
+        user_ids.append(user.id)
+        await balance_crud.deposit(user.id, 'RUB', balance * 1000, async_session=session)
+        await balance_crud.deposit(user.id, TICKER, balance, async_session=session)
+    await session.commit()
+    return user_ids
+
+
+async def place(spec: OrderSpec, user_id: str, crud: str, session: AsyncSession) -> None:
+    direction = Direction(spec.direction)
+    if crud == 'v1':
+        await order_crud.create_order(user_id=user_id, direction=direction, ticker=TICKER,
+                                      qty=spec.qty, price=spec.price, session=session)
+        return
+    method = {
+        (Direction.BUY, False): order_crud_v2.buy_limit,
+        (Direction.BUY, True): order_crud_v2.buy_market,
+        (Direction.SELL, False): order_crud_v2.sell_limit,
+        (Direction.SELL, True): order_crud_v2.sell_market,
+    }[direction, spec.price is None]
+    kwargs = {} if spec.price is None else {'price': spec.price}
+    await method(user_id=user_id, ticker=TICKER, qty=spec.qty, session=session, **kwargs)
+
+
+async def replay(session_factory: async_sessionmaker, stream: list[OrderSpec], user_ids: list[str],
+                 crud: str) -> int:
+    """Выставляет заявки по одной транзакции на заявку, возвращает число отказов"""
+    rejected = 0
+    for spec in stream:
+        async with session_factory() as session:
+            try:
+                await place(spec, user_ids[spec.user], crud, session)
+                await session.commit()
+            except ValueError:
+                # Отказ по бизнес-правилу (не хватило средств) - часть потока
+                await session.rollback()
+                rejected += 1
+    return rejected
+
+
+async def count_fills(session_factory: async_sessionmaker) -> int:
+    async with session_factory() as session:
+        return (await session.execute(select(func.count()).select_from(Transaction))).scalar_one()
+
+
+async def main(args: argparse.Namespace) -> None:
+    if args.load_stream:
+        with open(args.load_stream) as f:
+            data = json.load(f)
+        book = [OrderSpec(**spec) for spec in data['book']]
+        stream = [OrderSpec(**spec) for spec in data['stream']]
+        users = data['users']
+    else:
+        book, stream = generate_stream(args)
+        users = args.users
+    if args.save_stream:
+        with open(args.save_stream, 'w') as f:
+            json.dump({'users': users, 'book': [asdict(s) for s in book],
+                       'stream': [asdict(s) for s in stream]}, f)
+
+    engine = create_async_engine(settings.db.url, connect_args={'server_settings': {'search_path': args.schema}})
+    instrument_engine(engine)
+    async with engine.begin() as conn:
+        await conn.execute(text(f'CREATE SCHEMA {args.schema}'))
+        await conn.run_sync(Base.metadata.create_all)
+    await ensure_partitions(engine=engine)
+
+    session_factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    try:
+        async with session_factory() as session:
+            user_ids = await seed_users(session, users, args.balance)
+        await replay(session_factory, book, user_ids, args.crud)
+        fills_before = await count_fills(session_factory)
+
+        stats = QueryStats(request_id='matching-benchmark')
+        token = current_query_stats.set(stats)
+        start = time.perf_counter()
+        rejected = await replay(session_factory, stream, user_ids, args.crud)
+        elapsed = time.perf_counter() - start
+        current_query_stats.reset(token)
+        fills = await count_fills(session_factory) - fills_before
+
+        print(f'crud: {args.crud}, book: {len(book)}, orders: {len(stream)}, rejected: {rejected}')
+        print(f'elapsed: {elapsed:.2f}s')
+        print(f'throughput: {len(stream) / elapsed:.0f} orders/s, {fills / elapsed:.0f} fills/s')
+        print(f'statements per order: {stats.count / len(stream):.2f}, '
+              f'DB time per order: {stats.total / len(stream) * 1000:.3f}ms')
+    finally:
+        order_books.invalidate(TICKER)
+        async with engine.begin() as conn:
+            await conn.execute(text(f'DROP SCHEMA {args.schema} CASCADE'))
+        await engine.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--crud', choices=('v1', 'v2'), default='v1')
+    parser.add_argument('--orders', type=int, default=5_000, help='размер замеряемого потока')
+    parser.add_argument('--depth', type=int, default=500, help='заявок в стакане до замера')
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--balance', type=int, default=1_000_000, help='тикеров у каждого пользователя')
+    parser.add_argument('--mid', type=int, default=1_000)
+    parser.add_argument('--spread', type=int, default=20, help='разброс цен вокруг середины')
+    parser.add_argument('--distribution', choices=('uniform', 'normal'), default='normal')
+    parser.add_argument('--market-ratio', type=float, default=0.2)
+    parser.add_argument('--max-qty', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--save-stream', help='сохранить сгенерированный поток в файл')
+    parser.add_argument('--load-stream', help='воспроизвести поток из файла')
+    parser.add_argument('--schema', default='bench_matching')
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,79 @@
+"""
+Стоимость трассировки сопоставления в пересчёте на одно исполнение.
+
+Сопоставляет в стакане в памяти входящую заявку, которая съедает все встречные
+заявки, и на каждое исполнение пишет трассировку так же, как `_match_orders`.
+Сравниваются: канал трассировки выключен, канал включён и прежний вариант
+с f-строкой, собираемой до проверки уровня. Записи создаются, но никуда не
+пишутся, чтобы мерить только стоимость на стороне вызывающего кода.
+
+Запуск:
+```sh
+python -m benchmarks.matching_trace --fills 200 --rounds 200
+```
+"""
+import argparse
+import logging
+import time
+
+from app.core.logs import app_logger, matching_logger
+from app.crud.v1.order.order_book import OrderBook
+from app.models.order import Direction
+
+
+def build_book(fills: int) -> OrderBook:
+    book = OrderBook('BENCH')
+    for i in range(fills):
+        book.add(f'order-{i}', f'user-{i % 10}', Direction.SELL, price=100 + i % 20, qty=5)
+    return book
+
+
+def trace_lazy(fill) -> None:
+    matching_logger.debug("fill order %s: qty=%s price=%s filled=%s/%s",
+                          fill.order_id, fill.qty, fill.price, fill.filled, fill.order_qty)
+
+
+def trace_eager(fill) -> None:
+    # Так трассировка выглядела раньше: строка собирается всегда, даже если запись отсекается
+    matching_logger.debug(f"try fill order:{fill.__dict__ if hasattr(fill, '__dict__') else repr(fill)}")
+
+
+def run(fills: int, rounds: int, trace) -> float:
+    elapsed = 0.0
+    for _ in range(rounds):
+        book = build_book(fills)
+        start = time.perf_counter()
+        for fill in book.match(Direction.BUY, fills * 5, user_id='taker'):
+            if trace is not None:
+                trace(fill)
+        elapsed += time.perf_counter() - start
+    return elapsed / (rounds * fills)
+
+
+def main(args: argparse.Namespace) -> None:
+    handlers = app_logger.handlers[:]
+    app_logger.handlers = [logging.NullHandler()]
+    level = matching_logger.level
+    try:
+        results = {}
+        matching_logger.setLevel(logging.INFO)
+        results['no tracing'] = run(args.fills, args.rounds, None)
+        results['tracing off (lazy)'] = run(args.fills, args.rounds, trace_lazy)
+        results['tracing off (f-string)'] = run(args.fills, args.rounds, trace_eager)
+        matching_logger.setLevel(logging.DEBUG)
+        results['tracing on'] = run(args.fills, args.rounds, trace_lazy)
+
+        baseline = results['no tracing']
+        print(f'{"variant":<26}{"per fill, us":>14}{"overhead, us":>15}')
+        for name, per_fill in results.items():
+            print(f'{name:<26}{per_fill * 1e6:>14.3f}{(per_fill - baseline) * 1e6:>15.3f}')
+    finally:
+        matching_logger.setLevel(level)
+        app_logger.handlers = handlers
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--fills', type=int, default=200)
+    parser.add_argument('--rounds', type=int, default=200)
+    main(parser.parse_args())
@@ -0,0 +1,127 @@
+"""
+Накладные расходы логирующего middleware на один запрос.
+
+Гоняет ASGI-приложение напрямую, без сети и сервера: без middleware, с прежним
+`BaseHTTPMiddleware`-вариантом (копия ниже) и с текущим `RequestLoggerMiddleware`.
+Записи лога создаются и форматируются как обычно, но никуда не пишутся.
+
+Запуск:
+```sh
+python -m benchmarks.middleware_overhead --requests 5000
+```
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+
+from fastapi import FastAPI, Request, Response
+from fastapi.routing import APIRoute
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from app.core.logs import app_logger
+from app.core.middlewares import RequestLoggerMiddleware, format_log, generate_request_id
+
+
+class LegacyRequestLoggerMiddleware(BaseHTTPMiddleware):
+    """Прежняя реализация: буферизует тело ответа и ищет маршрут перебором"""
+
+    async def dispatch(self, request: Request, call_next) -> Response:
+        req_id = generate_request_id(request.headers)
+        route = next((r for r in request.app.routes
+                      if isinstance(r, APIRoute) and r.path == request.url.path), None)
+        skip_logging = bool(route and getattr(route.endpoint, "_no_log", False))
+        start = time.time()
+        raw_body = await request.body()
+        try:
+            body_json = json.loads(raw_body.decode())
+        except Exception:
+            body_json = None
+        formatted_body = json.dumps(body_json) if body_json else "<non-JSON body>"
+        if not skip_logging:
+            app_logger.info(format_log(f"Started {request.method} {request.url}", req_id))
+            app_logger.info(format_log(f"Body: {formatted_body}", req_id))
+        response = await call_next(request)
+        response_body = b""
+        async for chunk in response.body_iterator:
+            response_body += chunk
+        new_response = Response(content=response_body, status_code=response.status_code,
+                                headers=dict(response.headers), media_type=response.media_type)
+        if not skip_logging:
+            app_logger.info(format_log(f"Completed with status {response.status_code}", req_id))
+            app_logger.info(format_log(f"Response: {response_body.decode(errors='ignore')}", req_id))
+            app_logger.info(format_log(f"Duration: {time.time() - start:.4f}s", req_id))
+        return new_response
+
+
+def build_app(middleware: type | None, routes: int, **options) -> FastAPI:
+    app = FastAPI()
+    if middleware is not None:
+        app.add_middleware(middleware, **options)
+
+    # Маршруты, среди которых прежняя реализация искала нужный перебором
+    for i in range(routes):
+        app.add_api_route(f'/api/v1/filler/{i}', lambda: {}, methods=['GET'])
+
+    @app.post('/api/v1/order')
+    async def create_order(body: dict) -> dict:
+        return {'success': True, 'order_id': '35b0884d-9a1d-47b0-91c7-eecf0ca56bc8'}
+
+    return app
+
+
+async def call(app, body: bytes) -> None:
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+        'method': 'POST', 'scheme': 'http', 'path': '/api/v1/order', 'raw_path': b'/api/v1/order',
+        'query_string': b'', 'root_path': '', 'server': ('test', 80), 'client': ('test', 1),
+        'headers': [(b'content-type', b'application/json'),
+                    (b'content-length', str(len(body)).encode())],
+    }
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+
+    async def receive():
+        return messages.pop() if messages else {'type': 'http.disconnect'}
+
+    async def send(message):
+        pass
+
+    await app(scope, receive, send)
+
+
+async def measure(app, requests: int, body: bytes) -> float:
+    for _ in range(100):
+        await call(app, body)
+    start = time.perf_counter()
+    for _ in range(requests):
+        await call(app, body)
+    return (time.perf_counter() - start) / requests
+
+
+async def main(args: argparse.Namespace) -> None:
+    # Записи лога создаются и форматируются, но не пишутся на диск и в консоль
+    handlers = app_logger.handlers[:]
+    app_logger.handlers = [logging.NullHandler()]
+    body = json.dumps({'direction': 'BUY', 'ticker': 'MEMCOIN', 'qty': 10, 'price': 100}).encode()
+    try:
+        baseline = await measure(build_app(None, args.routes), args.requests, body)
+        variants = {
+            'BaseHTTPMiddleware (before)': build_app(LegacyRequestLoggerMiddleware, args.routes),
+            'pure ASGI (after)': build_app(RequestLoggerMiddleware, args.routes),
+            'pure ASGI, sample 10%': build_app(RequestLoggerMiddleware, args.routes, sample_rate=0.1),
+        }
+        print(f'{"variant":<30}{"per request, us":>18}{"overhead, us":>15}')
+        print(f'{"no middleware":<30}{baseline * 1e6:>18.1f}{0:>15.1f}')
+        for name, app in variants.items():
+            elapsed = await measure(app, args.requests, body)
+            print(f'{name:<30}{elapsed * 1e6:>18.1f}{(elapsed - baseline) * 1e6:>15.1f}')
+    finally:
+        app_logger.handlers = handlers
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=5_000)
+    parser.add_argument('--routes', type=int, default=30)
+    asyncio.run(main(parser.parse_args()))
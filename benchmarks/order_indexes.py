@@ -0,0 +1,175 @@
+"""
+Бенчмарк индексов таблицы заявок.
+
+Наполняет отдельную схему БД историческими заявками (по умолчанию 1 млн,
+большая часть исполнена или отменена), снимает планы и время основных
+запросов к стакану без индексов, затем строит индексы из модели `Order`
+и повторяет замеры.
+
+Всё выполняется в одной транзакции, которая в конце откатывается.
+Запуск (БД берётся из настроек приложения):
+```sh
+python -m benchmarks.order_indexes --orders 1000000 --tickers 20
+```
+"""
+import argparse
+import asyncio
+import time
+
+from sqlalchemy import and_, asc, desc, select, text, tuple_
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncConnection, create_async_engine
+
+from app.core.base import Base
+from app.core.config import settings
+from app.models import Order
+from app.models.order import Direction, Status
+
+ACTIVE = [Status.NEW, Status.PARTIALLY_EXECUTED]
+
+
+def build_queries(ticker: str, user_id: str) -> dict:
+    """Запросы в том виде, в каком их выполняют CRUD-классы заявок"""
+    return {
+        'load orderbook': select(
+            Order.id, Order.user_id, Order.direction, Order.price, Order.qty, Order.filled
+        ).where(
+            Order.ticker == ticker,
+            Order.status.in_(ACTIVE),
+            Order.price.isnot(None),
+        ).order_by(Order.created_at, Order.id),
+        'match sell orders by price': select(Order).where(
+            and_(
+                Order.ticker == ticker,
+                Order.direction == Direction.SELL,
+                Order.status.in_(ACTIVE),
+                Order.price <= 150,
+                Order.user_id != user_id,
+            )
+        ).order_by(asc(Order.price), asc(Order.created_at)),
+        'orderbook bids': select(
+            Order.price, Order.qty, Order.filled, Order.id, Order.status
+        ).where(
+            Order.ticker == ticker,
+            Order.direction == Direction.BUY,
+            Order.status.in_(ACTIVE),
+            Order.price.isnot(None),
+            Order.filled < Order.qty,
+            Order.user_id != user_id,
+        ),
+        'user orders': select(Order).where(
+            Order.user_id == user_id
+        ).order_by(desc(Order.created_at), desc(Order.id)).limit(100),
+        'all orders, page 100 by offset': select(Order).order_by(
+            desc(Order.created_at), desc(Order.id)
+        ).limit(100).offset(9_900),
+        'all orders, page 100 by cursor': select(Order).where(
+            tuple_(Order.created_at, Order.id) < tuple_(text("now() - interval '30 days'"), '')
+        ).order_by(desc(Order.created_at), desc(Order.id)).limit(100),
+    }
+
+
+def compile_query(query) -> str:
+    return str(query.compile(
+        dialect=postgresql.dialect(), compile_kwargs={'literal_binds': True}
+    ))
+
+
+async def seed(conn: AsyncConnection, orders: int, tickers: int, users: int,
+               active_ratio: float) -> None:
+    await conn.run_sync(Base.metadata.create_all)
+    await conn.execute(text(
+        "INSERT INTO instrument (ticker, name) "
+        "SELECT 'T' || g, 'Ticker ' || g FROM generate_series(1, :n) g"
+    ), {'n': tickers})
+    await conn.execute(text(
+        "INSERT INTO \"user\" (id, name, role, is_deleted, api_key) "
+        "SELECT md5(g::text)::uuid, 'user' || g, 'USER'::userrole, false, 'key-' || g "
+        "FROM generate_series(1, :n) g"
+    ), {'n': users})
+    await conn.execute(text(
+        """
+        INSERT INTO "order" (id, status, user_id, direction, ticker, qty, price, filled, created_at)
+        SELECT gen_random_uuid()::text,
+               CASE WHEN r < :active THEN
+                        (CASE WHEN g % 2 = 0 THEN 'NEW' ELSE 'PARTIALLY_EXECUTED' END)::status
+                    ELSE (CASE WHEN g % 3 = 0 THEN 'CANCELLED' ELSE 'EXECUTED' END)::status
+               END,
+               md5((1 + g % :users)::text)::uuid,
+               (CASE WHEN g % 2 = 0 THEN 'BUY' ELSE 'SELL' END)::direction,
+               'T' || (1 + g % :tickers),
+               10,
+               50 + (g * 7919) % 200,
+               CASE WHEN r < :active THEN g % 5 ELSE 10 END,
+               now() - (g % 31536000) * interval '1 second'
+        FROM (SELECT g, random() AS r FROM generate_series(1, :orders) g) s
+        """
+    ), {'active': active_ratio, 'users': users, 'tickers': tickers, 'orders': orders})
+    await conn.execute(text('ANALYZE'))
+
+
+async def measure(conn: AsyncConnection, queries: dict, repeats: int) -> dict:
+    timings = {}
+    for name, query in queries.items():
+        sql = compile_query(query)
+        plan = (await conn.execute(text(f'EXPLAIN (ANALYZE, BUFFERS) {sql}'))).scalars().all()
+        durations = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            await conn.execute(text(sql))
+            durations.append(time.perf_counter() - start)
+        durations.sort()
+        timings[name] = durations[len(durations) // 2]
+        print(f'--- {name}: median {timings[name] * 1000:.2f} ms')
+        print('\n'.join(plan))
+    return timings
+
+
+async def main(args: argparse.Namespace) -> None:
+    engine = create_async_engine(settings.db.url)
+    async with engine.connect() as conn:
+        await conn.execute(text(f'CREATE SCHEMA {args.schema}'))
+        await conn.execute(text(f'SET LOCAL search_path TO {args.schema}'))
+
+        start = time.perf_counter()
+        await seed(conn, args.orders, args.tickers, args.users, args.active_ratio)
+        print(f'seeded {args.orders} orders in {time.perf_counter() - start:.1f}s')
+
+        user_id = (await conn.execute(text("SELECT md5('1')::uuid::text"))).scalar_one()
+        queries = build_queries('T1', user_id)
+        indexes = sorted(Order.__table__.indexes, key=lambda index: index.name)
+
+        # create_all построил индексы из модели - снимаем их для исходных замеров
+        for index in indexes:
+            await conn.run_sync(index.drop)
+        await conn.execute(text('ANALYZE'))
+        print('=== without indexes')
+        before = await measure(conn, queries, args.repeats)
+
+        for index in indexes:
+            await conn.run_sync(index.create)
+        await conn.execute(text('ANALYZE'))
+        print('=== with indexes')
+        after = await measure(conn, queries, args.repeats)
+
+        print(f'{"query":<30}{"before, ms":>12}{"after, ms":>12}')
+        for name in queries:
+            print(f'{name:<30}{before[name] * 1000:>12.2f}{after[name] * 1000:>12.2f}')
+
+        if args.keep:
+            await conn.commit()
+        else:
+            await conn.rollback()
+    await engine.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--orders', type=int, default=1_000_000)
+    parser.add_argument('--tickers', type=int, default=20)
+    parser.add_argument('--users', type=int, default=1_000)
+    parser.add_argument('--active-ratio', type=float, default=0.03)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--schema', default='bench_order_indexes')
+    parser.add_argument('--keep', action='store_true', help='зафиксировать схему с данными')
+    asyncio.run(main(parser.parse_args()))
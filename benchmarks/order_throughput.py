@@ -0,0 +1,107 @@
+"""
+Пропускная способность выставления заявок.
+
+Создаёт отдельную схему БД, заводит пользователей с балансами и прогоняет
+через очередь тикера встречные лимитные заявки так, что каждая вторая
+исполняется против стакана. Печатает заявки в секунду и количество
+COMMIT на одну заявку (при одной транзакции на заявку - ровно 1).
+
+Запуск (БД берётся из настроек приложения):
+```sh
+python -m benchmarks.order_throughput --orders 5000 --tickers 4
+```
+"""
+import argparse
+import asyncio
+import time
+
+from sqlalchemy import event, text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from app.core.base import Base
+from app.core.config import settings
+from app.crud.v1.balance import balance_crud
+from app.crud.v1.order import order_crud
+from app.crud.v1.order.sequencer import OrderSequencer
+from app.crud.v1.user import user_crud
+from app.jobs.partitions import ensure_partitions
+from app.models import Instrument
+from app.models.order import Direction
+
+PRICE = 100
+
+
+async def seed(session: AsyncSession, tickers: list[str], users: int, qty: int) -> list[str]:
+    session.add_all([Instrument(ticker=ticker, name=ticker) for ticker in ['RUB', *tickers]])
+    await session.flush()
+
+    user_ids = []
+    for i in range(users):
+        user = await user_crud.add_user(f'bench{i}', session)
+        user_ids.append(user.id)
+        await balance_crud.deposit(user.id, 'RUB', qty * PRICE, async_session=session)
+        for ticker in tickers:
+            await balance_crud.deposit(user.id, ticker, qty, async_session=session)
+    await session.commit()
+    return user_ids
+
+
+async def place(sequencer: OrderSequencer, ticker: str, user_ids: list[str], orders: int) -> None:
+    for i in range(orders):
+        # Продажа от одного пользователя и встречная покупка от другого по той же цене
+        direction = Direction.SELL if i % 2 == 0 else Direction.BUY
+        user_id = user_ids[(i // 2 + i % 2) % len(user_ids)]
+        await sequencer.submit(ticker, lambda session, d=direction, u=user_id: order_crud.create_order(
+            user_id=u, direction=d, ticker=ticker, qty=1, price=PRICE, session=session
+        ))
+
+
+async def main(args: argparse.Namespace) -> None:
+    engine = create_async_engine(
+        settings.db.url,
+        pool_size=args.tickers + 1,
+        connect_args={'server_settings': {'search_path': args.schema}},
+    )
+    commits = 0
+
+    @event.listens_for(engine.sync_engine, 'commit')
+    def count_commit(conn):
+        nonlocal commits
+        commits += 1
+
+    async with engine.begin() as conn:
+        await conn.execute(text(f'CREATE SCHEMA {args.schema}'))
+        await conn.run_sync(Base.metadata.create_all)
+    await ensure_partitions(engine=engine)
+
+    session_factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    sequencer = OrderSequencer(session_factory=session_factory)
+    tickers = [f'T{i}' for i in range(args.tickers)]
+    try:
+        async with session_factory() as session:
+            user_ids = await seed(session, tickers, args.users, args.orders)
+
+        per_ticker = args.orders // args.tickers
+        commits = 0
+        start = time.perf_counter()
+        await asyncio.gather(*(place(sequencer, ticker, user_ids, per_ticker) for ticker in tickers))
+        elapsed = time.perf_counter() - start
+        await sequencer.shutdown()
+
+        total = per_ticker * args.tickers
+        print(f'orders: {total}, tickers: {args.tickers}, elapsed: {elapsed:.2f}s')
+        print(f'throughput: {total / elapsed:.0f} orders/s')
+        print(f'commits per order: {commits / total:.2f}')
+    finally:
+        async with engine.begin() as conn:
+            await conn.execute(text(f'DROP SCHEMA {args.schema} CASCADE'))
+        await engine.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--orders', type=int, default=5_000)
+    parser.add_argument('--tickers', type=int, default=4)
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--schema', default='bench_order_throughput')
+    asyncio.run(main(parser.parse_args()))
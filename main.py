@@ -1,9 +1,18 @@
+import asyncio
+
 import uvicorn
 from fastapi import FastAPI
 from fastapi.responses import ORJSONResponse
 
+from app.api.metrics import router as metrics_router
 from app.api.v1 import router as root_router
-from app.core.middlewares import add_cors_middleware, RequestLoggerMiddleware
+from app.core.db import AsyncSessionLocal
+from app.core.logs import app_logger
+from app.core.middlewares import add_cors_middleware, MetricsMiddleware, RequestLoggerMiddleware
+from app.crud.v1.order import order_sequencer
+from app.crud.v1.order.order_book import order_books
+from app.jobs.orders import maintain_orders
+from app.jobs.partitions import maintain_partitions
 
 app = FastAPI(
     title="Mini Exchange",
@@ -14,9 +23,36 @@ app = FastAPI(
 
 # middlewares
 app.add_middleware(RequestLoggerMiddleware)
+app.add_middleware(MetricsMiddleware)
 add_cors_middleware(app)
 
 app.include_router(root_router)
+app.include_router(metrics_router)
+
+background_tasks: set[asyncio.Task] = set()
+
+
+@app.on_event("startup")
+async def startup() -> None:
+    # Прогреваем стаканы; при ошибке они поднимутся лениво при первом запросе
+    try:
+        async with AsyncSessionLocal() as session:
+            await order_books.warm_up(session)
+    except Exception as e:
+        app_logger.error(f"Can't warm up orderbooks: {e}")
+    # Секции таблицы сделок создаются заранее, иначе запись сделок нового месяца упадёт
+    background_tasks.add(asyncio.create_task(maintain_partitions()))
+    # Завершённые заявки уходят в историю, таблица order остаётся размером со стакан
+    background_tasks.add(asyncio.create_task(maintain_orders()))
+
+
+@app.on_event("shutdown")
+async def shutdown() -> None:
+    for task in background_tasks:
+        task.cancel()
+    # Дожидаемся заявок, уже принятых в очереди тикеров
+    await order_sequencer.shutdown()
+
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,28 @@
+from hypothesis import given, strategies as st
+
+from app.crud.v1.order.fill_calculator import calculate_fill
+from benchmarks.fill_calculator import linear_fill
+
+quantities = st.integers(min_value=0, max_value=10_000)
+prices = st.integers(min_value=1, max_value=10_000)
+budgets = st.integers(min_value=0, max_value=10**8)
+
+
+@given(available=quantities, wanted=quantities, price=prices, budget=budgets)
+def test_matches_linear_fill(available, wanted, price, budget):
+    qty, cost = calculate_fill(available, wanted, price, budget)
+    assert qty == linear_fill(available, wanted, price, budget)
+    assert cost == qty * price
+
+
+@given(available=quantities, wanted=quantities, price=prices, budget=st.none() | budgets)
+def test_fill_is_within_bounds_and_maximal(available, wanted, price, budget):
+    qty, cost = calculate_fill(available, wanted, price, budget)
+    assert 0 <= qty <= min(available, wanted)
+    assert cost == qty * price
+    if budget is not None:
+        assert cost <= budget
+
+    # Ещё одна единица нарушила бы одно из ограничений
+    more = qty + 1
+    assert more > available or more > wanted or (budget is not None and more * price > budget)